@@ -1,65 +1,60 @@
+import warnings
 import abjad
+import numpy as np
+from fractions import Fraction
 from typing import Sequence
-from scamp import TempoEnvelope
-from importlib import resources
+from clockblocks import TempoEnvelope
+from itertools import accumulate
+from .timing import get_bar_times, beats_to_ticks, TICKS_PER_QUARTER, TICKS_PER_16TH
+from .instrumentation import count, span, traced
+from .lilypond_text import (layout_block_text, paper_block_text, respace_text, per_staff_timing_text,
+                            format_timestamp, get_tempo_annotation_plan, get_annotation_time_points,
+                            get_tempo_skip_layout, measure_dur_to_time_sig, get_abjad_ily_path,
+                            get_tempo_annotation_key_points)
 
 # ----------------------------- Abjad Utilities ---------------------------------
 
-abjad_ily_path = resources.files('abjad.scm') / 'abjad.ily'
+# This module imports abjad, so the rest of the package only imports it when a score is actually built with abjad.
 
-layout_block_text = r"""
-\context {{
-    \Score
-     proportionalNotationDuration = #(ly:make-moment {pdur_numerator}/{pdur_denominator})
-}}
-"""
+__all__ = [
+    "create_blank_score", "create_polymetric_score", "create_blank_lilypond_file", "get_abjad_tempo_voice",
+    "create_tempo_skip_voice", "format_lilypond_file",
+    # these used to be defined here, and are still importable from here for existing scripts (they now live in
+    # lilypond_text)
+    "get_tempo_annotation_key_points", "measure_dur_to_time_sig",
+]
 
-paper_block_text = r"""
-#(set-paper-size '(cons (* {width} in) (* {height} in)))
-ragged-right = ##t
-indent = #0
-"""
 
-respace_text = r"""
-\newSpacingSection
-\override Score.SpacingSpanner.spacing-increment = #{spacing}
-"""
+def __getattr__(name):
+    # abjad_ily_path used to be resolved at import time; it is now looked up on first use
+    if name == "abjad_ily_path":
+        return get_abjad_ily_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# the left tweaks don't start with a "-" because this is inserted by abjad
-tempo_spanner_tweaks_left = r"""\tweak bound-details.left.text \markup \small {{\note {{ {note_type} }} #1 "= {tempo}"}} 
-- \tweak bound-details.left-broken.text ##f"""
 
-tempo_spanner_tweaks_left_parenthesized = r"""\tweak bound-details.left.text \markup \small {{"(" \note {{ {note_type} }} #1 "= {tempo})"}} 
-- \tweak bound-details.left-broken.text ##f"""
-
-# this is just concatenated to the left tweak, so does start with a "-"
-tempo_spanner_tweaks_right_parenthesized = r"""- \tweak bound-details.right.text \markup \small {{"(" \note {{ {note_type} }} #1 "= {tempo})"}} 
-- \tweak bound-details.right-broken.text ##f"""
-
-tempo_spanner_padding_tweak = r"""- \tweak bound-details.right.padding #{}"""
-
-tempo_markup = r"""\markup \small {{\note {{ {note_type} }} #1 "= {tempo}"}}"""
-
-parenthesized_tempo_markup = r"""\markup \small {{ "(" \note {{ {note_type} }} #1 "= {tempo})"}}"""
-
-
-def create_blank_score(measure_durs: Sequence[int], measure_times: Sequence[float],
-                       tempo_envelope: TempoEnvelope) -> abjad.Score:
+@traced("create_blank_score")
+def create_blank_score(measure_durs: Sequence[int], measure_times: Sequence[float] | None,
+                       tempo_envelope: TempoEnvelope, merge_tempo_skips: bool = False) -> abjad.Score:
     """
     Create a blank score with the given list of measure durations.
     
     :param measure_durs: A list of measure durations in 16th notes
-    :param measure_times: A corresponding list of measure durations in seconds (to account for tempo)
+    :param measure_times: A corresponding list of measure durations in seconds (to account for tempo). If None,
+        these are calculated from the tempo envelope.
     :param tempo_envelope: A tempo envelope
+    :param merge_tempo_skips: If True, the tempo voice merges runs of unannotated skips into single skips
     :return: An Abjad Score object containing measures with the specified time signatures.
     """
+    count("bars_processed", len(measure_durs))
     score = abjad.Score()
     staff = abjad.Staff()
+
+    if measure_times is None:
+        _, measure_times = get_bar_times(list(accumulate([0] + list(measure_durs))), tempo_envelope)
     
     time_signatures = [measure_dur_to_time_sig(dur) for dur in measure_durs]
     seconds_per_sixteenth = [t / dur for dur, t in zip(measure_durs, measure_times)]
     
-    accumulated_beat = 0.0
     accumulated_time = 0.0
     for md, ts, sps, t in zip(measure_durs, time_signatures, seconds_per_sixteenth, measure_times):
         time_signature = abjad.TimeSignature(ts)
@@ -80,17 +75,12 @@ def create_blank_score(measure_durs: Sequence[int], measure_times: Sequence[floa
         abjad.attach(time_signature, measure[0])
         
         staff.append(measure)
-        accumulated_beat += md
         accumulated_time += t  # Accumulate time for next measure
 
-    tempo_voice = get_abjad_tempo_voice(tempo_envelope.scale_horizontal(0.25))
+    # the tempo voice is planned in ticks, straight from the envelope in 16ths
+    tempo_voice = get_abjad_tempo_voice(tempo_envelope, merge_skips=merge_tempo_skips, ticks_per_beat=TICKS_PER_16TH)
     tempo_staff = abjad.Staff([tempo_voice], name="TempoStaff")
-    tempo_staff.remove_commands.extend([
-        "Staff_symbol_engraver",  # Removes the actual staff lines
-        "Clef_engraver",  # Removes the clef
-        "Time_signature_engraver",  # Removes time signature
-        "Bar_line_engraver"  # Removes bar lines
-    ])
+    _hide_staff(tempo_staff)
     abjad.override(tempo_staff).TextSpanner.Y_offset = -4
     abjad.override(tempo_staff).TextScript.Y_offset = -4
 
@@ -100,15 +90,92 @@ def create_blank_score(measure_durs: Sequence[int], measure_times: Sequence[floa
     return score
 
 
+def _hide_staff(staff: abjad.Staff) -> None:
+    # leaves just what is attached to the staff's leaves (tempo marks, timestamps)
+    staff.remove_commands.extend([
+        "Staff_symbol_engraver",  # Removes the actual staff lines
+        "Clef_engraver",  # Removes the clef
+        "Time_signature_engraver",  # Removes time signature
+        "Bar_line_engraver"  # Removes bar lines
+    ])
+
+
+@traced("create_polymetric_score")
+def create_polymetric_score(layer_measure_durs: Sequence[Sequence[int]],
+                            layer_measure_times: Sequence[Sequence[float]], layer_names: Sequence[str] = None,
+                            timestamp_interval: float = 10, time_resolution: int = 1000) -> abjad.Score:
+    """
+    Create a blank score with one staff per layer of a polymetric texture, above a shared line of timestamps.
+
+    Each layer keeps its own bars and time signatures, but all of them are written on a common timebase in which a
+    quarter note lasts one second, so that bars line up by when they sound rather than by their notated
+    durations. The score needs per-staff timekeeping (see create_blank_lilypond_file).
+
+    :param layer_measure_durs: for each layer, a list of measure durations in 16th notes
+    :param layer_measure_times: for each layer, the corresponding list of measure durations in seconds
+    :param layer_names: optional name to print at the start of each layer's staff
+    :param timestamp_interval: how often (in seconds) to mark the time in the timestamp line
+    :param time_resolution: bar lines are placed to the nearest 1 / time_resolution of a second
+    :return: An Abjad Score with a staff per layer, followed by the timestamp line
+    """
+    score = abjad.Score()
+    end_time = 0
+    for i, (measure_durs, measure_times) in enumerate(zip(layer_measure_durs, layer_measure_times)):
+        count("bars_processed", len(measure_durs))
+        # bar lines are rounded to the grid from their (accumulated) times, so that rounding doesn't build up
+        bar_line_steps = np.rint(np.concatenate(([0], np.cumsum(measure_times))) * time_resolution).astype(np.int64)
+        end_time = max(end_time, Fraction(int(bar_line_steps[-1]), time_resolution))
+        measures = []
+        for md, steps in zip(measure_durs, np.diff(bar_line_steps).tolist()):
+            numerator, denominator = measure_dur_to_time_sig(md)
+            seconds = Fraction(steps, time_resolution)
+            skip = abjad.Skip(abjad.Duration(1, 4), multiplier=(seconds.numerator, seconds.denominator))
+            # a bar lasts as many quarter notes as seconds, whatever its time signature says
+            measure_length = seconds / 4
+            abjad.attach(abjad.LilyPondLiteral([
+                rf"\time {numerator}/{denominator}",
+                rf"\set Timing.measureLength = #(ly:make-moment "
+                rf"{measure_length.numerator}/{measure_length.denominator})",
+            ]), skip)
+            measures.append(skip)
+        if measures and layer_names is not None:
+            abjad.attach(abjad.LilyPondLiteral(rf'\set Staff.instrumentName = "{layer_names[i]}"'), measures[0])
+        score.append(abjad.Staff([abjad.Voice(measures)], name=f"LayerStaff{i + 1}"))
+
+    timestamps = []
+    interval = Fraction(timestamp_interval).limit_denominator(time_resolution)
+    time = Fraction(0)
+    while time < end_time:
+        length = min(interval, end_time - time)
+        skip = abjad.Skip(abjad.Duration(1, 4), multiplier=(length.numerator, length.denominator))
+        abjad.attach(abjad.Markup(f'"{format_timestamp(time)}"'), skip, direction=abjad.DOWN)
+        timestamps.append(skip)
+        time += length
+    timestamp_staff = abjad.Staff([abjad.Voice(timestamps)], name="TimestampStaff")
+    _hide_staff(timestamp_staff)
+    score.append(timestamp_staff)
+
+    return score
+
+
 def create_blank_lilypond_file(score: abjad.Score, proportional_duration: tuple[int, int] = (1, 20),
-                               page_size_in: tuple[float, float] = (17, 11)) -> abjad.LilyPondFile:
-    
+                               page_size_in: tuple[float, float] = (17, 11),
+                               per_staff_timing: bool = False) -> abjad.LilyPondFile:
+    """
+    Wraps a score from create_blank_score (or create_polymetric_score, with per_staff_timing) in a LilyPond file.
+
+    :param per_staff_timing: if True, each staff keeps its own time signatures and bar lines (as the layers of a
+        polymetric score need)
+    """
+
     # Set proportional notation
     layout_block = abjad.Block("layout")
     layout_block.items.append(
         layout_block_text.format(pdur_numerator=proportional_duration[0],
                                  pdur_denominator=proportional_duration[1])    
     )
+    if per_staff_timing:
+        layout_block.items.append(per_staff_timing_text)
 
     # Set page dimensions
     paper_block = abjad.Block("paper")
@@ -118,158 +185,97 @@ def create_blank_lilypond_file(score: abjad.Score, proportional_duration: tuple[
 
     # Wrap everything in a Score with LilyPond headers
     lilypond_file = abjad.LilyPondFile(
-        items=[rf'\include "{abjad_ily_path}"', layout_block, paper_block, score]
+        items=[rf'\include "{get_abjad_ily_path()}"', layout_block, paper_block, score]
     )
 
     return lilypond_file
 
 
-def get_abjad_tempo_voice(tempo_envelope: TempoEnvelope, parenthesized_end_offset=0.25):
-    annotation_key_points = get_tempo_annotation_key_points(tempo_envelope)
-
-
-    # list of (start_beat, end_beat, annotation_value)
-    #    - always has start_beat
-    #    - only arrow have end_beat
-    #    - annotation_value is the abjad annotation e.g. MetronomeMark
-    annotations = []
-
-    last_tempo = None
-    last_segment_was_constant_tempo = False
-
-    for i in range(0, len(annotation_key_points), 2):
-        start_kp, end_kp = annotation_key_points[i: i + 2]
-        next_start_tempo = annotation_key_points[i + 2][1] if i + 2 < len(annotation_key_points) else None
-        start_beat, start_tempo = start_kp
-        end_beat, end_tempo = end_kp
-
-        if start_tempo == end_tempo:  # constant segment
-            if start_tempo != last_tempo or not last_segment_was_constant_tempo:
-                annotations.append((
-                    start_beat,
-                    None,
-                    abjad.Markup(
-                        tempo_markup.format(note_type=8, tempo=round(start_tempo))
-                    )
-                ))
-            last_segment_was_constant_tempo = True
-        elif next_start_tempo is None or end_tempo != next_start_tempo:
-            # not a constant segment, since the first if statement failed, and we need to note the end tempo, since it's
-            # not going to be given at the start of the next segments (either because of subito change or end of score)
-            tweaks = (tempo_spanner_tweaks_left_parenthesized
-                      if start_tempo == last_tempo else tempo_spanner_tweaks_left).format(note_type=8,
-                                                                                          tempo=round(start_tempo))
-            tweaks += "\n" + tempo_spanner_tweaks_right_parenthesized.format(note_type=8, tempo=round(end_tempo))
-            tweaks += "\n" + tempo_spanner_padding_tweak.format(1)
-            right_before_end_beat = end_beat - parenthesized_end_offset
-            annotations.append((
-                start_beat,
-                right_before_end_beat,
-                abjad.StartTextSpan(
-                    style=tweaks
-                )
-            ))
-            last_segment_was_constant_tempo = False
-        else:
-            # not a constant segment, but the end tempo matches the beginning of the next segment, so just add a
-            # metronome mark and and arrow
-            tweaks = (tempo_spanner_tweaks_left_parenthesized
-                      if start_tempo == last_tempo else tempo_spanner_tweaks_left).format(note_type=8,
-                                                                                          tempo=round(start_tempo))
-            tweaks += "\n" + tempo_spanner_padding_tweak.format(1)
-
-            annotations.append((
-                start_beat,
-                end_beat,
-                abjad.StartTextSpan(
-                    style=tweaks
-                )
-            ))
-            last_segment_was_constant_tempo = False
-        last_tempo = end_tempo
-
-    tempo_voice, beats_to_skip_objects = create_tempo_skip_voice(annotations)
-    for start_beat, end_beat, annotation_object in annotations:
-        if end_beat is not None:
-            abjad.text_spanner([beats_to_skip_objects[start_beat], beats_to_skip_objects[end_beat]],
-                               start_text_span=annotation_object)
+def format_lilypond_file(lilypond_file: abjad.LilyPondFile) -> str:
+    """
+    Formats a LilyPond file (e.g. from MetricGroup.to_lilypond_file) as LilyPond source with abjad.lilypond,
+    timed as the "abjad_lilypond" span.
+    """
+    with span("abjad_lilypond"):
+        text = abjad.lilypond(lilypond_file)
+    count("bytes_written", len(text))
+    return text
+
+
+@traced("build_tempo_voice")
+def get_abjad_tempo_voice(tempo_envelope: TempoEnvelope, parenthesized_end_offset=0.25, merge_skips=False,
+                          ticks_per_beat=TICKS_PER_QUARTER):
+    # tuple of (start_tick, end_tick, annotation_string) (see get_tempo_annotations)
+    #    - always has start_tick
+    #    - only arrow have end_tick
+    #    - annotation_string is markup for a tempo mark, or the tweaks of the arrow's text spanner
+    # (ticks_per_beat gives the units of the envelope's beats; see get_tempo_annotation_plan)
+    annotations = get_tempo_annotation_plan(tempo_envelope, parenthesized_end_offset, ticks_per_beat).annotations
+    count("annotations_emitted", len(annotations))
+
+    tempo_voice, ticks_to_skip_objects = create_tempo_skip_voice(annotations, merge_skips=merge_skips)
+    for start_tick, end_tick, annotation_string in annotations:
+        if end_tick is not None:
+            abjad.text_spanner([ticks_to_skip_objects[start_tick], ticks_to_skip_objects[end_tick]],
+                               start_text_span=abjad.StartTextSpan(style=annotation_string))
         else:
-            abjad.attach(annotation_object, beats_to_skip_objects[start_beat])
+            abjad.attach(abjad.Markup(annotation_string), ticks_to_skip_objects[start_tick])
 
     return tempo_voice
 
 
-def get_tempo_annotation_key_points(tempo_envelope: TempoEnvelope):
-    annotations = []  # list of (beat, tempo_at_beat)
-    b = 0
-    for segment_duration in tempo_envelope.durations:
-        if segment_duration == 0:
-            continue
-        annotations.append((b, tempo_envelope.tempo_at(b)))
-        annotations.append((b + segment_duration, tempo_envelope.tempo_at(b + segment_duration, from_left=True)))
-        b += segment_duration
-    return annotations
-
-
 def create_tempo_skip_voice(
         annotations,
-        skip_duration=0.25,
-        voice_name="TempoVoice"
+        skip_ticks=TICKS_PER_16TH,
+        voice_name="TempoVoice",
+        merge_skips=False,
+        skip_duration=None
 ):
     """
     Creates a voice filled with fixed-duration skips and maps annotation time points to the appropriate skips.
 
     Args:
-        annotations: List of (start_beat, end_beat, annotation_value) tuples
-        skip_duration: Duration of each skip (default: 16th note)
+        annotations: List of (start_tick, end_tick, annotation_value) tuples
+        skip_ticks: Duration of each skip in ticks (default: 16th note)
         voice_name: Name of the created voice
+        merge_skips: If True, runs of skips that carry no annotation are merged into a single multiplied skip,
+            so that the voice has one leaf per annotation time point rather than one per skip
+        skip_duration: Deprecated. Duration of each skip in quarter notes, as this function used to take it, in
+            which case the annotations' time points are also in quarter notes (and so are the keys of the
+            returned dict). A skip length given positionally that isn't a whole number of ticks is taken as a
+            skip_duration too.
 
     Returns:
         A tuple containing:
         - abjad.Voice: The created voice filled with skips
-        - dict: Mapping from annotation time points to skip objects
+        - dict: Mapping from annotation time points (in ticks) to skip objects
     """
-    # Extract all time points from the annotations
-    time_points = set()
-    for start_beat, end_beat, _ in annotations:
-        time_points.add(start_beat)
-        if end_beat is not None:
-            time_points.add(end_beat)
-
-    # Sort the time points
-    time_points = sorted(time_points)
+    if skip_duration is not None or not isinstance(skip_ticks, (int, np.integer)):
+        warnings.warn("create_tempo_skip_voice takes annotations and skip lengths in ticks; skip_duration (with "
+                      "annotations in quarter notes) is deprecated", DeprecationWarning, stacklevel=2)
+        skip_duration = skip_ticks if skip_duration is None else skip_duration
+        tick_annotations = [(beats_to_ticks(start, TICKS_PER_QUARTER),
+                             None if end is None else beats_to_ticks(end, TICKS_PER_QUARTER), annotation)
+                            for start, end, annotation in annotations]
+        voice, tick_to_skip = create_tempo_skip_voice(
+            tick_annotations, beats_to_ticks(skip_duration, TICKS_PER_QUARTER), voice_name, merge_skips)
+        return voice, {point: tick_to_skip[beats_to_ticks(point, TICKS_PER_QUARTER)]
+                       for point in get_annotation_time_points(annotations)}
+
+    time_points = get_annotation_time_points(annotations)
 
     if not time_points:
         return abjad.Voice([], name=voice_name), {}
 
-    # Find the maximum beat needed
-    max_beat = max(time_points)
-
-    # Create a list of skips that spans the entire duration
-    skips = []
-    beat_to_skip = {}  # Mapping from beats to skips
-
-    current_beat = 0.0
-    while current_beat <= max_beat:
-        skip = abjad.Skip(skip_duration / 4)
-        skips.append(skip)
-
-        # Check if any annotation time points fall within this skip's duration
-        for point in time_points:
-            if current_beat <= point < current_beat + skip_duration:
-                beat_to_skip[point] = skip
-
-        current_beat += skip_duration
+    skip_lengths, point_to_skip_index = get_tempo_skip_layout(time_points, skip_ticks, merge_skips)
+    # (a whole note is four quarters)
+    written_duration = abjad.Duration(skip_ticks, 4 * TICKS_PER_QUARTER)
+    skips = [abjad.Skip(written_duration, multiplier=(length, 1)) if length > 1
+             else abjad.Skip(written_duration) for length in skip_lengths]
+    tick_to_skip = {point: skips[index] for point, index in point_to_skip_index.items()}
+    count("skips_created", len(skips))
 
     # Create the voice
     voice = abjad.Voice(skips, name=voice_name)
 
-    return voice, beat_to_skip
-
-
-def measure_dur_to_time_sig(dur_in_16ths: int):
-    if dur_in_16ths % 2 == 0:
-        return dur_in_16ths // 2,  8
-    else:
-        return dur_in_16ths, 16
-    
\ No newline at end of file
+    return voice, tick_to_skip
@@ -0,0 +1,265 @@
+"""
+Batch export of many metric group configs, each with a grid of LilyPond file settings, over a process pool::
+
+    python -m composing_time.batch "forms/*.json" -o scores --proportional-duration 1/20 1/16 --page-size 17x11
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Mapping, Sequence
+from .binary_format import save_binary, load_binary
+from .lilypond_text import write_blank_lilypond_file
+from .metric_group import MetricGroup
+from .timing import get_bar_times
+
+# ----------------------------- Batch Export ---------------------------------
+
+# Each distinct config is parsed once, by whichever worker gets to it first, and saved in the binary metric group
+# format. Every export of that config then memory-maps the same file, so the operating system shares its pages
+# between the workers, and each worker keeps the last few configs it used (bar lengths, bar times and concatenated
+# tempo envelope) so that a config's variants don't redo that work. Results are yielded as each export finishes.
+
+# the keyword arguments of write_blank_lilypond_file that can vary between the exports of a config
+EXPORT_PARAMETERS = ("proportional_duration", "page_size_in", "merge_tempo_skips")
+
+
+class BatchJob:
+    """
+    A single export: one config with one set of LilyPond file settings.
+
+    :param config: path of a JSON config file, a JSON config dictionary, or a MetricGroup
+    :param output_path: the LilyPond file to write
+    :param params: keyword arguments for write_blank_lilypond_file (see EXPORT_PARAMETERS)
+    """
+
+    def __init__(self, config: str | Path | dict | MetricGroup, output_path: str | Path, **params):
+        for name in params:
+            if name not in EXPORT_PARAMETERS:
+                raise ValueError(f"Unknown export parameter {name} (expected one of {', '.join(EXPORT_PARAMETERS)})")
+        self.config = config
+        self.output_path = Path(output_path)
+        self.params = params
+
+    def __repr__(self):
+        return f"BatchJob({self.output_path.name!r}, {self.params})"
+
+
+class BatchResult:
+    """
+    The outcome of a BatchJob.
+
+    :param job: the job
+    :param seconds: how long the export took (not counting the shared parsing of its config)
+    :param error: the formatted exception if the job failed, otherwise None
+    """
+
+    def __init__(self, job: BatchJob, seconds: float, error: str = None):
+        self.job = job
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_json_dict(self) -> dict[str, Any]:
+        config = self.job.config
+        return {
+            "config": str(config) if isinstance(config, (str, Path)) else None,
+            "output": str(self.job.output_path),
+            "params": self.job.params,
+            "ok": self.ok,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return f"BatchResult({self.job!r}, {'ok' if self.ok else 'failed'}, {self.seconds:.3f}s)"
+
+
+def expand_jobs(configs: Iterable[str | Path | dict | MetricGroup], output_dir: str | Path,
+                param_grid: Mapping[str, Sequence] = None) -> list[BatchJob]:
+    """
+    Makes a job for every combination of config and parameter settings.
+
+    :param configs: config file paths (which may be glob patterns), JSON config dictionaries or MetricGroups.
+        Repeats of the same config (the same file, or the same object) are dropped.
+    :param output_dir: directory for the LilyPond files. Each is named after its config file (or "config<n>" for
+        a config given as an object), followed by the index of its settings in the grid if there is more than one.
+    :param param_grid: dict mapping each parameter to vary (see EXPORT_PARAMETERS) to the values to try
+    :return: list of jobs, with the variants of each config next to each other
+    """
+    param_grid = {} if param_grid is None else param_grid
+    names = list(param_grid)
+    variants = [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+    output_dir = Path(output_dir)
+
+    expanded_configs = {}
+    for config in configs:
+        if isinstance(config, (str, Path)) and glob.has_magic(str(config)):
+            matches = [Path(match) for match in sorted(glob.glob(str(config)))]
+            if not matches:
+                raise ValueError(f"No config files match {config}")
+        else:
+            matches = [config]
+        for match in matches:
+            # a config file named more than once (e.g. both directly and by a glob) is only exported once
+            expanded_configs.setdefault(_config_key(match), match)
+
+    jobs = []
+    used_names = set()
+    for i, config in enumerate(expanded_configs.values()):
+        name = Path(config).stem if isinstance(config, (str, Path)) else f"config{i}"
+        if name in used_names:
+            name = f"{name}-{i}"
+        used_names.add(name)
+        for j, variant in enumerate(variants):
+            file_name = f"{name}.{j}.ly" if len(variants) > 1 else f"{name}.ly"
+            jobs.append(BatchJob(config, output_dir / file_name, **variant))
+    return jobs
+
+
+def run_batch(jobs: Sequence[BatchJob], max_workers: int = None) -> Iterator[BatchResult]:
+    """
+    Runs the given jobs over a process pool, yielding each result (successful or not) as soon as it is ready. A
+    config that fails to load fails all of its jobs.
+
+    :param jobs: the jobs to run (see :func:`expand_jobs`)
+    :param max_workers: number of worker processes (defaults to the number of CPUs)
+    """
+    # jobs sharing a config (by identity, or by path for config files) share its preparation
+    config_keys, configs, jobs_by_config = {}, [], []
+    for job in jobs:
+        key = _config_key(job.config)
+        if key not in config_keys:
+            config_keys[key] = len(configs)
+            configs.append(job.config)
+            jobs_by_config.append([])
+        jobs_by_config[config_keys[key]].append(job)
+
+    with tempfile.TemporaryDirectory() as working_dir, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            pending = {}
+            for i, config in enumerate(configs):
+                binary_path = Path(working_dir) / f"{i}.ctmg"
+                if isinstance(config, MetricGroup):
+                    # already built, so just save it (rather than pickling the whole tree over to a worker)
+                    save_binary(config, binary_path)
+                    for job in jobs_by_config[i]:
+                        pending[executor.submit(_export, binary_path, job.output_path, job.params)] = job
+                else:
+                    pending[executor.submit(_prepare_config, config, binary_path)] = i
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    target = pending.pop(future)
+                    if isinstance(target, BatchJob):
+                        seconds, error = future.result()
+                        yield BatchResult(target, seconds, error)
+                        continue
+                    binary_path, error = future.result()
+                    for job in jobs_by_config[target]:
+                        if error is None:
+                            pending[executor.submit(_export, binary_path, job.output_path, job.params)] = job
+                        else:
+                            yield BatchResult(job, 0.0, error)
+        finally:
+            # if the caller stops early, don't wait for the rest of the exports
+            executor.shutdown(cancel_futures=True)
+
+
+def _config_key(config: str | Path | dict | MetricGroup) -> str | int:
+    # identifies a config file by its resolved path, and a config object by its identity
+    return str(Path(config).resolve()) if isinstance(config, (str, Path)) else id(config)
+
+
+def _prepare_config(config: str | Path | dict, binary_path: Path) -> tuple[Path, str | None]:
+    # (runs in a worker) parses and validates a config, saving it as a binary metric group file
+    try:
+        metric_group = (MetricGroup.parse_json(config) if isinstance(config, dict)
+                        else MetricGroup.load_from_json(config))
+        save_binary(metric_group, binary_path)
+    except Exception:
+        return binary_path, traceback.format_exc()
+    return binary_path, None
+
+
+@lru_cache(maxsize=8)
+def _load_prepared(binary_path: Path) -> tuple[list[int], list[float], Any]:
+    # (runs in a worker) the bar lengths, bar times and tempo envelope of a prepared config
+    metric_group = load_binary(binary_path)
+    tempo_envelope = metric_group.get_tempo_envelope()
+    _, bar_times = get_bar_times(metric_group.get_bar_line_locations(), tempo_envelope)
+    return metric_group.get_bar_lengths(), bar_times, tempo_envelope
+
+
+def _export(binary_path: Path, output_path: Path, params: dict) -> tuple[float, str | None]:
+    # (runs in a worker) exports a prepared config with the given settings
+    start = time.perf_counter()
+    try:
+        bar_lengths, bar_times, tempo_envelope = _load_prepared(binary_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w") as f:
+            write_blank_lilypond_file(f, bar_lengths, bar_times, tempo_envelope, **params)
+    except Exception:
+        return time.perf_counter() - start, traceback.format_exc()
+    return time.perf_counter() - start, None
+
+
+# ----------------------------- Command Line ---------------------------------
+
+def _parse_fraction(text: str) -> tuple[int, int]:
+    numerator, _, denominator = text.partition("/")
+    return int(numerator), int(denominator or 1)
+
+
+def _parse_page_size(text: str) -> tuple[float, float]:
+    # (whole numbers are kept as ints, since they are written into the file as given)
+    return tuple(int(size) if size.strip().isdigit() else float(size) for size in text.lower().split("x", 1))
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m composing_time.batch",
+                                     description="Exports many metric group configs to LilyPond in parallel, "
+                                                 "over a grid of file settings.")
+    parser.add_argument("configs", nargs="+", help="JSON config files or glob patterns")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory for the LilyPond files")
+    parser.add_argument("--proportional-duration", nargs="+", type=_parse_fraction, metavar="N/D",
+                        help="proportional notation durations to try, e.g. 1/20")
+    parser.add_argument("--page-size", nargs="+", type=_parse_page_size, metavar="WxH",
+                        help="page sizes to try, in inches, e.g. 17x11")
+    parser.add_argument("--merge-tempo-skips", choices=("no", "yes", "both"), default="no")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    args = parser.parse_args(args)
+
+    param_grid = {}
+    if args.proportional_duration:
+        param_grid["proportional_duration"] = args.proportional_duration
+    if args.page_size:
+        param_grid["page_size_in"] = args.page_size
+    param_grid["merge_tempo_skips"] = {"no": [False], "yes": [True], "both": [False, True]}[args.merge_tempo_skips]
+
+    try:
+        jobs = expand_jobs(args.configs, args.output_dir, param_grid)
+    except ValueError as e:
+        parser.error(str(e))
+    num_failed = 0
+    # one JSON line per job, as it finishes
+    for result in run_batch(jobs, args.workers):
+        num_failed += not result.ok
+        print(json.dumps(result.to_json_dict()), flush=True)
+    print(f"{len(jobs) - num_failed} of {len(jobs)} exports succeeded", file=sys.stderr)
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
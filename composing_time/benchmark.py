@@ -0,0 +1,293 @@
+"""
+Benchmarks for each stage of the score generation pipeline, run against synthetic metric groups.
+
+Run the suite and save the results::
+
+    python -m composing_time.benchmark run -o results.json
+
+and compare two runs (e.g. before and after upgrading scamp or abjad), exiting with status 1 on any regression::
+
+    python -m composing_time.benchmark compare baseline.json results.json --time-threshold 0.25
+"""
+
+import argparse
+import gc
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Any, Callable
+from .metric_group import MetricGroup
+from .timing import get_bar_times, TICKS_PER_16TH
+
+# ----------------------------- Synthetic Metric Groups ---------------------------------
+
+DEFAULT_SIZES = (10, 1000, 50000)
+COMPLEXITIES = ("constant", "ramp", "envelope")
+BARS_PER_GROUP = 50
+
+
+def make_synthetic_config(num_bars: int, complexity: str, seed: int = 0) -> dict:
+    """
+    Makes a JSON config (as parsed by :func:`MetricGroup.parse_json`) for a piece of the given number of bars,
+    made of sections of up to BARS_PER_GROUP bars, grouped in turn into movements of ten sections.
+
+    :param num_bars: total number of bars
+    :param complexity: how complicated each section's tempo is: "constant" (a single tempo), "ramp" (a curved
+        accelerando or ritardando) or "envelope" (a tempo envelope of eight curved segments)
+    :param seed: random seed, so that every run benchmarks the same piece
+    :return: the JSON config
+    """
+    if complexity not in COMPLEXITIES:
+        raise ValueError(f"Complexity must be one of {', '.join(COMPLEXITIES)}.")
+    rng = random.Random(seed)
+    sections = []
+    for section_start in range(0, num_bars, BARS_PER_GROUP):
+        bar_lengths = [rng.randint(2, 16) for _ in range(min(BARS_PER_GROUP, num_bars - section_start))]
+        section = {"bar_lengths": bar_lengths}
+        if complexity == "constant":
+            section["tempo"] = rng.uniform(40, 160)
+        elif complexity == "ramp":
+            section.update(tempo=rng.uniform(40, 160), end_tempo=rng.uniform(40, 160),
+                           tempo_curvature=rng.uniform(-3, 3))
+        else:
+            section["tempo_envelope"] = {
+                "levels": [rng.uniform(40, 160) for _ in range(9)],
+                "durations": [sum(bar_lengths) / 8] * 8,
+                "curve_shapes": [rng.uniform(-3, 3) for _ in range(8)],
+            }
+        sections.append(section)
+    return {"subgroups": [{"subgroups": sections[i:i + 10]} for i in range(0, len(sections), 10)]}
+
+
+# ----------------------------- Stages ---------------------------------
+
+# Each stage is a pair of functions: a setup function, which takes the JSON config and returns the arguments for the
+# stage (e.g. a freshly parsed, uncached metric group), and the stage itself, which is what gets timed.
+
+
+def _fresh_group(config: dict) -> tuple:
+    return MetricGroup.parse_json(config),
+
+
+def _bar_timing_arguments(config: dict) -> tuple:
+    metric_group = MetricGroup.parse_json(config)
+    return metric_group.get_bar_line_locations(), metric_group.get_tempo_envelope()
+
+
+def _score_arguments(config: dict) -> tuple:
+    metric_group = MetricGroup.parse_json(config)
+    bar_lengths, tempo_envelope = metric_group.get_bar_lengths(), metric_group.get_tempo_envelope()
+    _, bar_times = get_bar_times(metric_group.get_bar_line_locations(), tempo_envelope)
+    return bar_lengths, bar_times, tempo_envelope
+
+
+def _tempo_voice_arguments(config: dict) -> tuple:
+    # (as in create_blank_score, the tempo voice is built straight from the envelope in 16ths)
+    return MetricGroup.parse_json(config).get_tempo_envelope(),
+
+
+def _lilypond_file_arguments(config: dict) -> tuple:
+    return MetricGroup.parse_json(config).to_lilypond_file(),
+
+
+def _create_blank_score(bar_lengths, bar_times, tempo_envelope):
+    from .abjad_utils import create_blank_score
+    return create_blank_score(bar_lengths, bar_times, tempo_envelope)
+
+
+def _get_abjad_tempo_voice(tempo_envelope):
+    from .abjad_utils import get_abjad_tempo_voice
+    return get_abjad_tempo_voice(tempo_envelope, ticks_per_beat=TICKS_PER_16TH)
+
+
+def _abjad_lilypond(lilypond_file):
+    from .abjad_utils import format_lilypond_file
+    return format_lilypond_file(lilypond_file)
+
+
+def _write_lilypond_file(metric_group):
+    metric_group.write_lilypond_file(io.StringIO())
+
+
+STAGES: dict[str, tuple[Callable[[dict], tuple], Callable]] = {
+    "parse_json": (lambda config: (config,), MetricGroup.parse_json),
+    "get_bar_lengths": (_fresh_group, lambda metric_group: metric_group.get_bar_lengths()),
+    "get_tempo_envelope": (_fresh_group, lambda metric_group: metric_group.get_tempo_envelope()),
+    "bar_timing": (_bar_timing_arguments, get_bar_times),
+    "create_blank_score": (_score_arguments, _create_blank_score),
+    "get_abjad_tempo_voice": (_tempo_voice_arguments, _get_abjad_tempo_voice),
+    "abjad_lilypond": (_lilypond_file_arguments, _abjad_lilypond),
+    "write_lilypond_file": (_fresh_group, _write_lilypond_file),
+}
+
+
+# ----------------------------- Running ---------------------------------
+
+
+def time_stage(setup: Callable[[dict], tuple], stage: Callable, config: dict, min_total_time: float = 1.0,
+               max_repeats: int = 20) -> dict[str, Any]:
+    """
+    Times one stage, repeating it (with a fresh setup each time) until it has run for min_total_time seconds in
+    total or max_repeats times, then runs it once more under tracemalloc to measure its peak memory use.
+
+    :return: dictionary of the individual times, their median and minimum, and the peak memory in bytes
+    """
+    times = []
+    while not times or (sum(times) < min_total_time and len(times) < max_repeats):
+        arguments = setup(config)
+        gc.collect()
+        start = time.perf_counter()
+        stage(*arguments)
+        times.append(time.perf_counter() - start)
+
+    arguments = setup(config)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage(*arguments)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"times": times, "median": statistics.median(times), "min": min(times), "peak_memory": peak_memory}
+
+
+def get_environment_info() -> dict[str, Any]:
+    """Python, platform and dependency versions, so that results from different environments can be told apart."""
+    versions = {}
+    for package in ("composing_time", "abjad", "scamp", "clockblocks", "expenvelope", "numpy"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "packages": versions,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, complexities=COMPLEXITIES, stages=tuple(STAGES), min_total_time: float = 1.0,
+                   max_repeats: int = 20, log: Callable[[str], None] = None) -> dict[str, Any]:
+    """
+    Runs every given stage against a synthetic metric group of every given size and complexity.
+
+    :param sizes: numbers of bars
+    :param complexities: tempo complexities (see :func:`make_synthetic_config`)
+    :param stages: names of the stages to run (keys of STAGES)
+    :param min_total_time: see :func:`time_stage`
+    :param max_repeats: see :func:`time_stage`
+    :param log: if given, called with a line of progress after each benchmark
+    :return: JSON-serializable dictionary of the environment and the results
+    """
+    # run each stage once on a tiny piece first, so that one-off costs (e.g. lazy imports) aren't timed
+    warm_up_config = make_synthetic_config(10, "constant")
+    for stage_name in stages:
+        setup, stage = STAGES[stage_name]
+        stage(*setup(warm_up_config))
+
+    results = []
+    for num_bars in sizes:
+        for complexity in complexities:
+            config = make_synthetic_config(num_bars, complexity)
+            for stage_name in stages:
+                setup, stage = STAGES[stage_name]
+                result = {"stage": stage_name, "bars": num_bars, "complexity": complexity,
+                          **time_stage(setup, stage, config, min_total_time, max_repeats)}
+                results.append(result)
+                if log is not None:
+                    log(f"{stage_name:>22} {num_bars:>6} bars {complexity:>9}: {result['median'] * 1000:10.2f} ms "
+                        f"(median of {len(result['times'])}), peak {result['peak_memory'] / 1e6:8.2f} MB")
+    return {"environment": get_environment_info(), "results": results}
+
+
+# ----------------------------- Comparing ---------------------------------
+
+
+def compare_results(baseline: dict, current: dict, time_threshold: float = 0.25,
+                    memory_threshold: float = 0.25) -> list[dict[str, Any]]:
+    """
+    Compares two sets of benchmark results, matching benchmarks by stage, size and complexity.
+
+    :param baseline: results of the earlier run (as returned by :func:`run_benchmarks`)
+    :param current: results of the later run
+    :param time_threshold: a benchmark has regressed if its time grew by more than this fraction. The fastest
+        of each benchmark's runs is compared, since it is the least affected by noise from the rest of the system.
+    :param memory_threshold: a benchmark has regressed if its peak memory grew by more than this fraction
+    :return: one dictionary per benchmark found in both runs, with the ratios of current to baseline time and
+        memory and whether either counts as a regression
+    """
+    def key(result):
+        return result["stage"], result["bars"], result["complexity"]
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    comparisons = []
+    for result in current["results"]:
+        if key(result) not in baseline_results:
+            continue
+        old = baseline_results[key(result)]
+        time_ratio = result["min"] / old["min"] if old["min"] > 0 else float("inf")
+        memory_ratio = result["peak_memory"] / old["peak_memory"] if old["peak_memory"] > 0 else 1.0
+        comparisons.append({
+            "stage": result["stage"], "bars": result["bars"], "complexity": result["complexity"],
+            "time_ratio": time_ratio, "memory_ratio": memory_ratio,
+            "regressed": time_ratio > 1 + time_threshold or memory_ratio > 1 + memory_threshold,
+        })
+    return comparisons
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m composing_time.benchmark", description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("-o", "--output", help="file to write the JSON results to (default: stdout)")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of bars")
+    run_parser.add_argument("--complexities", nargs="+", default=COMPLEXITIES, choices=COMPLEXITIES)
+    run_parser.add_argument("--stages", nargs="+", default=tuple(STAGES), choices=tuple(STAGES))
+    run_parser.add_argument("--min-time", type=float, default=1.0,
+                            help="keep repeating each benchmark until it has run for this many seconds")
+    run_parser.add_argument("--max-repeats", type=int, default=20)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two sets of results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--time-threshold", type=float, default=0.25,
+                                help="fractional slowdown that counts as a regression")
+    compare_parser.add_argument("--memory-threshold", type=float, default=0.25,
+                                help="fractional growth in peak memory that counts as a regression")
+
+    args = parser.parse_args(args)
+    if args.command == "run":
+        results = run_benchmarks(args.sizes, args.complexities, args.stages, args.min_time, args.max_repeats,
+                                 log=lambda line: print(line, file=sys.stderr))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    comparisons = compare_results(baseline, current, args.time_threshold, args.memory_threshold)
+    for comparison in comparisons:
+        print(f"{comparison['stage']:>22} {comparison['bars']:>6} bars {comparison['complexity']:>9}: "
+              f"time x{comparison['time_ratio']:.2f}, memory x{comparison['memory_ratio']:.2f}"
+              f"{'  REGRESSION' if comparison['regressed'] else ''}")
+    num_regressions = sum(comparison["regressed"] for comparison in comparisons)
+    print(f"{num_regressions} regression(s) in {len(comparisons)} benchmarks")
+    return 1 if num_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import struct
+from pathlib import Path
+import numpy as np
+from .compact import CompactMetricGroup
+from .instrumentation import traced
+from .metric_group import MetricGroup
+
+# ----------------------------- Binary Metric Group Files ---------------------------------
+
+# A binary metric group file is the columnar arrays of a CompactMetricGroup written back to back, so that loading
+# one is just memory-mapping the file: nothing is parsed, pages are only read when they are touched, and processes
+# that open the same file share its pages. The layout is
+#
+#   MAGIC (8 bytes) | format version (uint32) | header length (uint32) | header (UTF-8 JSON) | arrays
+#
+# where the header gives the dtype, shape and byte offset of each array. Arrays are little-endian and start on
+# 64-byte boundaries.
+
+MAGIC = b"CTMGROUP"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+
+_ARRAY_DTYPES = {
+    "bar_lengths": "<i4",
+    "segment_start_beats": "<f8",
+    "segment_end_beats": "<f8",
+    "segment_start_levels": "<f8",
+    "segment_end_levels": "<f8",
+    "segment_curve_shapes": "<f8",
+    "group_parents": "<i4",
+    "group_bar_ranges": "<i8",
+    "group_segment_ranges": "<i8",
+    "group_is_simple": "|b1",
+}
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+@traced("save_binary")
+def save_binary(metric_group: MetricGroup, file_path: str | Path) -> Path:
+    """
+    Saves a metric group (of any kind) to a binary metric group file.
+
+    :param metric_group: the metric group to save
+    :param file_path: where to save it
+    :return: file_path, as a Path
+    """
+    compact = CompactMetricGroup.from_metric_group(metric_group)
+    arrays = {name: np.ascontiguousarray(getattr(compact, name), dtype=dtype) for name, dtype in _ARRAY_DTYPES.items()}
+
+    # the array offsets depend on the length of the header, which contains them, so lay the arrays out relative to
+    # the end of the header first, then shift them once the header length is settled
+    relative_offsets, offset = {}, 0
+    for name, array in arrays.items():
+        relative_offsets[name] = offset
+        offset = _align(offset + array.nbytes)
+    data_start = 0
+    while True:
+        header = json.dumps({"arrays": {
+            name: {"dtype": _ARRAY_DTYPES[name], "shape": list(array.shape),
+                   "offset": data_start + relative_offsets[name]}
+            for name, array in arrays.items()
+        }}).encode()
+        header_end = _PREAMBLE.size + len(header)
+        if _align(header_end) == data_start:
+            break
+        data_start = _align(header_end)
+
+    file_path = Path(file_path)
+    with open(file_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + relative_offsets[name] - f.tell()))
+            f.write(array.tobytes())
+    return file_path
+
+
+def read_binary_header(file_path: str | Path) -> tuple[int, dict]:
+    """
+    Reads the version and header of a binary metric group file, without reading its arrays.
+
+    :return: tuple of (format version, header dictionary)
+    """
+    with open(file_path, "rb") as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size or preamble[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{file_path} is not a binary metric group file.")
+        _, version, header_length = _PREAMBLE.unpack(preamble)
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{file_path} uses binary format version {version}, but only versions up to "
+                             f"{FORMAT_VERSION} are supported.")
+        return version, json.loads(f.read(header_length))
+
+
+@traced("load_binary")
+def load_binary(file_path: str | Path, mmap: bool = True) -> CompactMetricGroup:
+    """
+    Loads a binary metric group file as a CompactMetricGroup.
+
+    :param file_path: the file to load
+    :param mmap: if True, the group's arrays are read-only views onto a memory map of the file; otherwise, the
+        file is read into memory
+    :return: a CompactMetricGroup (use its to_metric_group method for a tree of Simple/CompositeMetricGroups)
+    """
+    _, header = read_binary_header(file_path)
+    buffer = np.memmap(file_path, dtype=np.uint8, mode="r") if mmap else np.fromfile(file_path, dtype=np.uint8)
+    arrays = {}
+    for name in _ARRAY_DTYPES:
+        spec = header["arrays"][name]
+        arrays[name] = np.ndarray(tuple(spec["shape"]), dtype=spec["dtype"], buffer=buffer, offset=spec["offset"])
+    return CompactMetricGroup(**arrays)
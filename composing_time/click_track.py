@@ -0,0 +1,148 @@
+import wave
+from functools import cache
+from pathlib import Path
+from typing import Iterator, TYPE_CHECKING
+import numpy as np
+from .lilypond_text import measure_dur_to_time_sig
+from .timing import EnvelopeArrays
+
+if TYPE_CHECKING:
+    from .metric_group import MetricGroup
+
+# ----------------------------- Click Track Rendering ---------------------------------
+
+# Every click onset is computed from the bars and tempo envelope, so the click matches the printed bars exactly,
+# including through accelerandi. The audio is synthesized a block at a time, so memory use does not grow with the
+# length of the piece.
+
+DOWNBEAT, BEAT, SUBDIVISION = 0, 1, 2
+
+
+def get_beat_groups(num_units: int) -> list[int]:
+    """
+    Groups the units of a bar (eighths or sixteenths) into beats: groups of 3 when they divide evenly into more
+    than one (6/8, 9/8, 12/8), otherwise groups of 2 with a group of 3 at the end if there's an odd number (7/8 is
+    2+2+3). Bars of up to three units are a single beat.
+    """
+    if num_units <= 3:
+        return [num_units]
+    if num_units % 3 == 0:
+        return [3] * (num_units // 3)
+    return [2] * (num_units // 2 - 1) + [num_units - 2 * (num_units // 2 - 1)]
+
+
+@cache
+def get_bar_click_pattern(dur_in_16ths: int, subdivide: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The clicks within a bar of the given length, following its time signature (see measure_dur_to_time_sig).
+
+    :param dur_in_16ths: the length of the bar in 16th notes
+    :param subdivide: if True, every eighth (or sixteenth, in x/16 bars) clicks; otherwise only the beats
+    :return: tuple of (click offsets from the start of the bar in 16ths, accent level of each click)
+    """
+    num_units, denominator = measure_dur_to_time_sig(dur_in_16ths)
+    sixteenths_per_unit = 16 // denominator
+    offsets, levels = [], []
+    unit = 0
+    for group in get_beat_groups(num_units):
+        for i in range(group if subdivide else 1):
+            offsets.append((unit + i) * sixteenths_per_unit)
+            levels.append(DOWNBEAT if unit + i == 0 else BEAT if i == 0 else SUBDIVISION)
+        unit += group
+    return np.array(offsets, dtype=float), np.array(levels, dtype=np.int8)
+
+
+def iter_clicks(metric_group: "MetricGroup", subdivide: bool = True,
+                bars_per_batch: int = 512) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Generates the click onsets of a metric group, a batch of bars at a time.
+
+    :param metric_group: the metric group to click
+    :param subdivide: if True, click every eighth (or sixteenth, in x/16 bars); otherwise only the beats
+    :param bars_per_batch: how many bars' worth of clicks to compute at once
+    :return: iterator of (click times in seconds, accent levels) array pairs, in time order
+    """
+    bar_lengths = metric_group.get_bar_lengths()
+    bar_line_locations = metric_group.get_bar_line_locations()
+    envelope_arrays = EnvelopeArrays.from_envelope(metric_group.get_tempo_envelope())
+    for batch_start in range(0, len(bar_lengths), bars_per_batch):
+        batch_end = min(batch_start + bars_per_batch, len(bar_lengths))
+        patterns = [get_bar_click_pattern(bar_length, subdivide) for bar_length in bar_lengths[batch_start:batch_end]]
+        beats = np.concatenate([bar_start + offsets for bar_start, (offsets, _)
+                                in zip(bar_line_locations[batch_start:batch_end], patterns)])
+        levels = np.concatenate([levels for _, levels in patterns])
+        yield envelope_arrays.times_at_beats(beats), levels
+
+
+def make_click_sounds(sample_rate: int, click_duration: float = 0.03,
+                      click_frequencies: tuple[float, float, float] = (1760, 1320, 880),
+                      click_volumes: tuple[float, float, float] = (1.0, 0.7, 0.45)) -> np.ndarray:
+    """
+    Synthesizes one exponentially decaying sine burst per accent level (downbeat, beat, subdivision).
+
+    :return: array of shape (3, click length in samples)
+    """
+    t = np.arange(int(click_duration * sample_rate)) / sample_rate
+    envelope = np.exp(-t * 8 / click_duration)
+    return np.array([volume * envelope * np.sin(2 * np.pi * frequency * t)
+                     for frequency, volume in zip(click_frequencies, click_volumes)])
+
+
+def write_click_track(metric_group: "MetricGroup", file_path: str | Path, sample_rate: int = 44100,
+                      block_size: int = 65536, subdivide: bool = True, volume: float = 0.8,
+                      **click_sound_kwargs) -> Path:
+    """
+    Renders a click track for a metric group to a 16-bit mono WAV file, streaming it to disk in fixed-size blocks.
+
+    :param metric_group: the metric group to click
+    :param file_path: where to write the WAV file
+    :param sample_rate: sample rate of the file
+    :param block_size: number of samples synthesized and written at a time
+    :param subdivide: if True, click every eighth (or sixteenth, in x/16 bars); otherwise only the beats
+    :param volume: overall volume, from 0 to 1
+    :param click_sound_kwargs: passed on to make_click_sounds (click_duration, click_frequencies, click_volumes)
+    :return: file_path, as a Path
+    """
+    click_sounds = make_click_sounds(sample_rate, **click_sound_kwargs) * volume
+    click_length = click_sounds.shape[1]
+    click_sample_range = np.arange(click_length)
+    total_time = metric_group.get_metric_index().total_time
+    total_samples = int(np.ceil(total_time * sample_rate)) + click_length
+
+    clicks = iter_clicks(metric_group, subdivide)
+    pending_samples = np.zeros(0, dtype=np.int64)
+    pending_levels = np.zeros(0, dtype=np.int8)
+    # the tail of clicks that started in the previous block and ring on into the next one
+    carry = np.zeros(click_length)
+
+    file_path = Path(file_path)
+    with wave.open(str(file_path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+
+        for block_start in range(0, total_samples, block_size):
+            block_end = min(block_start + block_size, total_samples)
+            # pull batches of clicks until we have all those that start within this block
+            while clicks is not None and (len(pending_samples) == 0 or pending_samples[-1] < block_end):
+                try:
+                    times, levels = next(clicks)
+                except StopIteration:
+                    clicks = None
+                    break
+                pending_samples = np.concatenate((pending_samples, np.round(times * sample_rate).astype(np.int64)))
+                pending_levels = np.concatenate((pending_levels, levels))
+            num_in_block = np.searchsorted(pending_samples, block_end)
+
+            buffer = np.zeros(block_end - block_start + click_length)
+            buffer[:click_length] += carry
+            if num_in_block:
+                sample_indices = (pending_samples[:num_in_block] - block_start)[:, None] + click_sample_range
+                np.add.at(buffer, sample_indices, click_sounds[pending_levels[:num_in_block]])
+                pending_samples = pending_samples[num_in_block:]
+                pending_levels = pending_levels[num_in_block:]
+            carry = buffer[block_end - block_start:]
+
+            samples = np.clip(buffer[:block_end - block_start], -1, 1)
+            wav_file.writeframes((samples * 32767).astype("<i2").tobytes())
+    return file_path
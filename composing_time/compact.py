@@ -0,0 +1,304 @@
+import numpy as np
+from typing import Any, Callable, Iterator, Sequence
+from clockblocks import TempoEnvelope
+from expenvelope import EnvelopeSegment
+from .metric_group import MetricGroup, SimpleMetricGroup, CompositeMetricGroup
+from .metric_index import MetricIndex
+from .json_loader import MetricGroupJSONError, validate_group, parse_tempo_envelope, iter_metric_group_json
+from .timing import EnvelopeArrays
+
+# ----------------------------- Compact Metric Groups ---------------------------------
+
+# A tree of SimpleMetricGroups and CompositeMetricGroups costs a handful of Python objects per bar and per envelope
+# segment, which adds up to hundreds of MB for long generated pieces. A CompactMetricGroup holds the same
+# information in a few flat NumPy arrays, with the tree recorded as index ranges into them.
+
+
+class CompactMetricGroup(MetricGroup):
+    """
+    A flat, array-backed metric group that converts losslessly to and from a tree of Simple/CompositeMetricGroups.
+
+    Bars are stored in an int32 array, with their cumulative offsets alongside. The segments of every simple
+    group's tempo envelope are stored in columnar arrays, concatenated in order, with their beats measured from the
+    start of the group that owns them (so that they convert back exactly). The groups themselves are listed in
+    pre-order, each with its parent and the range of bars and of envelope segments that it covers.
+
+    Unlike the other metric groups, a CompactMetricGroup is meant to be treated as immutable.
+
+    :param bar_lengths: the length of each bar
+    :param segment_start_beats: start beat of each envelope segment, relative to the start of its simple group
+    :param segment_end_beats: end beat of each envelope segment, relative to the start of its simple group
+    :param segment_start_levels: beat length (seconds per beat) at the start of each envelope segment
+    :param segment_end_levels: beat length (seconds per beat) at the end of each envelope segment
+    :param segment_curve_shapes: curve shape of each envelope segment
+    :param group_parents: index of each group's parent (-1 for the root, which must come first)
+    :param group_bar_ranges: (start, end) range of bars covered by each group, as an array of shape (groups, 2)
+    :param group_segment_ranges: (start, end) range of envelope segments covered by each group
+    :param group_is_simple: whether each group is a simple group (owning its segments) or a composite one
+    """
+
+    # the arrays that hold everything (see nbytes)
+    _ARRAY_NAMES = ("bar_lengths", "bar_line_offsets", "segment_start_beats", "segment_end_beats",
+                    "segment_start_levels", "segment_end_levels", "segment_curve_shapes", "group_parents",
+                    "group_bar_ranges", "group_segment_ranges", "group_is_simple")
+
+    def __init__(self, bar_lengths: Sequence[int], segment_start_beats: Sequence[float],
+                 segment_end_beats: Sequence[float], segment_start_levels: Sequence[float],
+                 segment_end_levels: Sequence[float], segment_curve_shapes: Sequence[float],
+                 group_parents: Sequence[int] = None, group_bar_ranges: Sequence[Sequence[int]] = None,
+                 group_segment_ranges: Sequence[Sequence[int]] = None, group_is_simple: Sequence[bool] = None):
+        super().__init__()
+        bar_lengths = np.asarray(bar_lengths)
+        if not np.issubdtype(bar_lengths.dtype, np.integer) and np.any(bar_lengths != np.round(bar_lengths)):
+            raise ValueError("CompactMetricGroup only supports whole-number bar lengths.")
+        # (no copy is made if the bar lengths are already int32, e.g. when memory-mapped from a file)
+        self.bar_lengths = np.asarray(bar_lengths, dtype=np.int32)
+        self.bar_line_offsets = np.concatenate(([0], np.cumsum(self.bar_lengths, dtype=np.int64)))
+        self.segment_start_beats = np.asarray(segment_start_beats, dtype=float)
+        self.segment_end_beats = np.asarray(segment_end_beats, dtype=float)
+        self.segment_start_levels = np.asarray(segment_start_levels, dtype=float)
+        self.segment_end_levels = np.asarray(segment_end_levels, dtype=float)
+        self.segment_curve_shapes = np.asarray(segment_curve_shapes, dtype=float)
+        if group_parents is None:
+            # a single simple group
+            group_parents, group_is_simple = [-1], [True]
+            group_bar_ranges = [(0, len(self.bar_lengths))]
+            group_segment_ranges = [(0, len(self.segment_start_beats))]
+        self.group_parents = np.asarray(group_parents, dtype=np.int32)
+        self.group_bar_ranges = np.asarray(group_bar_ranges, dtype=np.int64).reshape(-1, 2)
+        self.group_segment_ranges = np.asarray(group_segment_ranges, dtype=np.int64).reshape(-1, 2)
+        self.group_is_simple = np.asarray(group_is_simple, dtype=bool)
+        self._tempo_envelope = None
+
+    # ------------------------------------- Conversion ---------------------------------------
+
+    @classmethod
+    def from_metric_group(cls, metric_group: MetricGroup) -> "CompactMetricGroup":
+        """Flattens a tree of Simple/CompositeMetricGroups (or another CompactMetricGroup) into a CompactMetricGroup."""
+        if isinstance(metric_group, CompactMetricGroup):
+            return metric_group
+        builder = _CompactBuilder()
+        builder.add_metric_group(metric_group, -1)
+        return builder.build()
+
+    @classmethod
+    def parse_json(cls, data: dict) -> "CompactMetricGroup":
+        """
+        Parses the same JSON dictionary as :func:`MetricGroup.parse_json` straight into a CompactMetricGroup,
+        without building the intermediate tree of groups.
+        """
+        builder = _CompactBuilder()
+        builder.add_json(data, -1, "$")
+        return builder.build()
+
+    @classmethod
+    def load_from_json(cls, file_path) -> "CompactMetricGroup":
+        """
+        Reads a JSON config file straight into a CompactMetricGroup, streaming it in as
+        :func:`MetricGroup.load_from_json` does, but without building the intermediate tree of groups.
+        """
+        builder = _CompactBuilder()
+        with open(file_path, "r") as f:
+            builder.add_json_events(iter_metric_group_json(f))
+        return builder.build()
+
+    def to_metric_group(self) -> MetricGroup:
+        """Rebuilds the tree of Simple/CompositeMetricGroups that this represents."""
+        def build_simple_group(group_index: int) -> MetricGroup:
+            bar_start, bar_end = self.group_bar_ranges[group_index].tolist()
+            return SimpleMetricGroup(self.bar_lengths[bar_start:bar_end].tolist(),
+                                     self.get_group_tempo_envelope(group_index))
+
+        return self._build_bottom_up(build_simple_group, lambda subgroups: CompositeMetricGroup(subgroups))
+
+    def to_json_dict(self) -> dict:
+        return self.to_metric_group().to_json_dict()
+
+    def save_to_json(self, file_path) -> None:
+        self.to_metric_group().save_to_json(file_path)
+
+    # ------------------------------------- Queries ---------------------------------------
+
+    @property
+    def num_groups(self) -> int:
+        return len(self.group_parents)
+
+    def get_bar_lengths(self) -> list[int]:
+        return self.bar_lengths.tolist()
+
+    def get_bar_line_locations(self) -> list[int]:
+        if self._bar_line_locations is None:
+            self._bar_line_locations = self.bar_line_offsets.tolist()
+        return self._bar_line_locations
+
+    def get_group_tempo_envelope(self, group_index: int) -> TempoEnvelope:
+        """Returns a new TempoEnvelope for the given simple group, identical to the one it was built from."""
+        segment_start, segment_end = self.group_segment_ranges[group_index].tolist()
+        return TempoEnvelope.from_segments([
+            EnvelopeSegment(*segment) for segment in zip(
+                self.segment_start_beats[segment_start:segment_end].tolist(),
+                self.segment_end_beats[segment_start:segment_end].tolist(),
+                self.segment_start_levels[segment_start:segment_end].tolist(),
+                self.segment_end_levels[segment_start:segment_end].tolist(),
+                self.segment_curve_shapes[segment_start:segment_end].tolist(),
+            )
+        ])
+
+    def get_tempo_envelope(self) -> TempoEnvelope:
+        """
+        Returns the tempo envelope of the whole piece, as a CompositeMetricGroup would make it. This builds a Python
+        object per segment, so prefer :func:`get_envelope_arrays` for large pieces.
+        """
+        if self._tempo_envelope is None:
+            self._tempo_envelope = self._build_bottom_up(self.get_group_tempo_envelope, _concatenate_envelopes)
+        return self._tempo_envelope
+
+    def _build_bottom_up(self, build_simple_group: Callable[[int], Any], combine: Callable[[list], Any]):
+        # builds a value for every group from those of its subgroups, starting from the simple groups. Groups are
+        # in pre-order, so going through them backwards reaches every subgroup before its parent, with no recursion
+        # however deeply they are nested.
+        children = self._get_children()
+        values = [None] * self.num_groups
+        for group_index in reversed(range(self.num_groups)):
+            if self.group_is_simple[group_index]:
+                values[group_index] = build_simple_group(group_index)
+            else:
+                values[group_index] = combine([values[child] for child in children[group_index]])
+                for child in children[group_index]:
+                    values[child] = None
+        return values[0]
+
+    def _get_children(self) -> list[list[int]]:
+        children = [[] for _ in range(len(self.group_parents))]
+        for group_index, parent in enumerate(self.group_parents.tolist()):
+            if parent >= 0:
+                children[parent].append(group_index)
+        return children
+
+    def get_envelope_arrays(self) -> EnvelopeArrays:
+        """Returns the tempo envelope of the whole piece as EnvelopeArrays, straight from the segment arrays."""
+        # shift each simple group's segments by the beat at which the group starts
+        simple_groups = np.flatnonzero(self.group_is_simple)
+        segment_ranges = self.group_segment_ranges[simple_groups]
+        group_start_beats = self.bar_line_offsets[self.group_bar_ranges[simple_groups, 0]]
+        segment_offsets = np.repeat(group_start_beats, segment_ranges[:, 1] - segment_ranges[:, 0])
+        return EnvelopeArrays(self.segment_start_beats + segment_offsets, self.segment_end_beats + segment_offsets,
+                              self.segment_start_levels, self.segment_end_levels, self.segment_curve_shapes)
+
+    def get_metric_index(self) -> MetricIndex:
+        if self._metric_index is None:
+            self._metric_index = MetricIndex(self.bar_line_offsets, self.get_envelope_arrays())
+        return self._metric_index
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the underlying arrays, in bytes."""
+        return sum(getattr(self, name).nbytes for name in self._ARRAY_NAMES)
+
+    def __repr__(self):
+        return f"CompactMetricGroup(num_bars={len(self.bar_lengths)}, num_groups={self.num_groups}, " \
+               f"num_segments={len(self.segment_start_beats)})"
+
+
+def _concatenate_envelopes(envelopes: list[TempoEnvelope]) -> TempoEnvelope:
+    # follows CompositeMetricGroup.get_tempo_envelope group by group, so that the segment times are rounded the
+    # same way as when the tree's envelopes are appended level by level
+    tempo_envelope = envelopes[0]
+    for te in envelopes[1:]:
+        tempo_envelope.append_envelope(te)
+    return tempo_envelope
+
+
+class _CompactBuilder:
+    """Accumulates groups in pre-order, then packs them into a CompactMetricGroup."""
+
+    def __init__(self):
+        self.bar_lengths = []
+        self.segments = []
+        self.group_parents = []
+        self.group_bar_ranges = []
+        self.group_segment_ranges = []
+        self.group_is_simple = []
+
+    # groups are added with an explicit stack rather than recursion, so that deeply nested groups don't hit the
+    # recursion limit; a None entry closes the composite group whose subgroups come before it on the stack
+
+    def add_metric_group(self, metric_group: MetricGroup, parent: int) -> None:
+        stack = [(metric_group, parent)]
+        while stack:
+            group, parent = stack.pop()
+            if group is None:
+                self._close_group(parent)
+            elif isinstance(group, CompositeMetricGroup):
+                group_index = self._open_group(parent, False)
+                stack.append((None, group_index))
+                stack.extend((subgroup, group_index) for subgroup in reversed(group.groups))
+            elif isinstance(group, CompactMetricGroup):
+                stack.append((group.to_metric_group(), parent))
+            else:
+                self._add_simple_group(group.get_bar_lengths(), group.get_tempo_envelope(), parent)
+
+    def add_json(self, data: dict, parent: int, path: str) -> None:
+        stack = [(data, parent, path)]
+        while stack:
+            data, parent, path = stack.pop()
+            if data is None:
+                self._close_group(parent)
+                continue
+            if not isinstance(data, dict):
+                raise MetricGroupJSONError(path, "expected an object")
+            validate_group({key: value for key, value in data.items() if key != "subgroups"}, "subgroups" in data,
+                           path)
+            if "subgroups" in data:
+                if not isinstance(data["subgroups"], list):
+                    raise MetricGroupJSONError(f"{path}.subgroups", "expected a list of groups")
+                if not data["subgroups"]:
+                    raise MetricGroupJSONError(f"{path}.subgroups", "expected at least one subgroup")
+                group_index = self._open_group(parent, False)
+                stack.append((None, group_index, path))
+                stack.extend((data["subgroups"][i], group_index, f"{path}.subgroups[{i}]")
+                             for i in reversed(range(len(data["subgroups"]))))
+            else:
+                self._add_simple_group(data["bar_lengths"], parse_tempo_envelope(data, path), parent)
+
+    def add_json_events(self, events: Iterator[tuple]) -> None:
+        """Adds the groups of a streamed JSON config, as generated by :func:`json_loader.iter_metric_group_json`."""
+        # the indices of the composite groups that we are inside of
+        stack = []
+        for event in events:
+            parent = stack[-1] if stack else -1
+            if event[0] == "start":
+                stack.append(self._open_group(parent, False))
+            elif event[0] == "group":
+                _, path, data, _ = event
+                self.add_json(data, parent, path)
+            else:
+                group_index = stack.pop()
+                if group_index == len(self.group_parents) - 1:
+                    # nothing was added after it, so it has no subgroups
+                    raise MetricGroupJSONError(f"{event[1]}.subgroups", "expected at least one subgroup")
+                self._close_group(group_index)
+
+    def _add_simple_group(self, bar_lengths: Sequence[int], tempo_envelope: TempoEnvelope, parent: int) -> None:
+        group_index = self._open_group(parent, True)
+        self.bar_lengths.extend(bar_lengths)
+        self.segments.extend((segment.start_time, segment.end_time, segment.start_level, segment.end_level,
+                              segment.curve_shape) for segment in tempo_envelope.segments)
+        self._close_group(group_index)
+
+    def _open_group(self, parent: int, is_simple: bool) -> int:
+        self.group_parents.append(parent)
+        self.group_is_simple.append(is_simple)
+        # the ranges are filled in with their ends when the group is closed
+        self.group_bar_ranges.append(len(self.bar_lengths))
+        self.group_segment_ranges.append(len(self.segments))
+        return len(self.group_parents) - 1
+
+    def _close_group(self, group_index: int) -> None:
+        self.group_bar_ranges[group_index] = (self.group_bar_ranges[group_index], len(self.bar_lengths))
+        self.group_segment_ranges[group_index] = (self.group_segment_ranges[group_index], len(self.segments))
+
+    def build(self) -> CompactMetricGroup:
+        segment_columns = np.array(self.segments, dtype=float).reshape(-1, 5).T
+        return CompactMetricGroup(self.bar_lengths, *segment_columns, self.group_parents, self.group_bar_ranges,
+                                  self.group_segment_ranges, self.group_is_simple)
@@ -0,0 +1,300 @@
+"""
+Incremental LilyPond export of a metric group config that is being edited, and a watch mode that re-exports it
+whenever the file changes::
+
+    python -m composing_time.incremental watch bar_config.json bar_config.ly
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from bisect import bisect_left
+from itertools import accumulate, chain
+from pathlib import Path
+from typing import Callable, Iterator
+import numpy as np
+from .instrumentation import span
+from .json_loader import MetricGroupJSONError, validate_group, parse_tempo_envelope
+from .lilypond_text import (INDENT, MEASURE_INDENT, get_tempo_annotation_key_points, plan_tempo_annotations,
+                            iter_file_header, iter_score_skeleton, iter_measure_head, iter_tempo_skips)
+from .metric_group import MetricGroup
+from .timing import get_bar_times, TICKS_PER_16TH
+
+# ----------------------------- Incremental Export ---------------------------------
+
+# The exporter keeps what it worked out for each simple group on the last export, keyed by the group's JSON text.
+# On the next export, only simple groups whose text has changed are parsed and timed again; every other group's
+# bars are taken as they were, and its timestamps are shifted by the change in its start time (and only re-formatted
+# if a displayed timestamp actually changes). The tempo voice is planned afresh each time, which only involves the
+# segment endpoints, but its text is split at the simple groups' boundaries and each piece is only re-rendered if
+# its skips or what is attached to them have changed.
+#
+# Bar durations are integrated over each simple group's own envelope and timestamps accumulated group by group, so
+# the result matches a fresh IncrementalExporter's, whatever was exported before it. (Compared to
+# MetricGroup.write_lilypond_file, which integrates the concatenated envelope, bar spacings can differ in their last
+# digits.)
+
+
+class _SimpleGroupPart:
+    """
+    Everything about a simple group's bars and tempo that doesn't depend on where it falls in the piece.
+
+    :param fields: the group's JSON fields
+    :param key: the group's JSON text, which identifies it
+    :param path: JSON path of the group, for error messages
+    """
+
+    def __init__(self, fields: dict, key: str, path: str):
+        validate_group(fields, False, path)
+        self.key = key
+        # (the schema allows fractional bar lengths, but a bar needs a whole number of 16ths for a time signature,
+        # and the tempo voice is laid out in whole ticks)
+        if any(length % 1 for length in fields["bar_lengths"]):
+            raise MetricGroupJSONError(f"{path}.bar_lengths", "bars must be whole numbers of 16ths to be exported")
+        bar_lengths = [int(length) for length in fields["bar_lengths"]]
+        tempo_envelope = parse_tempo_envelope(fields, path)
+        self.num_16ths = sum(bar_lengths)
+        _, bar_times = get_bar_times(list(accumulate([0] + bar_lengths)), tempo_envelope)
+        bar_times = bar_times.tolist()
+        # the start time of each bar, relative to the start of the group (accumulated as in _iter_measures)
+        bar_offsets = list(accumulate([0.0] + bar_times))
+        self.duration = bar_offsets.pop()
+        self.bar_offsets = np.array(bar_offsets)
+        # the text of each bar up to the digits of its timestamp
+        self.bar_heads = ["\n".join(iter_measure_head(md, t)) + "\n" + MEASURE_INDENT + INDENT + '_ "'
+                          for md, t in zip(bar_lengths, bar_times)]
+        self.key_points = get_tempo_annotation_key_points(tempo_envelope, ticks_per_beat=TICKS_PER_16TH)
+
+    def get_measures_text(self, whole_seconds: np.ndarray) -> str:
+        """
+        The text of the group's bars, given the time of each bar in whole seconds.
+        """
+        tail = '"\n' + MEASURE_INDENT + "}"
+        return "\n".join(f"{head}{minutes:02d}:{seconds:02d}{tail}" for head, minutes, seconds
+                         in zip(self.bar_heads, (whole_seconds // 60).tolist(), (whole_seconds % 60).tolist()))
+
+
+class IncrementalExporter:
+    """
+    Exports successive versions of a metric group config to LilyPond, redoing only what each edit changed. Each
+    export gives the same source as write_lilypond_file (bar spacings aside; see above).
+
+    :param proportional_duration: see :func:`~composing_time.abjad_utils.create_blank_lilypond_file`
+    :param page_size_in: see :func:`~composing_time.abjad_utils.create_blank_lilypond_file`
+    :param merge_tempo_skips: see :func:`~composing_time.abjad_utils.create_blank_score`
+    :ivar stats: counts from the last export: "groups" (simple groups in the config), "groups_rebuilt" (those
+        that had to be parsed and timed), "tempo_pieces_rendered" and "measure_pieces_rendered" (pieces of the
+        tempo voice and staff whose text had to be generated)
+    """
+
+    def __init__(self, proportional_duration: tuple[int, int] = (1, 20), page_size_in: tuple[float, float] = (17, 11),
+                 merge_tempo_skips: bool = False):
+        self.proportional_duration = proportional_duration
+        self.page_size_in = page_size_in
+        self.merge_tempo_skips = merge_tempo_skips
+        # everything from the last export, as {key: value}, so that anything not used again is dropped
+        self._parts = {}
+        self._tempo_texts = {}
+        self._measure_texts = {}
+        self.stats = {}
+
+    def export(self, config: dict | MetricGroup) -> str:
+        """
+        Returns the LilyPond source for the given config, reusing whatever it shares with the previous one.
+
+        :param config: the JSON dictionary of the config (or a MetricGroup)
+        :raises MetricGroupJSONError: if the config doesn't match the schema
+        """
+        if isinstance(config, MetricGroup):
+            config = config.to_json_dict()
+        with span("incremental_export"):
+            parts = self._get_parts(config)
+            start_ticks = list(accumulate([0] + [part.num_16ths * TICKS_PER_16TH for part in parts]))
+            start_times = list(accumulate([0.0] + [part.duration for part in parts]))
+            text = "\n".join(chain(
+                iter_file_header(self.proportional_duration, self.page_size_in),
+                iter_score_skeleton(self._get_tempo_texts(parts, start_ticks),
+                                    self._get_measure_texts(parts, start_times))
+            ))
+        return text
+
+    def export_file(self, config_path: str | Path, output_path: str | Path) -> Path:
+        """
+        Exports a JSON config file to a LilyPond file. The output file is replaced in one go, so nothing watching it
+        ever sees it half written.
+
+        :return: output_path, as a Path
+        """
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        text = self.export(config)
+        output_path = Path(output_path)
+        temp_path = output_path.with_name(output_path.name + ".tmp")
+        try:
+            with open(temp_path, "w") as f:
+                f.write(text)
+            os.replace(temp_path, output_path)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return output_path
+
+    def _get_parts(self, config: dict) -> list[_SimpleGroupPart]:
+        # built up separately and only kept if the whole config is valid, so that a failed export doesn't lose any
+        # of the parts from the last successful one
+        new_parts = {}
+        parts = []
+        num_rebuilt = 0
+        for fields, path in _iter_simple_groups(config):
+            try:
+                key = json.dumps(fields, sort_keys=True)
+            except (TypeError, ValueError):
+                # not plain JSON data, so let validation say what's wrong
+                validate_group(fields, False, path)
+                raise
+            if key not in new_parts:
+                if key in self._parts:
+                    new_parts[key] = self._parts[key]
+                else:
+                    new_parts[key] = _SimpleGroupPart(fields, key, path)
+                    num_rebuilt += 1
+            parts.append(new_parts[key])
+        self._parts = new_parts
+        self.stats = {"groups": len(parts), "groups_rebuilt": num_rebuilt}
+        return parts
+
+    def _get_tempo_texts(self, parts: list[_SimpleGroupPart], start_ticks: list[int]) -> Iterator[str]:
+        # the text of the tempo voice's skips, a piece per simple group
+        key_points = [(tick + start, tempo) for part, start in zip(parts, start_ticks)
+                      for tick, tempo in part.key_points]
+        plan = plan_tempo_annotations(key_points)
+        skip_lengths, _ = plan.get_skip_layout(self.merge_tempo_skips)
+        attachments = plan.get_attachments(self.merge_tempo_skips)
+        attached_skips = list(attachments)
+        skip_starts = (list(accumulate([0] + skip_lengths[:-1])) if self.merge_tempo_skips
+                       else range(len(skip_lengths)))
+
+        # each simple group's piece has the skips starting within it (on the 16th-note grid)
+        boundaries = [bisect_left(skip_starts, start // TICKS_PER_16TH) for start in start_ticks[1:-1]]
+        previous_texts, self._tempo_texts = self._tempo_texts, {}
+        num_rendered = 0
+        for first, end in zip([0] + boundaries, boundaries + [len(skip_lengths)]):
+            lengths = tuple(skip_lengths[first:end]) if self.merge_tempo_skips else end - first
+            attached = tuple((index - first, tuple(attachments[index])) for index
+                             in attached_skips[bisect_left(attached_skips, first):bisect_left(attached_skips, end)])
+            key = (lengths, attached)
+            if key not in self._tempo_texts:
+                if key in previous_texts:
+                    self._tempo_texts[key] = previous_texts[key]
+                else:
+                    self._tempo_texts[key] = "\n".join(iter_tempo_skips([1] * lengths if isinstance(lengths, int)
+                                                                        else lengths, dict(attached)))
+                    num_rendered += 1
+            if self._tempo_texts[key]:
+                yield self._tempo_texts[key]
+        self.stats["tempo_pieces_rendered"] = num_rendered
+
+    def _get_measure_texts(self, parts: list[_SimpleGroupPart], start_times: list[float]) -> Iterator[str]:
+        # the text of the bars, a piece per simple group
+        previous_texts, self._measure_texts = self._measure_texts, {}
+        num_rendered = 0
+        for part, start_time in zip(parts, start_times):
+            # the timestamps only show whole seconds, so a piece only needs redoing if one of those changes
+            whole_seconds = np.floor(part.bar_offsets + start_time).astype(np.int64)
+            key = (part.key, whole_seconds.tobytes())
+            if key not in self._measure_texts:
+                if key in previous_texts:
+                    self._measure_texts[key] = previous_texts[key]
+                else:
+                    self._measure_texts[key] = part.get_measures_text(whole_seconds)
+                    num_rendered += 1
+            yield self._measure_texts[key]
+        self.stats["measure_pieces_rendered"] = num_rendered
+
+
+def _iter_simple_groups(data: dict) -> Iterator[tuple[dict, str]]:
+    # the simple groups of a config in order, as (fields, JSON path), checking the composite groups along the way
+    stack = [(data, "$")]
+    while stack:
+        group, path = stack.pop()
+        if not isinstance(group, dict):
+            raise MetricGroupJSONError(path, "expected an object")
+        if "subgroups" not in group:
+            yield group, path
+            continue
+        subgroups = group["subgroups"]
+        if not isinstance(subgroups, list):
+            raise MetricGroupJSONError(f"{path}.subgroups", "expected a list of groups")
+        validate_group({key: value for key, value in group.items() if key != "subgroups"}, True, path)
+        if not subgroups:
+            raise MetricGroupJSONError(f"{path}.subgroups", "expected at least one subgroup")
+        stack.extend((subgroups[i], f"{path}.subgroups[{i}]") for i in reversed(range(len(subgroups))))
+
+
+# ----------------------------- Watch Mode ---------------------------------
+
+def watch(config_path: str | Path, output_path: str | Path, poll_interval: float = 0.1,
+          exporter: IncrementalExporter = None, log: Callable[[str], None] = print,
+          should_stop: Callable[[], bool] = None) -> None:
+    """
+    Exports a JSON config file to LilyPond, then re-exports it every time the file changes. Errors in the config
+    (or a half-saved file), and failures to read it or write the output, are logged, and the next change is waited
+    for.
+
+    :param config_path: the JSON config file to watch
+    :param output_path: the LilyPond file to write
+    :param poll_interval: how often to check the config file for changes, in seconds
+    :param exporter: the IncrementalExporter to use (a new one with default settings by default)
+    :param log: called with a line of text after each export or failed export
+    :param should_stop: if given, called after each check; watching stops once it returns True (otherwise it
+        continues until interrupted)
+    """
+    exporter = IncrementalExporter() if exporter is None else exporter
+    last_version = None
+    while should_stop is None or not should_stop():
+        try:
+            stat = os.stat(config_path)
+        except FileNotFoundError:
+            # (some editors save by deleting and re-creating the file)
+            stat = None
+        version = None if stat is None else (stat.st_mtime_ns, stat.st_size)
+        if version is not None and version != last_version:
+            last_version = version
+            start = time.perf_counter()
+            try:
+                exporter.export_file(config_path, output_path)
+            except (ValueError, OSError) as e:
+                log(f"{config_path}: not exported: {e}")
+            else:
+                log(f"{config_path}: exported to {output_path} in {(time.perf_counter() - start) * 1000:.0f} ms "
+                    f"({exporter.stats['groups_rebuilt']} of {exporter.stats['groups']} groups rebuilt)")
+        time.sleep(poll_interval)
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m composing_time.incremental",
+                                     description="Exports a metric group config to LilyPond, optionally re-exporting "
+                                                 "it whenever it changes.")
+    parser.add_argument("command", choices=("export", "watch"),
+                        help="export once, or keep re-exporting whenever the config changes")
+    parser.add_argument("config", help="JSON metric group config")
+    parser.add_argument("output", help="LilyPond file to write")
+    parser.add_argument("--merge-tempo-skips", action="store_true")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between checks for changes")
+    args = parser.parse_args(args)
+
+    exporter = IncrementalExporter(merge_tempo_skips=args.merge_tempo_skips)
+    if args.command == "export":
+        exporter.export_file(args.config, args.output)
+        return 0
+    try:
+        watch(args.config, args.output, args.poll_interval, exporter)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+# ----------------------------- Instrumentation ---------------------------------
+
+# The export pipeline is wrapped in named timing spans (loading, envelope concatenation, bar timing, score building,
+# tempo voice building, LilyPond writing) and bumps counters (bars processed, skips created, annotations emitted,
+# bytes written). None of this is recorded unless a Recorder is activated with `instrument`: otherwise `span`
+# hands back a shared do-nothing context manager and `count` returns straight away, so the instrumentation costs
+# little more than a function call.
+#
+#     with instrument() as recorder:
+#         metric_group.write_lilypond_file(f)
+#     recorder.write_trace_events("export.trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+#
+# The active recorder is held in a context variable, so each thread (and asyncio task) has its own: activating a
+# recorder in one thread doesn't record what other threads are doing at the same time. To record work handed to
+# other threads, run it in a copy of the activating context (contextvars.copy_context().run); a Recorder can be
+# added to from several threads at once.
+
+_active_recorder: ContextVar["Recorder | None"] = ContextVar("composing_time_active_recorder", default=None)
+
+
+class Recorder:
+    """
+    Collects the spans and counters emitted while it is active.
+
+    :param on_span: if given, called as on_span(name, start_seconds, duration_seconds, args) as each span ends
+    :param on_count: if given, called as on_count(name, value, total) each time a counter is bumped
+    """
+
+    def __init__(self, on_span: Callable[[str, float, float, dict], None] = None,
+                 on_count: Callable[[str, float, float], None] = None):
+        self.on_span = on_span
+        self.on_count = on_count
+        self.start_ns = time.perf_counter_ns()
+        # (name, start ns, duration ns, thread id, args)
+        self.spans = []
+        self.counters = defaultdict(int)
+        # (name, time ns, running total), for drawing counters over time
+        self.counter_events = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start_ns: int, duration_ns: int, args: dict) -> None:
+        with self._lock:
+            self.spans.append((name, start_ns, duration_ns, threading.get_ident(), args))
+        if self.on_span is not None:
+            self.on_span(name, (start_ns - self.start_ns) / 1e9, duration_ns / 1e9, args)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+            total = self.counters[name]
+            self.counter_events.append((name, time.perf_counter_ns(), total))
+        if self.on_count is not None:
+            self.on_count(name, value, total)
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Totals by span name and the final counter values.
+
+        :return: dictionary with "spans" (name -> {"calls", "total_seconds"}) and "counters" (name -> total)
+        """
+        spans = defaultdict(lambda: {"calls": 0, "total_seconds": 0.0})
+        for name, _, duration_ns, _, _ in self.spans:
+            spans[name]["calls"] += 1
+            spans[name]["total_seconds"] += duration_ns / 1e9
+        return {"spans": dict(spans), "counters": dict(self.counters)}
+
+    def to_trace_events(self) -> dict[str, Any]:
+        """Returns the recorded spans and counters in the Trace Event Format (as read by trace viewers)."""
+        pid = os.getpid()
+        events = [
+            {"name": name, "cat": "composing_time", "ph": "X", "pid": pid, "tid": thread_id,
+             "ts": (start_ns - self.start_ns) / 1000, "dur": duration_ns / 1000, "args": args}
+            for name, start_ns, duration_ns, thread_id, args in self.spans
+        ]
+        events.extend(
+            {"name": name, "cat": "composing_time", "ph": "C", "pid": pid, "ts": (time_ns - self.start_ns) / 1000,
+             "args": {name: total}}
+            for name, time_ns, total in self.counter_events
+        )
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace_events(self, file_path: str | Path) -> Path:
+        """
+        Writes the recorded spans and counters to a trace-event JSON file.
+
+        :return: file_path, as a Path
+        """
+        file_path = Path(file_path)
+        with open(file_path, "w") as f:
+            json.dump(self.to_trace_events(), f)
+        return file_path
+
+
+@contextmanager
+def instrument(recorder: Recorder = None) -> Iterator[Recorder]:
+    """
+    Records spans and counters for the duration of the with block.
+
+    :param recorder: the Recorder to record into (a new one by default)
+    :return: the Recorder
+    """
+    recorder = Recorder() if recorder is None else recorder
+    token = _active_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active_recorder.reset(token)
+
+
+def is_enabled() -> bool:
+    return _active_recorder.get() is not None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "args", "start_ns")
+
+    def __init__(self, recorder: Recorder, name: str, args: dict):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_span(self.name, self.start_ns, time.perf_counter_ns() - self.start_ns, self.args)
+        return False
+
+
+def span(name: str, **args):
+    """
+    Context manager timing the enclosed block as a span with the given name. Any keyword arguments are recorded
+    with the span.
+    """
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name, args)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Adds value to the named counter."""
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def traced(name: str):
+    """Decorator that records every call of the decorated function as a span with the given name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _active_recorder.get()
+            if recorder is None:
+                return function(*args, **kwargs)
+            with _Span(recorder, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
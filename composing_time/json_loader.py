@@ -0,0 +1,404 @@
+import json
+import re
+from numbers import Real
+from typing import Iterator, TextIO
+from clockblocks import TempoEnvelope
+from .metric_group import MetricGroup, SimpleMetricGroup, CompositeMetricGroup, fit_tempo_envelope
+from .instrumentation import traced
+
+# ----------------------------- Streaming JSON Loading ---------------------------------
+
+# Metric group configs are read a chunk at a time and turned into groups as soon as each group's closing brace is
+# read, so neither the whole file nor the whole dictionary tree is ever held in memory. The nesting of subgroups is
+# followed with an explicit stack rather than recursion, and only the leaves of each group (bar_lengths, tempo
+# fields) are handed to the json module's decoder. Every group is checked against the schema below as soon as it
+# is complete, and errors give the JSON path of the offending group or field, e.g. $.subgroups[3].tempo_envelope.
+
+
+class MetricGroupJSONError(ValueError):
+    """
+    Raised when a metric group config is malformed or doesn't match the schema.
+
+    :param path: JSON path of the offending value, e.g. "$.subgroups[2].bar_lengths"
+    :param message: what is wrong with it
+    """
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+_TEMPO_KEYS = ("tempo", "end_tempo", "tempo_curvature", "tempo_envelope")
+_SIMPLE_GROUP_KEYS = ("bar_lengths",) + _TEMPO_KEYS
+_TEMPO_ENVELOPE_KEYS = ("levels", "durations", "curve_shapes", "units", "duration_units")
+
+
+def _is_number(value) -> bool:
+    # (checking the exact type first is much quicker than the isinstance check against the Real ABC)
+    return type(value) in (int, float) or isinstance(value, Real) and not isinstance(value, bool)
+
+
+def _check_number_list(value, path: str, minimum: float, allow_minimum: bool, allow_empty: bool = False) -> None:
+    if not isinstance(value, list) or (not value and not allow_empty):
+        raise MetricGroupJSONError(path, f"expected a {'' if allow_empty else 'non-empty '}list of numbers")
+    if all(type(x) in (int, float) for x in value) and \
+            (not value or (min(value) >= minimum if allow_minimum else min(value) > minimum)):
+        return
+    for i, x in enumerate(value):
+        if not _is_number(x) or x < minimum or (x == minimum and not allow_minimum):
+            comparison = "at least" if allow_minimum else "greater than"
+            raise MetricGroupJSONError(f"{path}[{i}]", f"expected a number {comparison} {minimum}, got {x!r}")
+
+
+def validate_group(fields: dict, has_subgroups: bool, path: str = "$") -> None:
+    """
+    Checks the fields of a single metric group against the config schema: a group either has a non-empty list of
+    "subgroups" and nothing else, or it has "bar_lengths" and either a "tempo" (with optional "end_tempo" and
+    "tempo_curvature") or a "tempo_envelope" (the keyword arguments of a TempoEnvelope).
+
+    :param fields: the group's fields, other than its subgroups
+    :param has_subgroups: whether the group has a "subgroups" list
+    :param path: JSON path of the group, for error messages
+    """
+    if has_subgroups:
+        for key in fields:
+            raise MetricGroupJSONError(f"{path}.{key}", "a group with subgroups can't have other fields")
+        return
+    for key in fields:
+        if key not in _SIMPLE_GROUP_KEYS:
+            raise MetricGroupJSONError(f"{path}.{key}", f"unknown field (expected one of subgroups, "
+                                                        f"{', '.join(_SIMPLE_GROUP_KEYS)})")
+    if "bar_lengths" not in fields:
+        raise MetricGroupJSONError(path, "a group needs either subgroups or bar_lengths")
+    _check_number_list(fields["bar_lengths"], f"{path}.bar_lengths", 0, False)
+
+    if ("tempo" in fields) == ("tempo_envelope" in fields):
+        raise MetricGroupJSONError(path, "a group needs exactly one of tempo or tempo_envelope")
+    if "tempo" in fields:
+        for key in ("tempo", "end_tempo"):
+            if key in fields and not (_is_number(fields[key]) and fields[key] > 0):
+                raise MetricGroupJSONError(f"{path}.{key}", f"expected a positive number, got {fields[key]!r}")
+        if "tempo_curvature" in fields and not _is_number(fields["tempo_curvature"]):
+            raise MetricGroupJSONError(f"{path}.tempo_curvature", "expected a number")
+        return
+
+    for key in ("end_tempo", "tempo_curvature"):
+        if key in fields:
+            raise MetricGroupJSONError(f"{path}.{key}", "can only be used with tempo, not tempo_envelope")
+    envelope, envelope_path = fields["tempo_envelope"], f"{path}.tempo_envelope"
+    if not isinstance(envelope, dict):
+        raise MetricGroupJSONError(envelope_path, "expected an object")
+    for key in envelope:
+        if key not in _TEMPO_ENVELOPE_KEYS:
+            raise MetricGroupJSONError(f"{envelope_path}.{key}", f"unknown field (expected one of "
+                                                                 f"{', '.join(_TEMPO_ENVELOPE_KEYS)})")
+    if "levels" not in envelope:
+        raise MetricGroupJSONError(envelope_path, "missing levels")
+    _check_number_list(envelope["levels"], f"{envelope_path}.levels", 0, False)
+    num_segments = len(envelope["levels"]) - 1
+    _check_number_list(envelope.get("durations", []), f"{envelope_path}.durations", 0, True, allow_empty=True)
+    for key in ("durations", "curve_shapes"):
+        if (key in envelope or key == "durations") and len(envelope.get(key, [])) != num_segments:
+            raise MetricGroupJSONError(f"{envelope_path}.{key}", f"expected {num_segments} values (one fewer "
+                                                                 f"than levels), got {len(envelope.get(key, []))}")
+    if "curve_shapes" in envelope:
+        for i, curve_shape in enumerate(envelope["curve_shapes"]):
+            if not (_is_number(curve_shape) or isinstance(curve_shape, str)):
+                raise MetricGroupJSONError(f"{envelope_path}.curve_shapes[{i}]", "expected a number or string")
+    if envelope.get("units", "tempo").lower().replace(" ", "") not in ("tempo", "rate", "beatlength"):
+        raise MetricGroupJSONError(f"{envelope_path}.units", "expected tempo, rate or beatlength")
+    if envelope.get("duration_units", "beats") not in ("beats", "time"):
+        raise MetricGroupJSONError(f"{envelope_path}.duration_units", "expected beats or time")
+
+
+def parse_tempo_envelope(fields: dict, path: str = "$") -> TempoEnvelope:
+    """
+    Creates the tempo envelope of a validated simple group, fitted to the group's length.
+
+    :raises MetricGroupJSONError: if TempoEnvelope rejects the tempo fields (e.g. an unreadable curve shape)
+    """
+    try:
+        tempo_envelope = MetricGroup._parse_tempo_envelope(fields)
+    except (ValueError, TypeError, AssertionError, ZeroDivisionError) as e:
+        raise MetricGroupJSONError(path, f"invalid tempo: {e}")
+    return fit_tempo_envelope(tempo_envelope, sum(fields["bar_lengths"]))
+
+
+class _GroupBuilder:
+    """
+    Builds metric groups from their JSON fields, validating each one. Identical simple group definitions are only
+    validated once and share a single parsed TempoEnvelope, which each group copies before handing it out through
+    its tempo_envelope property.
+    """
+
+    def __init__(self):
+        # parsed tempo envelopes of the simple groups seen so far, keyed by their JSON text (identical text means
+        # identical groups)
+        self._tempo_envelopes = {}
+
+    def build(self, fields: dict, subgroups: list[MetricGroup] | None, path: str, key: str = None) -> MetricGroup:
+        """
+        Builds a single group from its fields and (for a composite group) its already-built subgroups.
+
+        :param key: the JSON text of a simple group, if known (otherwise its fields are serialized to get one)
+        """
+        if subgroups is not None:
+            validate_group(fields, True, path)
+            if not subgroups:
+                raise MetricGroupJSONError(f"{path}.subgroups", "expected at least one subgroup")
+            return CompositeMetricGroup(subgroups)
+        if key is None:
+            try:
+                key = json.dumps(fields, sort_keys=True)
+            except (TypeError, ValueError):
+                # not plain JSON data (only possible when parsing a dictionary), so let validation say what's wrong
+                pass
+        if key not in self._tempo_envelopes:
+            validate_group(fields, False, path)
+            tempo_envelope = parse_tempo_envelope(fields, path)
+            if key is None:
+                return SimpleMetricGroup(fields["bar_lengths"], tempo_envelope)
+            self._tempo_envelopes[key] = tempo_envelope
+        # each group gets its own copy of the bar lengths list, since it may be mutated
+        return SimpleMetricGroup._with_shared_envelope(list(fields["bar_lengths"]), self._tempo_envelopes[key])
+
+    def build_from_dict(self, data: dict, path: str, text: str = None) -> MetricGroup:
+        """
+        Builds a group, and any subgroups, from its JSON dictionary, iteratively rather than recursively.
+
+        :param text: the JSON text that the dictionary was decoded from, if known, which then serves as the key for
+            sharing the tempo envelopes of identical simple groups
+        """
+        if isinstance(data, dict) and "subgroups" not in data:
+            return self.build(data, None, path, text)
+        # each entry is (group dictionary, its path, the subgroups built so far or None for a simple group)
+        stack = [(data, path, None)]
+        while True:
+            group_data, group_path, subgroups = stack[-1]
+            if not isinstance(group_data, dict):
+                raise MetricGroupJSONError(group_path, "expected an object")
+            if "subgroups" in group_data:
+                if not isinstance(group_data["subgroups"], list):
+                    raise MetricGroupJSONError(f"{group_path}.subgroups", "expected a list of groups")
+                if subgroups is None:
+                    subgroups = []
+                    stack[-1] = (group_data, group_path, subgroups)
+                if len(subgroups) < len(group_data["subgroups"]):
+                    index = len(subgroups)
+                    stack.append((group_data["subgroups"][index], f"{group_path}.subgroups[{index}]", None))
+                    continue
+            fields = {key: value for key, value in group_data.items() if key != "subgroups"}
+            group = self.build(fields, subgroups, group_path)
+            stack.pop()
+            if not stack:
+                return group
+            stack[-1][2].append(group)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SUBGROUPS_START = re.compile(r'\{[ \t\n\r]*"subgroups"[ \t\n\r]*:[ \t\n\r]*\[')
+
+
+class _JSONReader:
+    """Reads a JSON text a chunk at a time, handing complete values to the json module's decoder."""
+
+    # enough lookahead that a number (or the start of a group) is never cut off at the end of the buffer
+    MIN_LOOKAHEAD = 64
+
+    def __init__(self, file: TextIO, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        # position of the start of the buffer within the whole text
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character (or "" at the end of the text)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def _ensure_lookahead(self) -> None:
+        while len(self.buffer) - self.pos < self.MIN_LOOKAHEAD and self._fill():
+            pass
+
+    def match(self, pattern: re.Pattern) -> bool:
+        """Consumes the given pattern if the text continues with it."""
+        self.peek()
+        self._ensure_lookahead()
+        match = pattern.match(self.buffer, self.pos)
+        if match:
+            self.pos = match.end()
+        return match is not None
+
+    def expect(self, characters: str, path: str) -> str:
+        """Consumes the next character, which must be one of the given ones."""
+        character = self.peek()
+        if character == "" or character not in characters:
+            found = repr(character) if character else "end of file"
+            raise MetricGroupJSONError(path, f"expected {' or '.join(map(repr, characters))} but found {found} "
+                                             f"(at character {self.offset + self.pos})")
+        self.pos += 1
+        return character
+
+    def value(self, path: str):
+        """Decodes the next complete JSON value."""
+        return self.value_and_text(path)[0]
+
+    def value_and_text(self, path: str):
+        """Decodes the next complete JSON value, returning it along with the text it was decoded from."""
+        self.peek()
+        self._ensure_lookahead()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # the value may just run past the end of what we've read so far
+                if (e.pos >= len(self.buffer) - self.MIN_LOOKAHEAD or e.msg.startswith("Unterminated")) \
+                        and self._fill():
+                    continue
+                raise MetricGroupJSONError(path, f"invalid JSON: {e.msg} (at character {self.offset + e.pos})")
+            start, self.pos = self.pos, end
+            return value, self.buffer[start:end]
+
+
+def iter_metric_group_json(file: TextIO, chunk_size: int = 1 << 20) -> Iterator[tuple]:
+    """
+    Reads a metric group config from a JSON text file a chunk at a time, generating its groups in pre-order, so
+    that it can be built into any kind of metric group without holding the whole text or dictionary in memory.
+
+    Generates ("start", path) when a composite group's subgroups list opens (if "subgroups" is its first field),
+    ("end", path) when that group closes, and ("group", path, data, text) for every other group, with its decoded
+    JSON dictionary and the text it was decoded from. Only the structure is checked here; the groups themselves are
+    left to be validated by whatever builds them.
+
+    :param file: text file handle to read from
+    :param chunk_size: number of characters to read at a time
+    :raises MetricGroupJSONError: if the file is not valid JSON, or a group is malformed
+    """
+    reader = _JSONReader(file, chunk_size)
+    # the paths of the composite groups that we are inside of, and how many subgroups each has so far
+    stack = []
+    path = "$"
+    while True:
+        if reader.match(_SUBGROUPS_START):
+            yield "start", path
+            stack.append([path, 0])
+            list_ended = reader.peek() == "]"
+            if list_ended:
+                reader.pos += 1
+        else:
+            # a group that doesn't open with its subgroups list is a simple group (or an invalid one), which is
+            # small enough to decode in one go
+            data, text = reader.value_and_text(path)
+            yield "group", path, data, text
+            if not stack:
+                break
+            stack[-1][1] += 1
+            list_ended = reader.expect(",]", f"{stack[-1][0]}.subgroups") == "]"
+
+        while list_ended:
+            # close the composite group whose subgroups list just ended
+            group_path, _ = stack.pop()
+            if reader.expect(",}", group_path) == ",":
+                key = reader.value(group_path)
+                raise MetricGroupJSONError(f"{group_path}.{key}", "a group with subgroups can't have other fields")
+            yield "end", group_path
+            if not stack:
+                break
+            stack[-1][1] += 1
+            list_ended = reader.expect(",]", f"{stack[-1][0]}.subgroups") == "]"
+        if not stack:
+            break
+        path = f"{stack[-1][0]}.subgroups[{stack[-1][1]}]"
+
+    if reader.peek() != "":
+        raise MetricGroupJSONError("$", f"unexpected data after the end of the config "
+                                        f"(at character {reader.offset + reader.pos})")
+
+
+@traced("load_json")
+def load_metric_group_json(file: TextIO, chunk_size: int = 1 << 20) -> MetricGroup:
+    """
+    Reads a metric group config from a JSON text file, validating each group as it is read.
+
+    :param file: text file handle to read from
+    :param chunk_size: number of characters to read at a time
+    :return: the metric group
+    :raises MetricGroupJSONError: if the file is not valid JSON or doesn't match the config schema
+    """
+    builder = _GroupBuilder()
+    # the subgroups read so far of each composite group that we are inside of
+    stack = []
+    for event in iter_metric_group_json(file, chunk_size):
+        if event[0] == "start":
+            stack.append([])
+            continue
+        if event[0] == "group":
+            _, path, data, text = event
+            group = builder.build_from_dict(data, path, text)
+        else:
+            group = builder.build({}, stack.pop(), event[1])
+        if stack:
+            stack[-1].append(group)
+    return group
+
+
+@traced("parse_json")
+def parse_metric_group_dict(data: dict) -> MetricGroup:
+    """
+    Builds a metric group from an already-loaded JSON dictionary, with the same validation and sharing of tempo
+    envelopes as :func:`load_metric_group_json`. Works iteratively, so any depth of nesting is fine.
+
+    :param data: the JSON dictionary
+    :return: the metric group
+    :raises MetricGroupJSONError: if the dictionary doesn't match the config schema
+    """
+    return _GroupBuilder().build_from_dict(data, "$")
+
+
+# ----------------------------- JSON Writing ---------------------------------
+
+def dump_metric_group_json(metric_group: MetricGroup, file: TextIO, indent: int = 2) -> None:
+    """
+    Writes a metric group's config to a JSON text file, exactly as json.dump(metric_group.to_json_dict(), file,
+    indent=indent) would, but following the subgroups with an explicit stack, so any depth of nesting is fine.
+    """
+    # each entry is either text to write or a (group, nesting level) pair to expand
+    stack = [(metric_group, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            file.write(item)
+            continue
+        group, level = item
+        padding = " " * (indent * level)
+        if not isinstance(group, CompositeMetricGroup):
+            # a simple group is small enough to hand to the json module, once indented to where it sits
+            file.write(json.dumps(group.to_json_dict(), indent=indent).replace("\n", "\n" + padding))
+            continue
+        inner_padding = padding + " " * indent
+        items = ["{\n" + inner_padding + '"subgroups": [\n']
+        for i, subgroup in enumerate(group.groups):
+            items.append((",\n" if i else "") + inner_padding + " " * indent)
+            items.append((subgroup, level + 2))
+        items.append("\n" + inner_padding + "]\n" + padding + "}")
+        stack.extend(reversed(items))
@@ -0,0 +1,503 @@
+import subprocess
+from collections import defaultdict
+from fractions import Fraction
+from functools import cache, lru_cache
+from importlib import util
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterable, Iterator, Sequence, TextIO
+import bisect
+from clockblocks import TempoEnvelope
+from .timing import get_bar_times, beats_to_ticks, TICKS_PER_QUARTER, TICKS_PER_16TH
+from .instrumentation import count, span
+
+# ----------------------------- LilyPond Templates ---------------------------------
+
+layout_block_text = r"""
+\context {{
+    \Score
+     proportionalNotationDuration = #(ly:make-moment {pdur_numerator}/{pdur_denominator})
+}}
+"""
+
+paper_block_text = r"""
+#(set-paper-size '(cons (* {width} in) (* {height} in)))
+ragged-right = ##t
+indent = #0
+"""
+
+respace_text = r"""
+\newSpacingSection
+\override Score.SpacingSpanner.spacing-increment = #{spacing}
+"""
+
+# moves timekeeping from the score to each staff, so that staves can have bars of different lengths
+per_staff_timing_text = r"""
+\context {
+    \Score
+    \remove Timing_translator
+    \remove Default_bar_line_engraver
+    \override SpacingSpanner.uniform-stretching = ##t
+}
+\context {
+    \Staff
+    \consists Timing_translator
+    \consists Default_bar_line_engraver
+}
+"""
+
+# the left tweaks don't start with a "-" because this is inserted by abjad
+tempo_spanner_tweaks_left = r"""\tweak bound-details.left.text \markup \small {{\note {{ {note_type} }} #1 "= {tempo}"}} 
+- \tweak bound-details.left-broken.text ##f"""
+
+tempo_spanner_tweaks_left_parenthesized = r"""\tweak bound-details.left.text \markup \small {{"(" \note {{ {note_type} }} #1 "= {tempo})"}} 
+- \tweak bound-details.left-broken.text ##f"""
+
+# this is just concatenated to the left tweak, so does start with a "-"
+tempo_spanner_tweaks_right_parenthesized = r"""- \tweak bound-details.right.text \markup \small {{"(" \note {{ {note_type} }} #1 "= {tempo})"}} 
+- \tweak bound-details.right-broken.text ##f"""
+
+tempo_spanner_padding_tweak = r"""- \tweak bound-details.right.padding #{}"""
+
+tempo_markup = r"""\markup \small {{\note {{ {note_type} }} #1 "= {tempo}"}}"""
+
+parenthesized_tempo_markup = r"""\markup \small {{ "(" \note {{ {note_type} }} #1 "= {tempo})"}}"""
+
+
+# ----------------------------- Backend-independent Planning ---------------------------------
+
+def get_tempo_annotations(tempo_envelope: TempoEnvelope, parenthesized_end_offset=0.25,
+                          ticks_per_beat: int = TICKS_PER_QUARTER):
+    """
+    Plans the tempo annotations for a tempo envelope, independently of how they are rendered.
+
+    :param tempo_envelope: the tempo envelope, with durations in quarter notes (unless ticks_per_beat says
+        otherwise)
+    :param parenthesized_end_offset: how far (in quarter notes) before the end of a segment to stop a spanner that
+        ends in a parenthesized tempo
+    :param ticks_per_beat: how many ticks make up a beat of the envelope (see :func:`get_tempo_annotation_plan`)
+    :return: list of (start_tick, end_tick, lilypond_string) tuples. For a plain tempo marking end_tick is None and
+        the string is its markup; otherwise the annotation is a text spanner (arrow) from start_tick to end_tick
+        and the string holds the spanner's tweaks.
+    """
+    return list(get_tempo_annotation_plan(tempo_envelope, parenthesized_end_offset, ticks_per_beat).annotations)
+
+
+class TempoAnnotationPlan:
+    """
+    The tempo annotations of a tempo envelope, along with the layout of the tempo voice that carries them. Plans
+    only depend on the endpoints of the envelope's segments, and are cached by them (see
+    :func:`get_tempo_annotation_plan`), so a plan is shared by every export of the same tempos, whichever backend
+    renders it. Treat plans as read-only.
+
+    :param annotation_key_points: the (tick, tempo) pairs at the start and end of each non-empty segment, as given
+        by :func:`get_tempo_annotation_key_points`
+    :param parenthesized_end_offset: see :func:`get_tempo_annotations`
+    :ivar annotations: tuple of (start_tick, end_tick, lilypond_string) (see :func:`get_tempo_annotations`). Equal
+        strings are the same object.
+    :ivar time_points: the sorted, distinct ticks at which annotations occur
+    """
+
+    __slots__ = ("annotations", "time_points", "_layouts")
+
+    def __init__(self, annotation_key_points: Sequence[tuple[int, float]], parenthesized_end_offset=0.25):
+        self.annotations = tuple(_plan_annotations(annotation_key_points, parenthesized_end_offset))
+        self.time_points = tuple(get_annotation_time_points(self.annotations))
+        # merge_skips -> (skip lengths, point_to_skip, attachments)
+        self._layouts = {}
+
+    def get_skip_layout(self, merge_skips: bool = False) -> tuple[list[int], dict[int, int]]:
+        """The skip layout of the tempo voice (see :func:`get_tempo_skip_layout`)."""
+        return self._get_layout(merge_skips)[:2]
+
+    def get_attachments(self, merge_skips: bool = False) -> dict[int, list[str]]:
+        """The lines attached after each skip of the tempo voice (see :func:`get_tempo_attachments`)."""
+        return self._get_layout(merge_skips)[2]
+
+    def _get_layout(self, merge_skips: bool):
+        if merge_skips not in self._layouts:
+            skip_lengths, point_to_skip = get_tempo_skip_layout(self.time_points, merge_skips=merge_skips)
+            self._layouts[merge_skips] = (skip_lengths, point_to_skip,
+                                          get_tempo_attachments(self.annotations, point_to_skip))
+        return self._layouts[merge_skips]
+
+    def __len__(self):
+        return len(self.annotations)
+
+    def __repr__(self):
+        return f"TempoAnnotationPlan({len(self.annotations)} annotations)"
+
+
+def get_tempo_annotation_plan(tempo_envelope: TempoEnvelope, parenthesized_end_offset=0.25,
+                              ticks_per_beat: int = TICKS_PER_QUARTER) -> TempoAnnotationPlan:
+    """
+    Returns the (cached) annotation plan for a tempo envelope.
+
+    :param tempo_envelope: the tempo envelope
+    :param parenthesized_end_offset: see :func:`get_tempo_annotations`
+    :param ticks_per_beat: how many ticks make up a beat of the envelope: TICKS_PER_QUARTER for an envelope in
+        quarter notes, TICKS_PER_16TH for one in 16ths (like a metric group's), so that the envelope needn't be
+        copied and rescaled first
+    """
+    return plan_tempo_annotations(get_tempo_annotation_key_points(tempo_envelope, ticks_per_beat),
+                                  parenthesized_end_offset)
+
+
+def plan_tempo_annotations(annotation_key_points: Sequence[tuple[int, float]],
+                           parenthesized_end_offset=0.25) -> TempoAnnotationPlan:
+    """
+    Returns the (cached) annotation plan for the given key points (see :class:`TempoAnnotationPlan`).
+    """
+    return _get_cached_plan(tuple(annotation_key_points), parenthesized_end_offset)
+
+
+@lru_cache(maxsize=64)
+def _get_cached_plan(annotation_key_points: tuple[tuple[int, float], ...],
+                     parenthesized_end_offset) -> TempoAnnotationPlan:
+    return TempoAnnotationPlan(annotation_key_points, parenthesized_end_offset)
+
+
+def _plan_annotations(annotation_key_points: Sequence[tuple[int, float]], parenthesized_end_offset):
+    annotations = []
+    parenthesized_end_ticks = beats_to_ticks(parenthesized_end_offset, TICKS_PER_QUARTER)
+
+    last_tempo = None
+    last_segment_was_constant_tempo = False
+
+    for i in range(0, len(annotation_key_points), 2):
+        start_kp, end_kp = annotation_key_points[i: i + 2]
+        next_start_tempo = annotation_key_points[i + 2][1] if i + 2 < len(annotation_key_points) else None
+        start_tick, start_tempo = start_kp
+        end_tick, end_tempo = end_kp
+
+        if start_tempo == end_tempo:  # constant segment
+            if start_tempo != last_tempo or not last_segment_was_constant_tempo:
+                annotations.append((start_tick, None, _format_tempo_markup(round(start_tempo))))
+            last_segment_was_constant_tempo = True
+        elif next_start_tempo is None or end_tempo != next_start_tempo:
+            # not a constant segment, since the first if statement failed, and we need to note the end tempo, since it's
+            # not going to be given at the start of the next segments (either because of subito change or end of score)
+            tweaks = _format_spanner_tweaks(round(start_tempo), start_tempo == last_tempo, round(end_tempo))
+            right_before_end_tick = end_tick - parenthesized_end_ticks
+            annotations.append((start_tick, right_before_end_tick, tweaks))
+            last_segment_was_constant_tempo = False
+        else:
+            # not a constant segment, but the end tempo matches the beginning of the next segment, so just add a
+            # metronome mark and and arrow
+            tweaks = _format_spanner_tweaks(round(start_tempo), start_tempo == last_tempo, None)
+            annotations.append((start_tick, end_tick, tweaks))
+            last_segment_was_constant_tempo = False
+        last_tempo = end_tempo
+
+    return annotations
+
+
+# the same few tempos come up again and again, so each distinct string is only formatted (and stored) once
+
+@cache
+def _format_tempo_markup(tempo: int) -> str:
+    return tempo_markup.format(note_type=8, tempo=tempo)
+
+
+@cache
+def _format_spanner_tweaks(start_tempo: int, parenthesize_start: bool, parenthesized_end_tempo: int | None) -> str:
+    tweaks = (tempo_spanner_tweaks_left_parenthesized if parenthesize_start
+              else tempo_spanner_tweaks_left).format(note_type=8, tempo=start_tempo)
+    if parenthesized_end_tempo is not None:
+        tweaks += "\n" + tempo_spanner_tweaks_right_parenthesized.format(note_type=8, tempo=parenthesized_end_tempo)
+    return tweaks + "\n" + tempo_spanner_padding_tweak.format(1)
+
+
+def get_tempo_annotation_key_points(tempo_envelope: TempoEnvelope, ticks_per_beat: int = TICKS_PER_QUARTER):
+    """
+    Returns the (tick, tempo) pairs at the start and end of each non-empty segment of a tempo envelope, read
+    straight from its levels rather than by evaluating it.
+
+    :param tempo_envelope: the tempo envelope
+    :param ticks_per_beat: how many ticks make up a beat of the envelope (see :func:`get_tempo_annotation_plan`)
+    """
+    annotations = []  # list of (tick, tempo_at_tick)
+    levels = tempo_envelope.levels
+    # each segment boundary is converted from the envelope's (float) beats on its own, so rounding can't build up
+    beat = 0
+    tick = 0
+    for i, segment_duration in enumerate(tempo_envelope.durations):
+        if segment_duration == 0:
+            continue
+        beat += segment_duration
+        end_tick = beats_to_ticks(beat, ticks_per_beat)
+        # levels are beat lengths; this is how TempoEnvelope.tempo_at converts them
+        annotations.append((tick, 1 / levels[i] * 60))
+        annotations.append((end_tick, 1 / levels[i + 1] * 60))
+        tick = end_tick
+    return annotations
+
+
+def get_annotation_time_points(annotations) -> list[int]:
+    """Returns the sorted, distinct ticks at which the given (start_tick, end_tick, value) annotations occur."""
+    time_points = set()
+    for start_tick, end_tick, _ in annotations:
+        time_points.add(start_tick)
+        if end_tick is not None:
+            time_points.add(end_tick)
+    return sorted(time_points)
+
+
+def get_tempo_skip_layout(time_points: Sequence[int], skip_ticks: int = TICKS_PER_16TH,
+                          merge_skips=False) -> tuple[list[int], dict[int, int]]:
+    """
+    Lays out the skips of a tempo voice on a grid of skip_ticks, so that each time point maps straight to the index
+    of the skip containing it.
+
+    :param time_points: sorted annotation time points, in ticks
+    :param skip_ticks: duration of each skip in ticks (default: 16th note)
+    :param merge_skips: if True, runs of skips that contain no time point are merged into a single skip
+    :return: tuple of (length of each skip as a multiple of skip_ticks, dict mapping each time point to the index
+        of the skip containing it)
+    """
+    if not time_points:
+        return [], {}
+    point_indices = [point // skip_ticks for point in time_points]
+    # the skips span the entire duration, up to and including the one containing the last time point
+    num_skips = point_indices[-1] + 1
+
+    if not merge_skips:
+        return [1] * num_skips, dict(zip(time_points, point_indices))
+
+    # every time point needs a skip starting on it; everything in between is one long skip
+    skip_start_indices = sorted(set([0] + point_indices))
+    skip_lengths = [next_start - start for start, next_start
+                    in zip(skip_start_indices, skip_start_indices[1:] + [num_skips])]
+    point_to_skip = {
+        point: bisect.bisect_right(skip_start_indices, index) - 1
+        for point, index in zip(time_points, point_indices)
+    }
+    return skip_lengths, point_to_skip
+
+
+def get_tempo_attachments(annotations, point_to_skip: dict[int, int]) -> dict[int, list[str]]:
+    """
+    Works out the lines attached after each skip of a tempo voice, ordered the way abjad orders them: markup, then
+    spanner stops, then spanner starts, each group sorted.
+
+    :param annotations: the annotations, as given by :func:`get_tempo_annotations`
+    :param point_to_skip: dict mapping each time point to the index of its skip (see :func:`get_tempo_skip_layout`)
+    :return: dict mapping the index of each skip that has anything attached to the lines attached to it
+    """
+    markups = defaultdict(list)
+    stops = defaultdict(list)
+    starts = defaultdict(list)
+    for start_tick, end_tick, string in annotations:
+        if end_tick is None:
+            markups[point_to_skip[start_tick]].append(_get_markup_lines(string))
+        else:
+            starts[point_to_skip[start_tick]].append(_get_spanner_start_lines(string))
+            stops[point_to_skip[end_tick]].append(_SPANNER_STOP_LINES)
+
+    attachments = {}
+    for index in sorted(set(markups) | set(stops) | set(starts)):
+        attachments[index] = [line for group in (markups, stops, starts)
+                              for lines in sorted(group.get(index, ())) for line in lines]
+    return attachments
+
+
+_SPANNER_STOP_LINES = [r"\stopTextSpan"]
+
+
+@cache
+def _get_markup_lines(markup: str) -> list[str]:
+    return [f"- {markup}"]
+
+
+@cache
+def _get_spanner_start_lines(tweaks: str) -> list[str]:
+    return f"- {tweaks}".split("\n") + [r"\startTextSpan"]
+
+
+def measure_dur_to_time_sig(dur_in_16ths: int):
+    if dur_in_16ths % 2 == 0:
+        return dur_in_16ths // 2,  8
+    else:
+        return dur_in_16ths, 16
+
+
+def format_timestamp(seconds: float) -> str:
+    """Formats a time in seconds as mm:ss"""
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+# ----------------------------- Text Backend ---------------------------------
+
+# Streams the same LilyPond source as abjad.lilypond(create_blank_lilypond_file(create_blank_score(...))), byte for
+# byte, straight from the bar and tempo data without building an abjad object tree.
+
+INDENT = "    "
+# the indentation of the lines of each bar, and of each skip of the tempo voice
+MEASURE_INDENT = 2 * INDENT
+TEMPO_SKIP_INDENT = 3 * INDENT
+
+
+@cache
+def get_abjad_ily_path() -> Path:
+    """Path of abjad's abjad.ily (found without importing abjad)."""
+    return Path(util.find_spec("abjad").submodule_search_locations[0]) / "scm" / "abjad.ily"
+
+
+@cache
+def get_lilypond_version_string() -> str:
+    """The installed LilyPond version, as reported by `lilypond --version` (and used by abjad)."""
+    proc = subprocess.run(["lilypond", "--version"], stdout=subprocess.PIPE)
+    return proc.stdout.decode().split()[2]
+
+
+def iter_blank_lilypond_file(measure_durs: Sequence[int], measure_times: Sequence[float] | None,
+                             tempo_envelope: TempoEnvelope, proportional_duration: tuple[int, int] = (1, 20),
+                             page_size_in: tuple[float, float] = (17, 11),
+                             merge_tempo_skips: bool = False, start_time: float = 0.0) -> Iterator[str]:
+    """
+    Generates the lines of a blank-score LilyPond file. Joined with newlines, these are identical to the output of
+    abjad.lilypond on the equivalent create_blank_lilypond_file(create_blank_score(...)).
+
+    (See :func:`~composing_time.abjad_utils.create_blank_score` and
+    :func:`~composing_time.abjad_utils.create_blank_lilypond_file` for the parameters, and :func:`iter_blank_score`
+    for start_time.)
+    """
+    yield from iter_file_header(proportional_duration, page_size_in)
+    yield from iter_blank_score(measure_durs, measure_times, tempo_envelope, merge_tempo_skips, start_time)
+
+
+def iter_file_header(proportional_duration: tuple[int, int], page_size_in: tuple[float, float]) -> Iterator[str]:
+    """Generates the lines of a blank-score LilyPond file before the score: version, includes, layout and paper."""
+    yield rf'\version "{get_lilypond_version_string()}"'
+    yield r'\language "english"'
+    yield rf'\include "{get_abjad_ily_path()}"'
+    yield r"\layout"
+    yield "{"
+    yield layout_block_text.format(pdur_numerator=proportional_duration[0],
+                                   pdur_denominator=proportional_duration[1])
+    yield "}"
+    yield r"\paper"
+    yield "{"
+    yield paper_block_text.format(width=page_size_in[0], height=page_size_in[1])
+    yield "}"
+
+
+def iter_blank_score(measure_durs: Sequence[int], measure_times: Sequence[float] | None,
+                     tempo_envelope: TempoEnvelope, merge_tempo_skips: bool = False,
+                     start_time: float = 0.0) -> Iterator[str]:
+    """
+    Generates the lines of a blank score, as formatted by abjad.lilypond(create_blank_score(...)).
+
+    :param start_time: time (in seconds) of the first bar, for the timestamps of scores that begin part way
+        through a piece
+    """
+    if measure_times is None:
+        _, measure_times = get_bar_times(list(accumulate([0] + list(measure_durs))), tempo_envelope)
+    count("bars_processed", len(measure_durs))
+    yield from iter_score_skeleton(_iter_tempo_voice(tempo_envelope, merge_tempo_skips),
+                           _iter_measures(measure_durs, measure_times, start_time))
+
+
+def iter_score_skeleton(tempo_voice_lines: Iterable[str], measure_lines: Iterable[str]) -> Iterator[str]:
+    """
+    Generates the lines of a blank score, filling in its skeleton with the given lines.
+
+    :param tempo_voice_lines: the lines of the tempo voice's skips (see :func:`iter_tempo_skips`)
+    :param measure_lines: the lines of the bars (see :func:`iter_measure_head`)
+    """
+    yield r"\new Score"
+    yield "<<"
+    yield INDENT + r'\context Staff = "TempoStaff"'
+    yield INDENT + r"\with"
+    yield INDENT + "{"
+    for command in ("Staff_symbol_engraver", "Clef_engraver", "Time_signature_engraver", "Bar_line_engraver"):
+        yield 2 * INDENT + rf"\remove {command}"
+    yield 2 * INDENT + r"\override TextScript.Y-offset = -4"
+    yield 2 * INDENT + r"\override TextSpanner.Y-offset = -4"
+    yield INDENT + "}"
+    yield INDENT + "{"
+    yield 2 * INDENT + r'\context Voice = "TempoVoice"'
+    yield 2 * INDENT + "{"
+    yield from tempo_voice_lines
+    yield 2 * INDENT + "}"
+    yield INDENT + "}"
+    yield INDENT + r"\new Staff"
+    yield INDENT + "{"
+    yield from measure_lines
+    yield INDENT + "}"
+    yield ">>"
+
+
+def write_blank_lilypond_file(file: TextIO, measure_durs: Sequence[int], measure_times: Sequence[float] | None,
+                              tempo_envelope: TempoEnvelope, proportional_duration: tuple[int, int] = (1, 20),
+                              page_size_in: tuple[float, float] = (17, 11), merge_tempo_skips: bool = False,
+                              start_time: float = 0.0) -> None:
+    """
+    Streams a blank-score LilyPond file to the given text file handle. (See :func:`iter_blank_lilypond_file`.)
+    """
+    with span("write_lilypond"):
+        lines = iter_blank_lilypond_file(measure_durs, measure_times, tempo_envelope, proportional_duration,
+                                         page_size_in, merge_tempo_skips, start_time)
+        first_line = next(lines)
+        file.write(first_line)
+        num_written = len(first_line)
+        for line in lines:
+            file.write("\n")
+            file.write(line)
+            num_written += len(line) + 1
+    # (LilyPond source is ASCII, so the number of characters written is the number of bytes)
+    count("bytes_written", num_written)
+
+
+def _iter_measures(measure_durs: Sequence[int], measure_times: Sequence[float],
+                   start_time: float = 0.0) -> Iterator[str]:
+    accumulated_time = start_time
+    for md, t in zip(measure_durs, measure_times):
+        yield from iter_measure_head(md, t)
+        yield MEASURE_INDENT + INDENT + f'_ "{format_timestamp(accumulated_time)}"'
+        yield MEASURE_INDENT + "}"
+        accumulated_time += t
+
+
+def iter_measure_head(measure_dur: int, measure_time: float) -> Iterator[str]:
+    """
+    Generates the lines of a bar, up to its timestamp.
+
+    :param measure_dur: length of the bar in 16ths
+    :param measure_time: duration of the bar in seconds (which sets its spacing)
+    """
+    inner_indent = MEASURE_INDENT + INDENT
+    numerator, denominator = measure_dur_to_time_sig(measure_dur)
+    yield MEASURE_INDENT + r"\new Voice"
+    yield MEASURE_INDENT + "{"
+    for line in respace_text.format(spacing=measure_time / measure_dur * 4).split("\n"):
+        yield inner_indent + line if line and not line.isspace() else ""
+    yield inner_indent + rf"\time {numerator}/{denominator}"
+    # abjad reduces the skip's multiplier (but not the time signature)
+    multiplier = Fraction(numerator, denominator)
+    yield inner_indent + f"s1 * {multiplier.numerator}/{multiplier.denominator}"
+
+
+def _iter_tempo_voice(tempo_envelope: TempoEnvelope, merge_skips: bool) -> Iterator[str]:
+    # (the envelope is in 16ths)
+    with span("build_tempo_voice"):
+        plan = get_tempo_annotation_plan(tempo_envelope, ticks_per_beat=TICKS_PER_16TH)
+        skip_lengths, _ = plan.get_skip_layout(merge_skips)
+        attachments = plan.get_attachments(merge_skips)
+    count("annotations_emitted", len(plan))
+    count("skips_created", len(skip_lengths))
+    yield from iter_tempo_skips(skip_lengths, attachments)
+
+
+def iter_tempo_skips(skip_lengths: Sequence[int], attachments: dict[int, list[str]]) -> Iterator[str]:
+    """
+    Generates the lines of the skips of a tempo voice, each followed by whatever is attached to it.
+
+    :param skip_lengths: length of each skip in 16ths (see :func:`get_tempo_skip_layout`)
+    :param attachments: the lines attached after each skip (see :func:`get_tempo_attachments`)
+    """
+    for i, length in enumerate(skip_lengths):
+        yield TEMPO_SKIP_INDENT + ("s16" if length == 1 else f"s16 * {length}/1")
+        if i in attachments:
+            for line in attachments[i]:
+                yield TEMPO_SKIP_INDENT + line
@@ -0,0 +1,256 @@
+import math
+from typing import Iterator, Mapping, Sequence
+import numpy as np
+from clockblocks import TempoEnvelope
+from .timing import EnvelopeArrays
+
+# ----------------------------- Markov Measure Generation ---------------------------------
+
+TransitionDict = Mapping[int, Sequence[int] | Mapping[int, float]]
+
+
+class MarkovMeasureGenerator:
+    """
+    Generates sequences of measure durations from a Markov chain, many sequences at a time.
+
+    The transition dict is compiled into a probability matrix, and every step advances all of the sequences being
+    generated at once, so large pools of candidate forms come out as a single 2-D array.
+
+    :param transitions: dict mapping each measure duration (in 16th notes) to the durations that may follow it.
+        These can be given either as a sequence, in which case repeating an entry makes it more likely (as in
+        scripts/markov_measures.py), or as a dict mapping each following duration to its weight.
+    :param initial_weights: weights for choosing the first measure of a sequence, as a dict from duration to
+        weight. Defaults to choosing uniformly among the keys of the transition dict.
+    :param seed: seed (or numpy Generator) for reproducible generation
+
+    Sequences can also be made to hit a total length exactly (see :func:`sample_exact`). For that, the generator
+    keeps a table of the log probability that the chain, having just played a measure, goes on to fill exactly r
+    more 16ths. Impossible completions are -inf, so infeasible prefixes are never chosen, and sampling
+    proportionally to the table gives the chain's own distribution conditioned on landing on the target.
+    """
+
+    def __init__(self, transitions: TransitionDict, initial_weights: Mapping[int, float] = None, seed=None):
+        self.states = sorted(transitions.keys())
+        if any(not isinstance(state, (int, np.integer)) or state <= 0 for state in self.states):
+            raise ValueError("Measure durations must be positive integers (numbers of 16th notes)")
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.transition_matrix = np.zeros((len(self.states), len(self.states)))
+        for state, next_states in transitions.items():
+            weights = next_states.items() if isinstance(next_states, Mapping) else ((s, 1) for s in next_states)
+            for next_state, weight in weights:
+                if next_state not in self.state_index:
+                    raise ValueError(f"Measure duration {next_state} (which can follow {state}) has no transitions "
+                                     f"of its own")
+                self.transition_matrix[self.state_index[state], self.state_index[next_state]] += weight
+        row_sums = self.transition_matrix.sum(axis=1, keepdims=True)
+        if np.any(row_sums <= 0):
+            raise ValueError("Every measure duration needs at least one transition with positive weight")
+        self.transition_matrix /= row_sums
+
+        self.initial_probabilities = np.full(len(self.states), 1 / len(self.states))
+        if initial_weights is not None:
+            self.initial_probabilities = np.zeros(len(self.states))
+            for state, weight in initial_weights.items():
+                self.initial_probabilities[self.state_index[state]] = weight
+            self.initial_probabilities /= self.initial_probabilities.sum()
+
+        # sampling draws a uniform number per sequence and finds where it falls in the row's cumulative distribution
+        self._cumulative_matrix = np.cumsum(self.transition_matrix, axis=1)
+        self._cumulative_matrix[:, -1] = 1.0
+        self._state_values = np.array(self.states)
+        self.rng = np.random.default_rng(seed)
+
+        with np.errstate(divide="ignore"):
+            self._log_transition_matrix = np.log(self.transition_matrix)
+            self._log_initial_probabilities = np.log(self.initial_probabilities)
+        # _log_completions[m, r]: log probability that, right after measure m, the next measures fill exactly r 16ths
+        self._log_completions = np.zeros((len(self.states), 1))
+
+    def generate(self, num_measures: int, num_sequences: int = 1, start: int | Sequence[int] = None) -> np.ndarray:
+        """
+        Generates a batch of measure duration sequences.
+
+        :param num_measures: the number of measures in each sequence
+        :param num_sequences: how many sequences to generate
+        :param start: the duration of the first measure (or a sequence of first durations, one per sequence).
+            If None, first measures are drawn from the initial weights.
+        :return: int array of shape (num_sequences, num_measures) of measure durations in 16th notes
+        """
+        state_indices = np.empty((num_sequences, num_measures), dtype=np.intp)
+        if num_measures == 0:
+            return self._state_values[state_indices]
+        if start is None:
+            state_indices[:, 0] = self.rng.choice(len(self.states), size=num_sequences, p=self.initial_probabilities)
+        else:
+            state_indices[:, 0] = [self.state_index[s] for s in np.broadcast_to(start, (num_sequences,))]
+        for i in range(1, num_measures):
+            state_indices[:, i] = self._step(state_indices[:, i - 1])
+        return self._state_values[state_indices]
+
+    def _step(self, state_indices: np.ndarray) -> np.ndarray:
+        draws = self.rng.random(len(state_indices))
+        # the first column whose cumulative probability exceeds the draw
+        return (draws[:, None] < self._cumulative_matrix[state_indices]).argmax(axis=1)
+
+    def log_probabilities(self, sequences: np.ndarray | Sequence[Sequence[int]],
+                          include_start: bool = False) -> np.ndarray:
+        """
+        Log probability of each of the given sequences under this chain, e.g. for scoring a pool of candidates.
+        Sequences containing an impossible transition get -inf.
+
+        :param sequences: 2-D array (or list of equal-length lists) of measure durations
+        :param include_start: whether to include the probability of the first measure under the initial weights
+        :return: array with one log probability per sequence
+        """
+        state_indices = np.vectorize(self.state_index.__getitem__, otypes=[np.intp])(np.asarray(sequences))
+        with np.errstate(divide="ignore"):
+            step_probabilities = np.log(self.transition_matrix[state_indices[:, :-1], state_indices[:, 1:]])
+            result = step_probabilities.sum(axis=1)
+            if include_start:
+                result += np.log(self.initial_probabilities[state_indices[:, 0]])
+        return result
+
+    # ------------------------------ Exact-length search ---------------------------------
+
+    def _get_log_completions(self, max_remaining: int) -> np.ndarray:
+        # extends the completion table (which doesn't depend on the target) as far as needed, and returns it
+        table = self._log_completions
+        computed = table.shape[1]
+        if computed <= max_remaining:
+            table = np.concatenate((table, np.full((len(self.states), max_remaining + 1 - computed), -np.inf)), axis=1)
+            state_range = np.arange(len(self.states))
+            for r in range(computed, max_remaining + 1):
+                previous = r - self._state_values
+                completions_after_next = np.where(previous >= 0, table[state_range, np.maximum(previous, 0)], -np.inf)
+                table[:, r] = _log_sum_exp(self._log_transition_matrix + completions_after_next, axis=1)
+            self._log_completions = table
+        return table
+
+    def _get_log_start_weights(self, total_sixteenths: int, start: int = None) -> np.ndarray:
+        # unnormalized log probability of each first measure, given that the sequence fills total_sixteenths exactly
+        log_completions = self._get_log_completions(total_sixteenths)
+        remaining = total_sixteenths - self._state_values
+        weights = np.where(remaining >= 0,
+                           log_completions[np.arange(len(self.states)), np.maximum(remaining, 0)], -np.inf)
+        if start is None:
+            return weights + self._log_initial_probabilities
+        start_only = np.full(len(self.states), -np.inf)
+        start_only[self.state_index[start]] = weights[self.state_index[start]]
+        return start_only
+
+    def can_fill_exactly(self, total_sixteenths: int, start: int = None) -> bool:
+        """Whether any sequence allowed by the transitions (beginning with start, if given) lasts exactly
+        total_sixteenths."""
+        return bool(np.isfinite(self._get_log_start_weights(total_sixteenths, start)).any())
+
+    def sample_exact(self, total_sixteenths: int, num_sequences: int = 1, start: int = None) -> list[np.ndarray]:
+        """
+        Samples sequences whose durations add up exactly to total_sixteenths, all at once. Each sequence follows the
+        Markov chain's distribution conditioned on hitting the target.
+
+        :param total_sixteenths: the exact total length of each sequence, in 16th notes
+        :param num_sequences: how many sequences to sample
+        :param start: the duration of the first measure, if it should be fixed
+        :return: list of int arrays of measure durations (which can differ in length from one another)
+        """
+        log_start_weights = self._get_log_start_weights(total_sixteenths, start)
+        if not np.isfinite(log_start_weights).any():
+            raise ValueError(f"No sequence of measures allowed by the transitions lasts exactly {total_sixteenths} "
+                             f"16ths")
+        log_completions = self._get_log_completions(total_sixteenths)
+
+        states = self._sample_log_weights(np.broadcast_to(log_start_weights, (num_sequences, len(self.states))))
+        remaining = total_sixteenths - self._state_values[states]
+        sequences = [[state] for state in states]
+        active = np.flatnonzero(remaining > 0)
+        while len(active):
+            previous = remaining[active, None] - self._state_values[None, :]
+            log_weights = self._log_transition_matrix[states[active]] + np.where(
+                previous >= 0, log_completions[np.arange(len(self.states)), np.maximum(previous, 0)], -np.inf
+            )
+            states[active] = self._sample_log_weights(log_weights)
+            remaining[active] -= self._state_values[states[active]]
+            for i in active:
+                sequences[i].append(states[i])
+            active = active[remaining[active] > 0]
+        return [self._state_values[sequence] for sequence in sequences]
+
+    def enumerate_exact(self, total_sixteenths: int, start: int = None) -> Iterator[list[int]]:
+        """
+        Generates every sequence allowed by the transitions whose durations add up exactly to total_sixteenths.
+        Prefixes that cannot be completed are pruned without being explored.
+
+        :param total_sixteenths: the exact total length of each sequence, in 16th notes
+        :param start: the duration of the first measure, if it should be fixed
+        """
+        log_completions = self._get_log_completions(total_sixteenths)
+        first_states = np.flatnonzero(np.isfinite(self._get_log_start_weights(total_sixteenths, start)))
+        # depth-first, with an explicit stack of (sequence so far as state indices, remaining 16ths)
+        stack = [([i], total_sixteenths - self.states[i]) for i in reversed(first_states)]
+        while stack:
+            sequence, remaining = stack.pop()
+            if remaining == 0:
+                yield [self.states[i] for i in sequence]
+                continue
+            for next_index in reversed(np.flatnonzero(self.transition_matrix[sequence[-1]] > 0)):
+                next_remaining = remaining - self.states[next_index]
+                if next_remaining >= 0 and np.isfinite(log_completions[next_index, next_remaining]):
+                    stack.append((sequence + [next_index], next_remaining))
+
+    def sample_exact_duration(self, total_seconds: float, tempo_envelope: TempoEnvelope | float = 60,
+                              tolerance: float = 0.0, num_sequences: int = 1, start: int = None,
+                              sixteenths_per_beat: int = 4) -> list[np.ndarray]:
+        """
+        Samples sequences that last total_seconds (within tolerance) when played under tempo_envelope.
+
+        Since the sequence starts at beat 0, how long it lasts depends only on its total number of beats, so this
+        finds the totals that land within tolerance of the target and samples among them (weighted by how likely
+        the chain is to hit each one).
+
+        :param total_seconds: the target duration in seconds
+        :param tempo_envelope: the tempo the measures are played at (a TempoEnvelope or a fixed tempo)
+        :param tolerance: how far (in seconds) the duration may be from total_seconds
+        :param num_sequences: how many sequences to sample
+        :param start: the duration of the first measure, if it should be fixed
+        :param sixteenths_per_beat: how many 16ths make one beat of the tempo envelope (4 means the envelope is in
+            quarter notes, as in scripts/markov_measures.py; 1 means it is in 16ths, as in a MetricGroup)
+        :return: list of int arrays of measure durations
+        """
+        if not isinstance(tempo_envelope, TempoEnvelope):
+            tempo_envelope = TempoEnvelope(tempo_envelope)
+        envelope_arrays = EnvelopeArrays.from_envelope(tempo_envelope)
+        # a little slack, so that totals landing right on the edge of the tolerance survive rounding
+        slack = 1e-9 * max(1.0, total_seconds)
+        low_beat, high_beat = envelope_arrays.beats_at_times([max(total_seconds - tolerance - slack, 0),
+                                                              total_seconds + tolerance + slack])
+        candidate_totals = np.arange(math.ceil(low_beat * sixteenths_per_beat),
+                                     math.floor(high_beat * sixteenths_per_beat) + 1)
+        candidate_totals = candidate_totals[candidate_totals > 0]
+
+        log_total_weights = np.array([
+            _log_sum_exp(self._get_log_start_weights(int(total), start), axis=0) for total in candidate_totals
+        ])
+        if not np.isfinite(log_total_weights).any():
+            raise ValueError(f"No sequence of measures allowed by the transitions lasts {total_seconds} seconds "
+                             f"(within {tolerance})")
+        totals = candidate_totals[self._sample_log_weights(np.broadcast_to(log_total_weights,
+                                                                           (num_sequences, len(candidate_totals))))]
+        sequences = [None] * num_sequences
+        for total in np.unique(totals):
+            which = np.flatnonzero(totals == total)
+            for i, sequence in zip(which, self.sample_exact(int(total), len(which), start)):
+                sequences[i] = sequence
+        return sequences
+
+    def _sample_log_weights(self, log_weights: np.ndarray) -> np.ndarray:
+        # samples one column index per row, proportionally to exp(log_weights), via the Gumbel-max trick
+        gumbel_noise = -np.log(-np.log(self.rng.random(log_weights.shape)))
+        return np.argmax(log_weights + gumbel_noise, axis=-1)
+
+
+def _log_sum_exp(values: np.ndarray, axis: int) -> np.ndarray:
+    maxima = np.max(values, axis=axis, keepdims=True)
+    safe_maxima = np.where(np.isfinite(maxima), maxima, 0.0)
+    with np.errstate(divide="ignore"):
+        result = np.log(np.sum(np.exp(values - safe_maxima), axis=axis, keepdims=True)) + safe_maxima
+    return np.squeeze(result, axis=axis)
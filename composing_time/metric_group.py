@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from scamp import TempoEnvelope
-import json
-from .abjad_utils import create_blank_lilypond_file, create_blank_score
+from clockblocks import TempoEnvelope
+import weakref
+from typing import Callable, TextIO
+from .lilypond_text import write_blank_lilypond_file
+from .timing import get_bar_times, beats_to_ticks
+from .metric_index import MetricIndex
+from .instrumentation import span
 from itertools import accumulate
 
 
@@ -11,43 +15,112 @@ from itertools import accumulate
 # \override Score.SpacingSpanner.spacing-increment seems like it gets close, but isn't exact/has some distortion
 
 # TODO:
-# - Make clicktrack from metric group
 # - add unit_dur to metric group class, so that it applies to self and all subgroups
 # - Implement methods like total time for MetricGroup
 # - Use this to generate notation
-# - Some sort of printout or rendering of a metric group as a timeline
+
+
+def fit_tempo_envelope(tempo_envelope: TempoEnvelope, total_bar_length: float) -> TempoEnvelope:
+    """Extends or truncates the tempo envelope (in place) so that it lasts exactly total_bar_length beats."""
+    return (tempo_envelope.
+            extend_to(total_bar_length).
+            truncate_at(total_bar_length))
 
 
 class MetricGroup(ABC):
-    """Abstract base class for metric groups, with shared functionality."""
+    """
+    Abstract base class for metric groups, with shared functionality.
+
+    Flattened bar lengths and tempo envelopes are cached on each group. Assigning to a group's attributes
+    invalidates its cache and that of every group containing it; after mutating a group in place (e.g. appending
+    to its bar_lengths list), call :func:`invalidate` to do the same (which also refits a simple group's tempo
+    envelope to its bars). Cached results are shared, so duplicate them before modifying.
+    """
+
+    def __init__(self):
+        self._parents = weakref.WeakSet()
+        self._bar_line_locations = None
+        self._bar_line_ticks = None
+        self._metric_index = None
 
     @abstractmethod
-    def get_bar_lengths(self) -> list[float]:
+    def get_bar_lengths(self) -> list[int]:
         pass
 
     @abstractmethod
     def get_tempo_envelope(self) -> TempoEnvelope:
         pass
 
-    def total_beat_duration(self) -> float:
+    def get_bar_line_locations(self) -> list[int]:
+        """Returns the cumulative bar line locations, from 0 up to and including the final bar line."""
+        if self._bar_line_locations is None:
+            self._bar_line_locations = list(accumulate([0] + list(self.get_bar_lengths())))
+        return self._bar_line_locations
+
+    def get_bar_line_ticks(self) -> list[int]:
+        """
+        Returns the cumulative bar line locations in ticks (see :data:`timing.TICKS_PER_16TH`), which can be
+        compared, hashed and used as keys exactly.
+        """
+        if self._bar_line_ticks is None:
+            self._bar_line_ticks = [beats_to_ticks(location) for location in self.get_bar_line_locations()]
+        return self._bar_line_ticks
+
+    def get_metric_index(self) -> MetricIndex:
+        """Returns a MetricIndex for fast bar/beat/time lookups in this group."""
+        if self._metric_index is None:
+            self._metric_index = MetricIndex.from_metric_group(self)
+        return self._metric_index
+
+    def total_beat_duration(self) -> int:
         """Returns the total number of beats across all bars."""
-        return sum(self.get_bar_lengths())
+        return self.get_bar_line_locations()[-1]
+
+    def invalidate(self) -> None:
+        """Clears the cached data of this group and of every group that contains it."""
+        # (iteratively, like every walk over the tree, so that deeply nested groups don't hit the recursion limit)
+        stack, seen = [self], set()
+        while stack:
+            group = stack.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            group._clear_cache()
+            stack.extend(group._parents)
+
+    def _clear_cache(self) -> None:
+        self._bar_line_locations = None
+        self._bar_line_ticks = None
+        self._metric_index = None
     
     @classmethod
     def load_from_json(cls, file_path):
+        """
+        Reads a MetricGroup from a JSON config file, streaming it in and validating each group as it's read (see
+        :func:`json_loader.load_metric_group_json`).
+        """
+        from .json_loader import load_metric_group_json
         with open(file_path, 'r') as f:
-            return cls.parse_json(json.load(f))
+            return load_metric_group_json(f)
 
     @classmethod
     def parse_json(cls, data: dict) -> "MetricGroup":
-        """Recursively parses a JSON dictionary into a MetricGroup object."""
-        if "subgroups" in data:
-            return CompositeMetricGroup([cls.parse_json(subgroup) for subgroup in data["subgroups"]])
-        else:
-            return SimpleMetricGroup(
-                bar_lengths=data["bar_lengths"],
-                tempo_envelope=cls._parse_tempo_envelope(data)
-            )
+        """
+        Parses a JSON dictionary into a MetricGroup object, validating each group along the way (see
+        :func:`json_loader.parse_metric_group_dict`).
+        """
+        from .json_loader import parse_metric_group_dict
+        return parse_metric_group_dict(data)
+
+    @abstractmethod
+    def to_json_dict(self) -> dict:
+        """Returns a JSON dictionary that parse_json turns back into an identical metric group."""
+        pass
+
+    def save_to_json(self, file_path) -> None:
+        from .json_loader import dump_metric_group_json
+        with open(file_path, 'w') as f:
+            dump_metric_group_json(self, f)
 
     @staticmethod
     def _parse_tempo_envelope(group: dict) -> TempoEnvelope:
@@ -64,15 +137,38 @@ class MetricGroup(ABC):
                 curve_shapes=[curvature]
             )
 
+    @staticmethod
+    def _tempo_envelope_to_json(tempo_envelope: TempoEnvelope) -> dict:
+        """Inverse of _parse_tempo_envelope, using the simple tempo/end_tempo/tempo_curvature form where possible."""
+        segments = tempo_envelope.segments
+        beat_lengths = [segments[0].start_level] + [segment.end_level for segment in segments]
+        tempos = [60 / beat_length for beat_length in beat_lengths]
+        # tempos only make it back to exactly the same beat lengths if 60 / (60 / x) == x
+        tempos_are_exact = all(60 / tempo == beat_length for tempo, beat_length in zip(tempos, beat_lengths))
+        if len(segments) == 1 and tempos_are_exact:
+            group = {"tempo": tempos[0]}
+            if tempos[1] != tempos[0]:
+                group["end_tempo"] = tempos[1]
+            if segments[0].curve_shape != 0:
+                group["tempo_curvature"] = segments[0].curve_shape
+            return group
+        envelope = {
+            "levels": tempos if tempos_are_exact else beat_lengths,
+            "durations": [segment.end_time - segment.start_time for segment in segments],
+            "curve_shapes": [segment.curve_shape for segment in segments],
+        }
+        if not tempos_are_exact:
+            envelope["units"] = "beatlength"
+        return {"tempo_envelope": envelope}
+
     def to_lilypond_file(self):
+        # imported here so that abjad is only loaded when an abjad score is actually requested
+        from .abjad_utils import create_blank_lilypond_file, create_blank_score
         bar_lengths_beats = self.get_bar_lengths()
         tempo_env = self.get_tempo_envelope()
-        bar_line_location = list(accumulate([0] + bar_lengths_beats))
-        bar_lengths_times = [
-            tempo_env.time_at_beat(end_beat) - tempo_env.time_at_beat(start_beat)
-            for start_beat, end_beat in zip(bar_line_location[:-1], bar_line_location[1:])
-        ]
-        
+        bar_line_location = self.get_bar_line_locations()
+        _, bar_lengths_times = get_bar_times(bar_line_location, tempo_env)
+
         score = create_blank_score(
             bar_lengths_beats,
             bar_lengths_times,
@@ -81,35 +177,203 @@ class MetricGroup(ABC):
 
         return create_blank_lilypond_file(score)
 
+    def write_lilypond_file(self, file: TextIO, **kwargs) -> None:
+        """
+        Streams the same LilyPond source as abjad.lilypond(self.to_lilypond_file()) to the given text file handle,
+        without building an abjad object tree. Keyword arguments are passed on to write_blank_lilypond_file.
+        """
+        bar_lengths_beats = self.get_bar_lengths()
+        tempo_env = self.get_tempo_envelope()
+        _, bar_lengths_times = get_bar_times(self.get_bar_line_locations(), tempo_env)
+        write_blank_lilypond_file(file, bar_lengths_beats, bar_lengths_times, tempo_env, **kwargs)
+
+    def to_click_track(self, file_path, **kwargs):
+        """
+        Renders a click track matching this group's bars and tempo to a WAV file. Keyword arguments are passed on to
+        write_click_track.
+        """
+        from .click_track import write_click_track
+        return write_click_track(self, file_path, **kwargs)
+
+    def to_midi_tempo_map(self, file_path, **kwargs):
+        """
+        Writes this group's time signatures and tempo envelope to a Standard MIDI File conductor track. Keyword
+        arguments are passed on to write_tempo_map.
+        """
+        from .tempo_map import write_tempo_map
+        return write_tempo_map(self, file_path, **kwargs)
+
+    def to_timeline_svg(self, file_path, **kwargs):
+        """
+        Draws this group as a timeline in an SVG file, with bars in proportion to their durations and the tempo
+        curve across them. Keyword arguments are passed on to iter_timeline_svg.
+        """
+        from .timeline import write_timeline_svg
+        return write_timeline_svg(self, file_path, **kwargs)
+
+
+def fold_metric_group(metric_group: MetricGroup, get_known_value: Callable[[MetricGroup], object],
+                      combine: Callable[["CompositeMetricGroup", list], object]):
+    """
+    Works out a value for a tree of metric groups from the bottom up, iteratively rather than recursively, so that
+    deeply nested groups don't hit the recursion limit.
+
+    :param metric_group: the root of the tree
+    :param get_known_value: returns the value of a group if it can be had without looking at its subgroups (always
+        the case for groups other than CompositeMetricGroups, and for composite groups with the value cached),
+        otherwise None
+    :param combine: returns the value of a composite group, given the values of its subgroups
+    :return: the value of the root
+    """
+    value = get_known_value(metric_group)
+    if value is not None:
+        return value
+    # each entry is (composite group, the values of its subgroups so far)
+    stack = [(metric_group, [])]
+    while True:
+        group, values = stack[-1]
+        if len(values) < len(group.groups):
+            subgroup = group.groups[len(values)]
+            value = get_known_value(subgroup)
+            if value is None:
+                stack.append((subgroup, []))
+            else:
+                values.append(value)
+            continue
+        value = combine(group, values)
+        stack.pop()
+        if not stack:
+            return value
+        stack[-1][1].append(value)
+
 
 class SimpleMetricGroup(MetricGroup):
+    """
+    A run of bars under a single tempo envelope.
+
+    Groups loaded from identical JSON definitions share one envelope (see json_loader). The tempo_envelope
+    property gives such a group its own copy before handing it out, so editing it in place never affects other
+    groups; get_tempo_envelope returns the (possibly shared) envelope as is, for reading.
+    """
+
     def __init__(self, bar_lengths: list[int], tempo_envelope: TempoEnvelope):
-        self.bar_lengths = bar_lengths
-        total_bar_length = self.total_beat_duration()
-        self.tempo_envelope = (tempo_envelope.
-                               extend_to(total_bar_length).
-                               truncate_at(total_bar_length))
+        super().__init__()
+        self._bar_lengths = bar_lengths
+        self._tempo_envelope = self._fit_tempo_envelope(tempo_envelope)
+        self._envelope_is_shared = False
+
+    @classmethod
+    def _with_shared_envelope(cls, bar_lengths: list[int], tempo_envelope: TempoEnvelope) -> "SimpleMetricGroup":
+        # a group whose (already fitted) envelope is shared with other groups, so is copied before being handed out
+        group = cls(bar_lengths, tempo_envelope)
+        group._envelope_is_shared = True
+        return group
+
+    @property
+    def bar_lengths(self) -> list[int]:
+        return self._bar_lengths
+
+    @bar_lengths.setter
+    def bar_lengths(self, bar_lengths: list[int]):
+        self._bar_lengths = bar_lengths
+        # (this refits the envelope to the new bars)
+        self.invalidate()
+
+    @property
+    def tempo_envelope(self) -> TempoEnvelope:
+        if self._envelope_is_shared:
+            self._tempo_envelope = self._tempo_envelope.duplicate()
+            self._envelope_is_shared = False
+        return self._tempo_envelope
+
+    @tempo_envelope.setter
+    def tempo_envelope(self, tempo_envelope: TempoEnvelope):
+        self._tempo_envelope = self._fit_tempo_envelope(tempo_envelope)
+        self._envelope_is_shared = False
+        self.invalidate()
+
+    def _fit_tempo_envelope(self, tempo_envelope: TempoEnvelope) -> TempoEnvelope:
+        return fit_tempo_envelope(tempo_envelope, self.total_beat_duration())
+
+    def _clear_cache(self) -> None:
+        super()._clear_cache()
+        # the bars may have been changed in place, so make sure the envelope still lasts exactly as long as them.
+        # The envelope may be shared with other groups, so refit a copy of it.
+        if self._tempo_envelope.end_time() != self.total_beat_duration():
+            self._tempo_envelope = self._fit_tempo_envelope(self._tempo_envelope.duplicate())
+            self._envelope_is_shared = False
 
     def get_bar_lengths(self) -> list[int]:
         return self.bar_lengths
 
+    def to_json_dict(self) -> dict:
+        return {"bar_lengths": list(self.bar_lengths), **self._tempo_envelope_to_json(self._tempo_envelope)}
+
     def get_tempo_envelope(self) -> TempoEnvelope:
-        return self.tempo_envelope
+        return self._tempo_envelope
 
 
 class CompositeMetricGroup(MetricGroup):
     def __init__(self, groups: list[MetricGroup]):
+        super().__init__()
+        self._groups = []
+        self._bar_lengths = None
+        self._tempo_envelope = None
         self.groups = groups
 
-    def get_bar_lengths(self) -> list[float]:
-        return [bar for group in self.groups for bar in group.get_bar_lengths()]
+    @property
+    def groups(self) -> list[MetricGroup]:
+        return self._groups
+
+    @groups.setter
+    def groups(self, groups: list[MetricGroup]):
+        for group in self._groups:
+            group._parents.discard(self)
+        self._groups = groups
+        for group in groups:
+            group._parents.add(self)
+        self.invalidate()
+
+    def _clear_cache(self) -> None:
+        super()._clear_cache()
+        self._bar_lengths = None
+        self._tempo_envelope = None
+
+    def to_json_dict(self) -> dict:
+        return fold_metric_group(
+            self, lambda group: None if isinstance(group, CompositeMetricGroup) else group.to_json_dict(),
+            lambda group, subgroups: {"subgroups": subgroups}
+        )
+
+    def get_bar_lengths(self) -> list[int]:
+        return fold_metric_group(self, _get_known_bar_lengths, _combine_bar_lengths)
 
     def get_tempo_envelope(self) -> TempoEnvelope:
-        envelopes = [group.get_tempo_envelope() for group in self.groups]
+        return fold_metric_group(self, _get_known_tempo_envelope, _combine_tempo_envelopes)
+
+
+# (the subgroups' results are cached along the way, just as when each group works out its own)
+
+def _get_known_bar_lengths(group: MetricGroup) -> list[int] | None:
+    return group._bar_lengths if isinstance(group, CompositeMetricGroup) else group.get_bar_lengths()
+
+
+def _combine_bar_lengths(group: CompositeMetricGroup, subgroup_bar_lengths: list[list[int]]) -> list[int]:
+    group._bar_lengths = [bar for bar_lengths in subgroup_bar_lengths for bar in bar_lengths]
+    return group._bar_lengths
+
+
+def _get_known_tempo_envelope(group: MetricGroup) -> TempoEnvelope | None:
+    return group._tempo_envelope if isinstance(group, CompositeMetricGroup) else group.get_tempo_envelope()
+
+
+def _combine_tempo_envelopes(group: CompositeMetricGroup, envelopes: list[TempoEnvelope]) -> TempoEnvelope:
+    with span("concatenate_envelopes", num_groups=len(envelopes)):
         tempo_envelope = envelopes[0].duplicate()
         for te in envelopes[1:]:
             tempo_envelope.append_envelope(te)
-        return tempo_envelope
+    group._tempo_envelope = tempo_envelope
+    return tempo_envelope
 
 
 if __name__ == '__main__':
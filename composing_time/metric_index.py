@@ -0,0 +1,142 @@
+import bisect
+import numpy as np
+from typing import Sequence, TYPE_CHECKING
+from .timing import EnvelopeArrays, TICKS_PER_16TH
+
+if TYPE_CHECKING:
+    from .metric_group import MetricGroup
+
+
+class MetricIndex:
+    """
+    Precomputed lookup tables for converting between bars, beats and times in a metric group.
+
+    Holds the cumulative bar line beats, the time of every bar line and the per-segment integrals of the tempo
+    envelope as arrays, so that single lookups are O(log n) bisections and batched lookups (arrays of times or
+    beats, e.g. for syncing video cues or electronics) are vectorized. Bars are indexed from 0, like the list
+    returned by :func:`MetricGroup.get_bar_lengths`, and beats are in the same units as the bar lengths (16ths).
+    Positions can also be given in integer ticks (see :data:`timing.TICKS_PER_16TH`), which locate bars exactly.
+
+    :param bar_line_locations: cumulative bar line locations in beats, including the final bar line
+    :param envelope_arrays: the tempo envelope that the bars are played under, as EnvelopeArrays
+    """
+
+    def __init__(self, bar_line_locations: Sequence[float], envelope_arrays: EnvelopeArrays):
+        self.envelope_arrays = envelope_arrays
+        self.bar_line_locations = np.asarray(bar_line_locations, dtype=float)
+        self.bar_line_times = envelope_arrays.times_at_beats(self.bar_line_locations)
+        self.bar_line_ticks = np.rint(self.bar_line_locations * TICKS_PER_16TH).astype(np.int64)
+        # plain lists bisect faster than NumPy arrays for one-off lookups
+        self._bar_line_location_list = self.bar_line_locations.tolist()
+        self._bar_line_time_list = self.bar_line_times.tolist()
+        self._bar_line_tick_list = self.bar_line_ticks.tolist()
+
+    @classmethod
+    def from_metric_group(cls, metric_group: "MetricGroup") -> "MetricIndex":
+        return cls(metric_group.get_bar_line_locations(),
+                   EnvelopeArrays.from_envelope(metric_group.get_tempo_envelope()))
+
+    @property
+    def num_bars(self) -> int:
+        return len(self._bar_line_location_list) - 1
+
+    @property
+    def bar_start_times(self) -> np.ndarray:
+        return self.bar_line_times[:-1]
+
+    @property
+    def total_time(self) -> float:
+        return self._bar_line_time_list[-1]
+
+    # ------------------------------------- Single lookups ---------------------------------------
+
+    def beat_at_bar(self, bar: int, beat_in_bar: float = 0) -> float:
+        """Returns the beat at which the given bar starts, plus beat_in_bar."""
+        return self._bar_line_location_list[bar] + beat_in_bar
+
+    def time_at_bar(self, bar: int, beat_in_bar: float = 0) -> float:
+        """Returns the time (in seconds) of the given beat within the given bar."""
+        if beat_in_bar == 0:
+            return self._bar_line_time_list[bar]
+        return self.time_at_beat(self.beat_at_bar(bar, beat_in_bar))
+
+    def time_at_beat(self, beat: float) -> float:
+        """Returns the time (in seconds) at the given beat."""
+        return float(self.envelope_arrays.times_at_beats([beat])[0])
+
+    def beat_at_time(self, time: float) -> float:
+        """Returns the beat sounding at the given time (in seconds)."""
+        return float(self.envelope_arrays.beats_at_times([time])[0])
+
+    def bar_at_beat(self, beat: float) -> tuple[int, float]:
+        """Returns the bar containing the given beat, along with how many beats into the bar it falls."""
+        bar = self._clip_bar(bisect.bisect_right(self._bar_line_location_list, beat) - 1)
+        return bar, beat - self._bar_line_location_list[bar]
+
+    def bar_at_tick(self, tick: int) -> tuple[int, int]:
+        """Returns the bar containing the given tick, along with how many ticks into the bar it falls."""
+        bar = self._clip_bar(bisect.bisect_right(self._bar_line_tick_list, tick) - 1)
+        return bar, tick - self._bar_line_tick_list[bar]
+
+    def time_at_tick(self, tick: int) -> float:
+        """Returns the time (in seconds) at the given tick."""
+        return self.time_at_beat(tick / TICKS_PER_16TH)
+
+    def bar_at_time(self, time: float) -> tuple[int, float]:
+        """Returns the bar sounding at the given time (in seconds), along with how many beats into the bar it is."""
+        bar = self._clip_bar(bisect.bisect_right(self._bar_line_time_list, time) - 1)
+        return bar, self.beat_at_time(time) - self._bar_line_location_list[bar]
+
+    def tempo_at_bar(self, bar: int, beat_in_bar: float = 0) -> float:
+        """Returns the tempo at the given beat within the given bar."""
+        return self.tempo_at_beat(self.beat_at_bar(bar, beat_in_bar))
+
+    def tempo_at_beat(self, beat: float) -> float:
+        """Returns the tempo at the given beat (after the jump, if the tempo changes suddenly there)."""
+        return 60 / float(self.envelope_arrays.levels_at_beats([beat])[0])
+
+    def _clip_bar(self, bar: int) -> int:
+        # times or beats past the final bar line are treated as falling in the last bar (and before zero, the first)
+        return min(max(bar, 0), self.num_bars - 1)
+
+    # ------------------------------------- Batched lookups ---------------------------------------
+
+    def times_at_beats(self, beats: Sequence[float]) -> np.ndarray:
+        """Vectorized version of :func:`time_at_beat`."""
+        return self.envelope_arrays.times_at_beats(beats)
+
+    def beats_at_times(self, times: Sequence[float]) -> np.ndarray:
+        """Vectorized version of :func:`beat_at_time`."""
+        return self.envelope_arrays.beats_at_times(times)
+
+    def times_at_bars(self, bars: Sequence[int], beats_in_bars: Sequence[float] = None) -> np.ndarray:
+        """Vectorized version of :func:`time_at_bar`."""
+        if beats_in_bars is None:
+            return self.bar_line_times[np.asarray(bars, dtype=int)]
+        return self.times_at_beats(self.bar_line_locations[np.asarray(bars, dtype=int)] + beats_in_bars)
+
+    def bars_at_beats(self, beats: Sequence[float]) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of :func:`bar_at_beat`, returning an array of bars and an array of beats into them."""
+        beats = np.asarray(beats, dtype=float)
+        bars = np.clip(np.searchsorted(self.bar_line_locations, beats, side="right") - 1, 0, self.num_bars - 1)
+        return bars, beats - self.bar_line_locations[bars]
+
+    def bars_at_ticks(self, ticks: Sequence[int]) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of :func:`bar_at_tick`, returning an array of bars and an array of ticks into them."""
+        ticks = np.asarray(ticks, dtype=np.int64)
+        bars = np.clip(np.searchsorted(self.bar_line_ticks, ticks, side="right") - 1, 0, self.num_bars - 1)
+        return bars, ticks - self.bar_line_ticks[bars]
+
+    def times_at_ticks(self, ticks: Sequence[int]) -> np.ndarray:
+        """Vectorized version of :func:`time_at_tick`."""
+        return self.times_at_beats(np.asarray(ticks) / TICKS_PER_16TH)
+
+    def bars_at_times(self, times: Sequence[float]) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of :func:`bar_at_time`, returning an array of bars and an array of beats into them."""
+        times = np.asarray(times, dtype=float)
+        bars = np.clip(np.searchsorted(self.bar_line_times, times, side="right") - 1, 0, self.num_bars - 1)
+        return bars, self.beats_at_times(times) - self.bar_line_locations[bars]
+
+    def tempos_at_beats(self, beats: Sequence[float]) -> np.ndarray:
+        """Vectorized version of :func:`tempo_at_beat`."""
+        return 60 / self.envelope_arrays.levels_at_beats(beats)
@@ -0,0 +1,120 @@
+import heapq
+from collections import deque
+from itertools import repeat
+from typing import Iterator, Sequence
+import numpy as np
+from .metric_group import MetricGroup
+
+# ----------------------------- Polymetric Layers ---------------------------------
+
+# Several players, each following their own metric group, start together and then go their own ways. The
+# downbeats of all the layers are visited in order of time with a k-way merge of each layer's (already sorted) bar
+# start times, so finding where they coincide takes O(total bars * log(layers)) rather than comparing every pair of
+# layers. A window slides along the merged downbeats, holding a run of them that all fall within the tolerance of
+# each other, with at most one from each layer; each time the window is about to lose its earliest downbeat, it is
+# reported if it has gained any since it was last reported. So every maximal run is reported once, and a downbeat
+# can belong to several overlapping coincidences.
+
+
+class Coincidence:
+    """
+    Downbeats of several layers that fall (nearly) together.
+
+    :param time: time (in seconds) of the earliest of the downbeats
+    :param bars: dict mapping the index of each layer involved to the index of its bar
+    :param spread: time (in seconds) between the earliest and the latest of the downbeats
+    """
+
+    def __init__(self, time: float, bars: dict[int, int], spread: float):
+        self.time = time
+        self.bars = bars
+        self.spread = spread
+
+    @property
+    def layers(self) -> list[int]:
+        return sorted(self.bars)
+
+    def __repr__(self):
+        return f"Coincidence({self.time:.3f}s, {self.bars}, spread={self.spread:.3f}s)"
+
+
+class PolymetricLayers:
+    """
+    Several metric groups played at once, each by its own layer of players, all starting at time 0.
+
+    :param metric_groups: the metric group of each layer
+    :param names: optional name for each layer (used to label its staff)
+    """
+
+    def __init__(self, metric_groups: Sequence[MetricGroup], names: Sequence[str] = None):
+        if len(metric_groups) == 0:
+            raise ValueError("PolymetricLayers needs at least one metric group.")
+        if names is not None and len(names) != len(metric_groups):
+            raise ValueError(f"Expected {len(metric_groups)} names (one per layer), got {len(names)}.")
+        self.metric_groups = list(metric_groups)
+        self.names = None if names is None else list(names)
+
+    @property
+    def num_layers(self) -> int:
+        return len(self.metric_groups)
+
+    def get_bar_start_times(self) -> list[np.ndarray]:
+        """Returns the start time (in seconds) of every bar of each layer."""
+        # (each group's metric index is cached on the group)
+        return [metric_group.get_metric_index().bar_start_times for metric_group in self.metric_groups]
+
+    def iter_downbeats(self) -> Iterator[tuple[float, int, int]]:
+        """Generates the downbeats of all the layers in order of time, as (time, layer, bar) tuples."""
+        return heapq.merge(*(zip(bar_start_times.tolist(), repeat(layer), range(len(bar_start_times)))
+                             for layer, bar_start_times in enumerate(self.get_bar_start_times())))
+
+    def iter_coincidences(self, tolerance: float = 0.05, min_layers: int = 2) -> Iterator[Coincidence]:
+        """
+        Generates the places where the downbeats of several layers coincide, in order of time.
+
+        :param tolerance: how far apart (in seconds) downbeats can be and still count as coinciding. A coincidence
+            is a maximal run of consecutive downbeats that are all within this time of each other, with at most one
+            from each layer; overlapping coincidences can share downbeats.
+        :param min_layers: how many layers need to coincide
+        """
+        if tolerance < 0:
+            raise ValueError("tolerance can't be negative")
+        # the times of the downbeats in the window, and the bar of each layer in it (both in order of time)
+        window_times, window_bars = deque(), {}
+        grown = False
+        for time, layer, bar in self.iter_downbeats():
+            if window_times and (time - window_times[0] > tolerance or layer in window_bars):
+                if grown and len(window_bars) >= min_layers:
+                    yield Coincidence(window_times[0], dict(window_bars), window_times[-1] - window_times[0])
+                grown = False
+                while window_times and (time - window_times[0] > tolerance or layer in window_bars):
+                    window_times.popleft()
+                    del window_bars[next(iter(window_bars))]
+            window_times.append(time)
+            window_bars[layer] = bar
+            grown = True
+        if grown and len(window_bars) >= min_layers:
+            yield Coincidence(window_times[0], dict(window_bars), window_times[-1] - window_times[0])
+
+    def find_coincidences(self, tolerance: float = 0.05, min_layers: int = 2) -> list[Coincidence]:
+        """Returns a list of the coincidences between layers (see :func:`iter_coincidences`)."""
+        return list(self.iter_coincidences(tolerance, min_layers))
+
+    def to_lilypond_file(self, proportional_duration: tuple[int, int] = (1, 20),
+                         page_size_in: tuple[float, float] = (17, 11), **kwargs):
+        """
+        Builds a blank abjad score with a staff per layer, aligned in time, and a shared line of timestamps below.
+        Keyword arguments are passed on to create_polymetric_score.
+        """
+        # imported here so that abjad is only loaded when an abjad score is actually requested
+        from .abjad_utils import create_blank_lilypond_file, create_polymetric_score
+        score = create_polymetric_score(
+            [metric_group.get_bar_lengths() for metric_group in self.metric_groups],
+            [np.diff(metric_group.get_metric_index().bar_line_times) for metric_group in self.metric_groups],
+            self.names,
+            **kwargs
+        )
+        return create_blank_lilypond_file(score, proportional_duration, page_size_in, per_staff_timing=True)
+
+    def __repr__(self):
+        return f"PolymetricLayers({self.num_layers} layers)"
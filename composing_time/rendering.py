@@ -0,0 +1,172 @@
+import hashlib
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Sequence, TYPE_CHECKING
+from clockblocks import TempoEnvelope
+from .lilypond_text import iter_blank_lilypond_file
+from .timing import get_bar_times
+
+if TYPE_CHECKING:
+    from .metric_group import MetricGroup
+
+# ----------------------------- Chunked, Cached Rendering ---------------------------------
+
+# Long scores are split into chunks that LilyPond can engrave independently and in parallel. Rendered chunks are
+# cached on disk under the hash of their LilyPond source, so re-rendering after an edit only re-engraves the chunks
+# whose source actually changed.
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "composing_time" / "lilypond"
+
+
+class ScoreChunk:
+    """
+    A run of consecutive bars that can be engraved on its own. Every bar carries its own time signature, so the
+    chunk only needs the tempo envelope from its first bar onward and the time at which it starts.
+
+    :param first_bar: index of the first bar of the chunk within the whole piece
+    :param measure_durs: the durations of the chunk's bars in 16th notes
+    :param measure_times: the durations of the chunk's bars in seconds
+    :param tempo_envelope: the tempo envelope over the chunk, starting at beat 0
+    :param start_time: the time (in seconds) at which the chunk starts within the whole piece
+    """
+
+    def __init__(self, first_bar: int, measure_durs: Sequence[int], measure_times: Sequence[float],
+                 tempo_envelope: TempoEnvelope, start_time: float):
+        self.first_bar = first_bar
+        self.measure_durs = measure_durs
+        self.measure_times = measure_times
+        self.tempo_envelope = tempo_envelope
+        self.start_time = start_time
+
+    def to_lilypond(self, **file_kwargs) -> str:
+        """
+        Returns the LilyPond source of this chunk. Keyword arguments are passed on to iter_blank_lilypond_file.
+        """
+        return "\n".join(iter_blank_lilypond_file(self.measure_durs, self.measure_times, self.tempo_envelope,
+                                                  start_time=self.start_time, **file_kwargs))
+
+    def __repr__(self):
+        return f"ScoreChunk(first_bar={self.first_bar}, num_bars={len(self.measure_durs)})"
+
+
+def split_into_chunks(metric_group: "MetricGroup", bars_per_chunk: int = None) -> list[ScoreChunk]:
+    """
+    Splits a metric group into independently renderable chunks.
+
+    :param metric_group: the metric group to split
+    :param bars_per_chunk: if given, each chunk has this many bars (apart from the last). Otherwise, a composite
+        group is split into one chunk per top-level subgroup, and a simple group makes a single chunk.
+    :return: list of ScoreChunks, in order
+    """
+    bar_lengths = list(metric_group.get_bar_lengths())
+    bar_line_locations = metric_group.get_bar_line_locations()
+    tempo_envelope = metric_group.get_tempo_envelope()
+    start_times, measure_times = get_bar_times(bar_line_locations, tempo_envelope)
+
+    if bars_per_chunk is not None:
+        chunk_starts = list(range(0, len(bar_lengths), bars_per_chunk))
+    elif hasattr(metric_group, "groups"):
+        chunk_starts = [0]
+        for group in metric_group.groups[:-1]:
+            chunk_starts.append(chunk_starts[-1] + len(group.get_bar_lengths()))
+    else:
+        chunk_starts = [0]
+    chunk_ends = chunk_starts[1:] + [len(bar_lengths)]
+
+    envelope_pieces = tempo_envelope.split_at([bar_line_locations[start] for start in chunk_starts[1:]])
+    return [
+        ScoreChunk(start, bar_lengths[start:end], measure_times[start:end], envelope_piece, float(start_times[start]))
+        for start, end, envelope_piece in zip(chunk_starts, chunk_ends, envelope_pieces)
+    ]
+
+
+def render_lilypond_source(source: str, cache_dir: str | Path = DEFAULT_CACHE_DIR,
+                           lilypond_command: str = "lilypond") -> Path:
+    """
+    Engraves the given LilyPond source to a PDF, unless a PDF for identical source is already in the cache.
+
+    :param source: LilyPond source
+    :param cache_dir: directory in which rendered PDFs are cached, keyed by the SHA-256 hash of their source
+    :param lilypond_command: the LilyPond executable to run
+    :return: path of the (cached) PDF
+    """
+    cache_dir = Path(cache_dir)
+    source_hash = hashlib.sha256(source.encode()).hexdigest()
+    pdf_path = cache_dir / f"{source_hash}.pdf"
+    if pdf_path.exists():
+        return pdf_path
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # render in a private directory and move the result into place, so that concurrent renders of the same source
+    # never see a half-written PDF
+    with tempfile.TemporaryDirectory(dir=cache_dir) as working_dir:
+        ly_path = Path(working_dir) / f"{source_hash}.ly"
+        ly_path.write_text(source)
+        output_base = Path(working_dir) / source_hash
+        subprocess.run([lilypond_command, "--pdf", "-o", str(output_base), str(ly_path)],
+                       check=True, capture_output=True)
+        os.replace(output_base.with_suffix(".pdf"), pdf_path)
+    return pdf_path
+
+
+def render_chunks(chunks: Sequence[ScoreChunk], cache_dir: str | Path = DEFAULT_CACHE_DIR, max_workers: int = None,
+                  lilypond_command: str = "lilypond", **file_kwargs) -> list[Path]:
+    """
+    Renders the given chunks to PDFs in a process pool, skipping any whose source is already cached.
+
+    :param chunks: the chunks to render
+    :param cache_dir: directory in which rendered PDFs are cached
+    :param max_workers: maximum number of LilyPond processes to run at once (defaults to the number of CPUs)
+    :param lilypond_command: the LilyPond executable to run
+    :param file_kwargs: passed on to iter_blank_lilypond_file (e.g. proportional_duration, page_size_in)
+    :return: the PDF path for each chunk, in order
+    """
+    sources = [chunk.to_lilypond(**file_kwargs) for chunk in chunks]
+    # identical chunks share one render
+    unique_sources = list(dict.fromkeys(sources))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pdf_paths = dict(zip(unique_sources, executor.map(
+            render_lilypond_source, unique_sources,
+            [cache_dir] * len(unique_sources), [lilypond_command] * len(unique_sources)
+        )))
+    return [pdf_paths[source] for source in sources]
+
+
+def stitch_pdfs(pdf_paths: Sequence[str | Path], output_path: str | Path) -> Path:
+    """
+    Concatenates the given PDFs into a single PDF. Requires the optional pypdf dependency.
+
+    :param pdf_paths: the PDFs to concatenate, in order
+    :param output_path: where to write the combined PDF
+    :return: output_path, as a Path
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        raise ImportError("Stitching rendered chunks requires pypdf (pip install composing_time[render])")
+    writer = PdfWriter()
+    for pdf_path in pdf_paths:
+        writer.append(str(pdf_path))
+    output_path = Path(output_path)
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    return output_path
+
+
+def render_metric_group(metric_group: "MetricGroup", output_path: str | Path, bars_per_chunk: int = None,
+                        cache_dir: str | Path = DEFAULT_CACHE_DIR, max_workers: int = None,
+                        lilypond_command: str = "lilypond", **file_kwargs) -> Path:
+    """
+    Renders a metric group to a single PDF by engraving it in independent chunks, in parallel, and stitching the
+    results together. Chunks whose LilyPond source is unchanged since a previous render come from the cache.
+
+    (See :func:`split_into_chunks` and :func:`render_chunks` for the parameters.)
+
+    :return: output_path, as a Path
+    """
+    chunks = split_into_chunks(metric_group, bars_per_chunk)
+    pdf_paths = render_chunks(chunks, cache_dir, max_workers, lilypond_command, **file_kwargs)
+    return stitch_pdfs(pdf_paths, output_path)
@@ -0,0 +1,210 @@
+import heapq
+import math
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterator, TYPE_CHECKING
+from .lilypond_text import measure_dur_to_time_sig
+from .timing import EnvelopeArrays, EnvelopeCursor, LINEAR_CURVE_SHAPE_THRESHOLD
+
+if TYPE_CHECKING:
+    from .metric_group import MetricGroup
+
+# ----------------------------- Standard MIDI File Tempo Maps ---------------------------------
+
+# A tempo map is a format 0 Standard MIDI File holding just a conductor track: a time signature event wherever the
+# time signature changes and tempo events tracing the tempo envelope. MIDI tempos are constant between events, so
+# each curved segment is cut into steps, each of which takes exactly as long as the stretch of curve it replaces.
+# The clock drifts furthest from the curve within a step where the curve's beat length crosses the step's, so that
+# drift can be worked out exactly, and steps are made as long as it allows: short where the tempo is changing fast,
+# long where it is nearly steady. MIDI tempos are whole microseconds per quarter note, so the rounding of each step
+# is carried into the next one, and steps are kept short enough that it can't build up within long stretches of
+# constant tempo either. Events are generated and written one at a time, so nothing grows with the length of the
+# piece; only the track length is patched in at the end.
+
+DEFAULT_PPQ = 480
+# largest tempo a MIDI tempo event can hold, in microseconds per quarter note
+_MAX_MICROSECONDS_PER_QUARTER = 0xFFFFFF
+# how much of max_error is set aside for the rounding of tempos to whole microseconds per quarter, which limits the
+# length of steps even where the tempo is constant
+_ROUNDING_ERROR_SHARE = 0.05
+# event kinds, in the order in which events on the same tick are written
+_TIME_SIGNATURE, _TEMPO = 0, 1
+
+
+def write_tempo_map(metric_group: "MetricGroup", file_path: str | Path, ppq: int = DEFAULT_PPQ,
+                    max_error: float = 0.001) -> Path:
+    """
+    Writes the time signatures and tempo envelope of a metric group to a Standard MIDI File conductor track.
+
+    :param metric_group: the metric group
+    :param file_path: where to write the MIDI file
+    :param ppq: ticks per quarter note (must be a multiple of 4, so that every 16th falls on a tick)
+    :param max_error: how far (in seconds) the MIDI file's clock may stray from the tempo envelope at any point,
+        leaving aside the rounding of event positions to whole ticks
+    :return: file_path, as a Path
+    """
+    file_path = Path(file_path)
+    with open(file_path, "wb") as f:
+        write_tempo_map_to_file(f, metric_group, ppq, max_error)
+    return file_path
+
+
+def write_tempo_map_to_file(file: BinaryIO, metric_group: "MetricGroup", ppq: int = DEFAULT_PPQ,
+                            max_error: float = 0.001) -> None:
+    """
+    Streams a tempo map to a seekable binary file handle. (See :func:`write_tempo_map`.)
+    """
+    file.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, ppq))
+    file.write(b"MTrk\0\0\0\0")
+    track_start = file.tell()
+    last_tick = 0
+    for tick, event in iter_tempo_map_events(metric_group, ppq, max_error):
+        file.write(_variable_length_quantity(tick - last_tick) + event)
+        last_tick = tick
+    end_tick = round(metric_group.total_beat_duration() * (ppq // 4))
+    file.write(_variable_length_quantity(max(end_tick - last_tick, 0)) + b"\xff\x2f\x00")
+    track_end = file.tell()
+    file.seek(track_start - 4)
+    file.write(struct.pack(">I", track_end - track_start))
+    file.seek(track_end)
+
+
+def iter_tempo_map_events(metric_group: "MetricGroup", ppq: int = DEFAULT_PPQ,
+                          max_error: float = 0.001) -> Iterator[tuple[int, bytes]]:
+    """
+    Generates the events of a tempo map in order. (See :func:`write_tempo_map` for the parameters.)
+
+    :return: iterator of (tick, meta event bytes) pairs
+    """
+    if ppq % 4 != 0 or not 0 < ppq < 0x8000:
+        raise ValueError("ppq must be a positive multiple of 4, less than 32768")
+    if max_error <= 0:
+        raise ValueError("max_error must be positive")
+    events = heapq.merge(
+        ((tick, _TIME_SIGNATURE, event) for tick, event in _iter_time_signature_events(metric_group, ppq)),
+        ((tick, _TEMPO, event) for tick, event in
+         _iter_tempo_events(EnvelopeArrays.from_envelope(metric_group.get_tempo_envelope()), ppq, max_error)),
+    )
+    for tick, _, event in events:
+        yield tick, event
+
+
+def _iter_time_signature_events(metric_group: "MetricGroup", ppq: int) -> Iterator[tuple[int, bytes]]:
+    ticks_per_16th = ppq // 4
+    last_time_signature = None
+    for bar_length, bar_line in zip(metric_group.get_bar_lengths(), metric_group.get_bar_line_locations()):
+        time_signature = measure_dur_to_time_sig(bar_length)
+        if time_signature != last_time_signature:
+            numerator, denominator = time_signature
+            # the metronome clicks once per denominator unit (24 MIDI clocks to the quarter), with 8 32nds per quarter
+            yield (round(bar_line * ticks_per_16th),
+                   b"\xff\x58\x04" + bytes([numerator, denominator.bit_length() - 1, 96 // denominator, 8]))
+            last_time_signature = time_signature
+
+
+def _iter_tempo_events(envelope_arrays: EnvelopeArrays, ppq: int, max_error: float) -> Iterator[tuple[int, bytes]]:
+    # steps through the envelope (in 16ths), yielding a tempo event at the start of each step with a new tempo
+    ticks_per_16th = ppq // 4
+    cursor = EnvelopeCursor(envelope_arrays)
+    # (a second cursor, for trying out possible steps)
+    trial_cursor = EnvelopeCursor(envelope_arrays)
+    midi_time = 0.0
+    last_tick = 0
+    last_tempo = None
+    # a tempo is off by at most half a microsecond per quarter note, so this is as long as a step can be while
+    # keeping its rounding error within its share
+    max_step_ticks = max(1, int(_ROUNDING_ERROR_SHARE * max_error / 0.5e-6 * ppq))
+    for start_beat, end_beat, start_level, end_level, curve_shape in zip(
+            envelope_arrays.start_beats.tolist(), envelope_arrays.end_beats.tolist(),
+            envelope_arrays.start_levels.tolist(), envelope_arrays.end_levels.tolist(),
+            envelope_arrays.curve_shapes.tolist()):
+        end_tick = round(end_beat * ticks_per_16th)
+        if end_tick <= last_tick:
+            continue
+        segment = _SegmentLevels(start_beat, end_beat, start_level, end_level, curve_shape)
+        while last_tick < end_tick:
+            tick = _next_step_end(segment, trial_cursor, last_tick, min(end_tick, last_tick + max_step_ticks),
+                                  ticks_per_16th, (1 - _ROUNDING_ERROR_SHARE) * max_error)
+            # the tempo that makes this step take as long as the envelope does, less any drift carried over
+            exact_time = cursor.advance_to(tick / ticks_per_16th)
+            tempo = round((exact_time - midi_time) * 1e6 * ppq / (tick - last_tick))
+            tempo = min(max(tempo, 1), _MAX_MICROSECONDS_PER_QUARTER)
+            midi_time += tempo * (tick - last_tick) / ppq / 1e6
+            if tempo != last_tempo:
+                yield last_tick, b"\xff\x51\x03" + tempo.to_bytes(3, "big")
+                last_tempo = tempo
+            last_tick = tick
+
+
+def _next_step_end(segment: "_SegmentLevels", cursor: EnvelopeCursor, start_tick: int, end_tick: int,
+                   ticks_per_16th: int, max_error: float) -> int:
+    # the tick at which a step starting at start_tick should end, so that the clock drifts by at most max_error
+    # within it: as long as possible, but no further than end_tick
+    if segment.is_constant:
+        return end_tick
+    start_beat = start_tick / ticks_per_16th
+    # first guess, from the rate of change of the beat length, for which the drift is about step^2 * slope / 8
+    slope = abs(segment.slope_at(start_beat))
+    step = math.sqrt(8 * max_error / slope) if slope > 0 else math.inf
+    while True:
+        tick = min(end_tick, max(start_tick + 1, round((start_beat + step) * ticks_per_16th)))
+        beat = tick / ticks_per_16th
+        if tick == start_tick + 1 or _get_step_error(segment, cursor, start_beat, beat) <= max_error:
+            return tick
+        step = min(step, beat - start_beat) * 0.7
+
+
+def _get_step_error(segment: "_SegmentLevels", cursor: EnvelopeCursor, start_beat: float, end_beat: float) -> float:
+    # how far the clock strays from the envelope within a step of constant tempo that lasts as long as the envelope
+    # does from start_beat to end_beat. The beat length is monotonic along a segment, so the gap is largest where
+    # it crosses the step's beat length.
+    start_time = cursor.advance_to(start_beat)
+    step_level = (cursor.advance_to(end_beat) - start_time) / (end_beat - start_beat)
+    crossing = min(max(segment.beat_at_level(step_level), start_beat), end_beat)
+    return abs(cursor.advance_to(crossing) - start_time - step_level * (crossing - start_beat))
+
+
+class _SegmentLevels:
+    """The beat length and its rate of change along a single envelope segment (see EnvelopeArrays._levels_at)."""
+
+    def __init__(self, start_beat: float, end_beat: float, start_level: float, end_level: float, curve_shape: float):
+        self.start_beat = start_beat
+        self.duration = end_beat - start_beat
+        self.start_level = start_level
+        self.level_change = end_level - start_level
+        self.curve_shape = 0.0 if abs(curve_shape) < LINEAR_CURVE_SHAPE_THRESHOLD else curve_shape
+        self.is_constant = self.level_change == 0 or self.duration == 0
+
+    def _progress(self, beat: float) -> float:
+        return min(max((beat - self.start_beat) / self.duration, 0.0), 1.0)
+
+    def level_at(self, beat: float) -> float:
+        x = self._progress(beat)
+        if self.curve_shape == 0:
+            return self.start_level + x * self.level_change
+        return self.start_level + self.level_change / math.expm1(self.curve_shape) * math.expm1(self.curve_shape * x)
+
+    def beat_at_level(self, level: float) -> float:
+        # (the inverse of level_at)
+        if self.curve_shape == 0:
+            x = (level - self.start_level) / self.level_change
+        else:
+            x = math.log1p((level - self.start_level) / self.level_change * math.expm1(self.curve_shape)) \
+                / self.curve_shape
+        return self.start_beat + min(max(x, 0.0), 1.0) * self.duration
+
+    def slope_at(self, beat: float) -> float:
+        x = self._progress(beat)
+        if self.curve_shape == 0:
+            return self.level_change / self.duration
+        return (self.level_change / math.expm1(self.curve_shape) * self.curve_shape * math.exp(self.curve_shape * x)
+                / self.duration)
+
+
+def _variable_length_quantity(value: int) -> bytes:
+    result = [value & 0x7F]
+    value >>= 7
+    while value:
+        result.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(result))
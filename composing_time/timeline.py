@@ -0,0 +1,178 @@
+from pathlib import Path
+from typing import Iterator, TextIO, TYPE_CHECKING
+import numpy as np
+from .lilypond_text import measure_dur_to_time_sig
+from .timing import EnvelopeArrays, get_bar_times
+
+if TYPE_CHECKING:
+    from .metric_group import MetricGroup
+
+# ----------------------------- SVG Timelines ---------------------------------
+
+# A quick preview of a metric group, drawn straight to SVG rather than engraved: bars are laid out in proportion to
+# the time they take, with their time signatures above and the same mm:ss timestamps as the score below, and the
+# tempo curve is drawn across them. Positions are computed with NumPy a batch of bars (or envelope segments) at a
+# time and written out as they are formatted, so even an hour-long form takes a fraction of a second. Timestamps
+# that would crowd the last one drawn are left out, and so is the text of time signature changes that would crowd
+# the last one labelled, though every change is still marked.
+
+_STYLE = """
+.background { fill: white; }
+.shading { fill: #f0f0f0; }
+.bar-lines { stroke: #888; stroke-width: 1; fill: none; }
+.axis { stroke: #444; stroke-width: 1; }
+.tempo { stroke: #c0392b; stroke-width: 1.5; fill: none; stroke-linejoin: round; }
+.signature { font-size: 11px; font-weight: bold; fill: #222; }
+.signature-marks { stroke: #222; stroke-width: 1.5; fill: none; }
+.timestamp { font-size: 10px; fill: #444; }
+.tempo-label { font-size: 10px; fill: #c0392b; text-anchor: end; }
+"""
+
+
+def write_timeline_svg(metric_group: "MetricGroup", file_path: str | Path, **kwargs) -> Path:
+    """
+    Draws a metric group as a timeline in an SVG file. Keyword arguments are passed on to iter_timeline_svg.
+
+    :return: file_path, as a Path
+    """
+    file_path = Path(file_path)
+    with open(file_path, "w") as f:
+        write_timeline_svg_to_file(f, metric_group, **kwargs)
+    return file_path
+
+
+def write_timeline_svg_to_file(file: TextIO, metric_group: "MetricGroup", **kwargs) -> None:
+    """Streams a timeline SVG to the given text file handle. (See :func:`iter_timeline_svg`.)"""
+    for text in iter_timeline_svg(metric_group, **kwargs):
+        file.write(text)
+
+
+def iter_timeline_svg(metric_group: "MetricGroup", pixels_per_second: float = 8, height: float = 160,
+                      min_label_spacing: float = 40, tempo_sample_spacing: float = 2,
+                      batch_size: int = 4096) -> Iterator[str]:
+    """
+    Generates the text of a timeline SVG for a metric group, a piece at a time.
+
+    :param metric_group: the metric group to draw
+    :param pixels_per_second: horizontal scale
+    :param height: height of the drawing in pixels
+    :param min_label_spacing: timestamps are kept at least this many pixels apart (and time signatures half as
+        many), by leaving out any that would come too close to the last one drawn. A time signature change left
+        without its text is still marked.
+    :param tempo_sample_spacing: roughly how many pixels apart to sample the tempo curve
+    :param batch_size: how many bars (or envelope segments) to draw at a time
+    """
+    bar_lengths = np.asarray(metric_group.get_bar_lengths())
+    envelope_arrays = EnvelopeArrays.from_envelope(metric_group.get_tempo_envelope())
+    bar_start_times, bar_times = get_bar_times(metric_group.get_bar_line_locations(), envelope_arrays)
+    total_time = float(bar_start_times[-1] + bar_times[-1]) if len(bar_times) else 0.0
+
+    left, right = 50.0, 10.0
+    width = left + total_time * pixels_per_second + right
+    signature_y, lane_top, lane_bottom = 14.0, 22.0, height - 30
+    timestamp_y = height - 14
+    bar_xs = left + bar_start_times * pixels_per_second
+    bar_widths = bar_times * pixels_per_second
+
+    # tempos are in the envelope's own units (beats of the metric group per minute); along each segment the tempo
+    # moves monotonically between its endpoints, so those give the range
+    tempos = 60 / np.concatenate((envelope_arrays.start_levels, envelope_arrays.end_levels))
+    min_tempo, max_tempo = float(tempos.min()), float(tempos.max())
+    if max_tempo - min_tempo < 1e-9:
+        min_tempo, max_tempo = min_tempo * 0.9, max_tempo * 1.1
+    tempo_top, tempo_bottom = lane_top + 8, lane_bottom - 8
+
+    def tempo_to_y(tempo):
+        return tempo_bottom - (tempo - min_tempo) / (max_tempo - min_tempo) * (tempo_bottom - tempo_top)
+
+    yield (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+           f'viewBox="0 0 {width:.2f} {height:.2f}" font-family="sans-serif">\n')
+    yield f"<style>{_STYLE}</style>\n"
+    yield f'<rect class="background" width="{width:.2f}" height="{height:.2f}"/>\n'
+
+    # every other bar is shaded, and every bar line is drawn, each as a single path
+    lane_height = lane_bottom - lane_top
+    yield '<path class="shading" d="'
+    for start in range(1, len(bar_xs), 2 * batch_size):
+        yield "".join(f"M{x:.2f} {lane_top:.2f}h{w:.2f}v{lane_height:.2f}h{-w:.2f}z" for x, w in
+                      zip(bar_xs[start:start + 2 * batch_size:2].tolist(),
+                          bar_widths[start:start + 2 * batch_size:2].tolist()))
+    yield '"/>\n<path class="bar-lines" d="'
+    bar_line_xs = np.append(bar_xs, left + total_time * pixels_per_second)
+    for start in range(0, len(bar_line_xs), batch_size):
+        yield "".join(f"M{x:.2f} {lane_top:.2f}V{lane_bottom:.2f}"
+                      for x in bar_line_xs[start:start + batch_size].tolist())
+    yield '"/>\n'
+
+    # time signatures where they change, and timestamps, each thinned so that they don't overlap. Every change of
+    # time signature is marked, even where there isn't room for its text.
+    # (the score's time signatures, worked out once per distinct bar length)
+    distinct_lengths, length_indices = np.unique(bar_lengths, return_inverse=True)
+    numerators, denominators = np.array([measure_dur_to_time_sig(length)
+                                         for length in distinct_lengths.tolist()]).reshape(-1, 2)[length_indices].T
+    changes = np.ones(len(bar_lengths), dtype=bool)
+    changes[1:] = (numerators[1:] != numerators[:-1]) | (denominators[1:] != denominators[:-1])
+    change_bars = np.flatnonzero(changes)
+    labelled = _spaced_out(bar_xs[change_bars], min_label_spacing / 2)
+    signature_bars, unlabelled_bars = change_bars[labelled], change_bars[~labelled]
+    timestamp_bars = np.flatnonzero(_spaced_out(bar_xs, min_label_spacing))
+    yield '<path class="signature-marks" d="'
+    for start in range(0, len(unlabelled_bars), batch_size):
+        yield "".join(f"M{x:.2f} {signature_y - 8:.2f}V{lane_top:.2f}"
+                      for x in bar_xs[unlabelled_bars[start:start + batch_size]].tolist())
+    yield '"/>\n<g class="signature">\n'
+    for start in range(0, len(signature_bars), batch_size):
+        bars = signature_bars[start:start + batch_size]
+        yield "".join(f'<text x="{x + 2:.2f}" y="{signature_y:.2f}">{n}/{d}</text>\n' for x, n, d in
+                      zip(bar_xs[bars].tolist(), numerators[bars].tolist(), denominators[bars].tolist()))
+    yield '</g>\n<g class="timestamp">\n'
+    for start in range(0, len(timestamp_bars), batch_size):
+        bars = timestamp_bars[start:start + batch_size]
+        # (as in format_timestamp)
+        seconds = bar_start_times[bars]
+        yield "".join(f'<text x="{x + 2:.2f}" y="{timestamp_y:.2f}">{m:02d}:{s:02d}</text>\n' for x, m, s in
+                      zip(bar_xs[bars].tolist(), (seconds // 60).astype(int).tolist(),
+                          (seconds % 60).astype(int).tolist()))
+    yield "</g>\n"
+
+    # the tempo curve, with its range marked on the left
+    yield (f'<line class="axis" x1="{left:.2f}" y1="{lane_top:.2f}" x2="{left:.2f}" y2="{lane_bottom:.2f}"/>\n'
+           f'<text class="tempo-label" x="{left - 4:.2f}" y="{tempo_to_y(max_tempo) + 4:.2f}">{max_tempo:.0f}</text>\n'
+           f'<text class="tempo-label" x="{left - 4:.2f}" y="{tempo_to_y(min_tempo) + 4:.2f}">{min_tempo:.0f}</text>\n')
+    yield '<polyline class="tempo" points="'
+    num_segments = len(envelope_arrays.durations)
+    for start in range(0, num_segments, batch_size):
+        times, tempos = _sample_tempo_curve(envelope_arrays, np.arange(start, min(start + batch_size, num_segments)),
+                                            tempo_sample_spacing / pixels_per_second)
+        yield " ".join(f"{x:.2f},{y:.2f}" for x, y in
+                       zip((left + times * pixels_per_second).tolist(), tempo_to_y(tempos).tolist())) + " "
+    yield '"/>\n</svg>\n'
+
+
+def _spaced_out(xs: np.ndarray, spacing: float) -> np.ndarray:
+    # which of the given (sorted) positions to label: the first, then each one at least the given spacing past the
+    # last one labelled. (Each choice depends on the last, so this is a plain loop over a list of floats.)
+    kept = []
+    next_x = -np.inf
+    for i, x in enumerate(xs.tolist()):
+        if x >= next_x:
+            kept.append(i)
+            next_x = x + spacing
+    keep = np.zeros(len(xs), dtype=bool)
+    keep[kept] = True
+    return keep
+
+
+def _sample_tempo_curve(envelope_arrays: EnvelopeArrays, segment_indices: np.ndarray,
+                        sample_spacing: float) -> tuple[np.ndarray, np.ndarray]:
+    # points along the given segments of the tempo curve, as (times, tempos), including both ends of every segment
+    # (so that jumps are drawn as vertical lines) and enough points in between to keep them about sample_spacing
+    # seconds apart
+    segment_pixels = envelope_arrays.segment_integrals[segment_indices] / sample_spacing
+    num_points = 2 + np.maximum(np.ceil(segment_pixels).astype(int) - 1, 0)
+    point_segments = np.repeat(segment_indices, num_points)
+    first_points = np.cumsum(num_points) - num_points
+    # the progress through its segment of each point, from 0 to 1
+    x = (np.arange(num_points.sum()) - np.repeat(first_points, num_points)) / np.repeat(num_points - 1, num_points)
+    beats = envelope_arrays.start_beats[point_segments] + x * envelope_arrays.durations[point_segments]
+    return envelope_arrays.times_at_beats(beats), 60 / envelope_arrays._levels_at(point_segments, x)
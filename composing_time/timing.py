@@ -0,0 +1,286 @@
+import math
+import numpy as np
+from typing import Sequence
+from clockblocks import TempoEnvelope
+from .instrumentation import traced
+
+# ----------------------------- Tick Timebase ---------------------------------
+
+# Positions in the score (bar lines, tempo annotations, skips) are counted in whole ticks, so that they compare,
+# hash and index exactly. Tempo envelopes, and the seconds integrated from them, stay in floating point beats;
+# positions are only converted to and from ticks at that boundary. A 16th note is TICKS_PER_16TH ticks, so bar
+# lengths in 16ths convert exactly, and TICKS_PER_QUARTER divides evenly into triplets and quintuplets.
+
+TICKS_PER_QUARTER = 960
+TICKS_PER_16TH = TICKS_PER_QUARTER // 4
+
+
+def beats_to_ticks(beats: float, ticks_per_beat: int = TICKS_PER_16TH) -> int:
+    """
+    Converts a position in beats (16ths by default, like bar lengths) to the nearest tick.
+
+    :param beats: the position in beats
+    :param ticks_per_beat: how many ticks make up a beat (TICKS_PER_QUARTER for beats in quarter notes)
+    """
+    return round(beats * ticks_per_beat)
+
+
+def ticks_to_beats(ticks: int, ticks_per_beat: int = TICKS_PER_16TH) -> float:
+    """Inverse of :func:`beats_to_ticks`."""
+    return ticks / ticks_per_beat
+
+
+# ----------------------------- Bar Timing Engine ---------------------------------
+
+# below this absolute curve shape, expenvelope treats a segment as linear; we do the same so that results agree
+LINEAR_CURVE_SHAPE_THRESHOLD = 0.000001
+
+
+class EnvelopeArrays:
+    """
+    Columnar (NumPy) view of the segments of a TempoEnvelope, with the closed-form integral of each segment
+    precomputed. Integrating beat length over beats gives time, so this lets us convert any number of beats to
+    times in one vectorized pass, rather than re-integrating the envelope from beat 0 for every query.
+
+    :param start_beats: start beat of each segment
+    :param end_beats: end beat of each segment
+    :param start_levels: beat length (seconds per beat) at the start of each segment
+    :param end_levels: beat length (seconds per beat) at the end of each segment
+    :param curve_shapes: curve shape of each segment (see expenvelope's EnvelopeSegment)
+    """
+
+    def __init__(self, start_beats: Sequence[float], end_beats: Sequence[float], start_levels: Sequence[float],
+                 end_levels: Sequence[float], curve_shapes: Sequence[float]):
+        self.start_beats = np.asarray(start_beats, dtype=float)
+        self.end_beats = np.asarray(end_beats, dtype=float)
+        self.start_levels = np.asarray(start_levels, dtype=float)
+        self.end_levels = np.asarray(end_levels, dtype=float)
+        self.curve_shapes = np.asarray(curve_shapes, dtype=float)
+        self.durations = self.end_beats - self.start_beats
+        # cumulative_integrals[i] is the time elapsed between the start of the envelope and the start of segment i
+        self.segment_integrals = self._integrate_from_segment_start(np.arange(len(self.durations)), self.durations)
+        self.cumulative_integrals = np.concatenate(([0.0], np.cumsum(self.segment_integrals)))
+
+    @classmethod
+    def from_envelope(cls, tempo_envelope: TempoEnvelope) -> "EnvelopeArrays":
+        segments = tempo_envelope.segments
+        return cls(
+            [segment.start_time for segment in segments],
+            [segment.end_time for segment in segments],
+            [segment.start_level for segment in segments],
+            [segment.end_level for segment in segments],
+            [segment.curve_shape for segment in segments],
+        )
+
+    @property
+    def start_beat(self) -> float:
+        return self.start_beats[0]
+
+    @property
+    def end_beat(self) -> float:
+        return self.end_beats[-1]
+
+    def _integrate_from_segment_start(self, segment_indices: np.ndarray, beat_offsets: np.ndarray) -> np.ndarray:
+        """
+        Closed-form integral of the given segments from their start to the given offset (in beats) into them.
+        The curve is y(x) = y1 + (y2 - y1) / (e^S - 1) * (e^(S*x) - 1) for normalized progress x, so its
+        antiderivative is A * x + B * e^(S*x), with the same A and B constants that expenvelope uses.
+        """
+        durations = self.durations[segment_indices]
+        y1 = self.start_levels[segment_indices]
+        y2 = self.end_levels[segment_indices]
+        shapes = self.curve_shapes[segment_indices]
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            x = np.where(durations > 0, beat_offsets / durations, 0.0)
+            linear = np.abs(shapes) < LINEAR_CURVE_SHAPE_THRESHOLD
+            # substitute a harmless curve shape for linear segments so that the exponential branch stays finite
+            safe_shapes = np.where(linear, 1.0, shapes)
+            exp_s_minus_1 = np.expm1(safe_shapes)
+            a = y1 - (y2 - y1) / exp_s_minus_1
+            b = (y2 - y1) / (safe_shapes * exp_s_minus_1)
+            curved_area = durations * (a * x + b * np.expm1(safe_shapes * x))
+            linear_area = beat_offsets * (y1 + 0.5 * x * (y2 - y1))
+        return np.where(linear, linear_area, curved_area)
+
+    def times_at_beats(self, beats: Sequence[float]) -> np.ndarray:
+        """
+        Vectorized equivalent of TempoEnvelope.time_at_beat: the time elapsed between beat 0 and each of the given
+        beats. Beats outside the envelope continue at its start or end level, as in TempoEnvelope.
+
+        :param beats: array of beats
+        :return: array of times in seconds
+        """
+        beats = np.asarray(beats, dtype=float)
+        return self._antiderivative(beats) - self._antiderivative(np.zeros(1))[0]
+
+    def beats_at_times(self, times: Sequence[float], max_error: float = 1e-10) -> np.ndarray:
+        """
+        Vectorized equivalent of TempoEnvelope.beat_at_time: the inverse of :func:`times_at_beats`.
+
+        :param times: array of times in seconds, measured from beat 0
+        :param max_error: tolerance (in normalized segment progress) for the Newton iteration on curved segments
+        :return: array of beats
+        """
+        areas = np.asarray(times, dtype=float) + self._antiderivative(np.zeros(1))[0]
+        num_segments = len(self.durations)
+        # the last segment whose cumulative start area is <= the target; zero-length segments have no area, so
+        # side="right" steps past them
+        segment_indices = np.searchsorted(self.cumulative_integrals[1:], areas, side="right")
+        inside = (segment_indices < num_segments) & (areas >= 0)
+        clipped_indices = np.minimum(segment_indices, num_segments - 1)
+        remaining = areas - self.cumulative_integrals[clipped_indices]
+        durations = self.durations[clipped_indices]
+        segment_areas = np.where(durations > 0, self.segment_integrals[clipped_indices], 1.0)
+        # Newton's method on the (monotonic) segment integral, starting from the proportional guess
+        x = np.clip(remaining / segment_areas, 0, 1)
+        for _ in range(64):
+            error = self._integrate_from_segment_start(clipped_indices, x * durations) - remaining
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = np.where(durations > 0, error / (durations * self._levels_at(clipped_indices, x)), 0.0)
+            x = np.clip(x - step, 0, 1)
+            if np.all(np.abs(step) < max_error):
+                break
+        beats = np.where(
+            inside,
+            self.start_beats[clipped_indices] + x * durations,
+            self.end_beat + (areas - self.cumulative_integrals[-1]) / self.end_levels[-1]
+        )
+        return np.where(areas < 0, self.start_beat + areas / self.start_levels[0], beats)
+
+    def levels_at_beats(self, beats: Sequence[float]) -> np.ndarray:
+        """
+        Vectorized equivalent of TempoEnvelope.beat_length_at: the beat length (seconds per beat) at each beat.
+        Where the envelope jumps, this gives the level after the jump.
+
+        :param beats: array of beats
+        :return: array of beat lengths
+        """
+        beats = np.asarray(beats, dtype=float)
+        num_segments = len(self.durations)
+        segment_indices = np.searchsorted(self.end_beats, beats, side="right")
+        clipped_indices = np.minimum(segment_indices, num_segments - 1)
+        durations = self.durations[clipped_indices]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = np.where(durations > 0, (beats - self.start_beats[clipped_indices]) / durations, 0.0)
+        levels = np.where(segment_indices < num_segments, self._levels_at(clipped_indices, np.clip(x, 0, 1)),
+                          self.end_levels[-1])
+        return np.where(beats < self.start_beat, self.start_levels[0], levels)
+
+    def _levels_at(self, segment_indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        # the level of the given segments at normalized progress x
+        y1 = self.start_levels[segment_indices]
+        y2 = self.end_levels[segment_indices]
+        shapes = self.curve_shapes[segment_indices]
+        linear = np.abs(shapes) < LINEAR_CURVE_SHAPE_THRESHOLD
+        safe_shapes = np.where(linear, 1.0, shapes)
+        with np.errstate(over="ignore", invalid="ignore"):
+            curved = y1 + (y2 - y1) / np.expm1(safe_shapes) * np.expm1(safe_shapes * x)
+        return np.where(linear, y1 + x * (y2 - y1), curved)
+
+    def _antiderivative(self, beats: np.ndarray) -> np.ndarray:
+        # the time at each beat, measured from the start of the envelope
+        # searching the segment end beats skips over zero-length segments, which contribute nothing to the integral
+        num_segments = len(self.durations)
+        segment_indices = np.searchsorted(self.end_beats, beats, side="right")
+        inside = segment_indices < num_segments
+        clipped_indices = np.minimum(segment_indices, num_segments - 1)
+        offsets = beats - self.start_beats[clipped_indices]
+        times = np.where(
+            inside,
+            self.cumulative_integrals[clipped_indices] + self._integrate_from_segment_start(clipped_indices, offsets),
+            self.cumulative_integrals[-1] + (beats - self.end_beat) * self.end_levels[-1]
+        )
+        before_start = beats < self.start_beat
+        return np.where(before_start, (beats - self.start_beat) * self.start_levels[0], times)
+
+
+@traced("bar_timing")
+def get_bar_times(bar_line_locations: Sequence[float],
+                  tempo_envelope: TempoEnvelope | EnvelopeArrays) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the start time and duration (in seconds) of every bar in a single pass over the envelope.
+
+    :param bar_line_locations: the cumulative bar line locations in beats, starting with the first downbeat and
+        ending with the final bar line (so one longer than the number of bars)
+    :param tempo_envelope: the TempoEnvelope that the bars are played under (or its EnvelopeArrays)
+    :return: a tuple of (bar start times, bar durations), as NumPy arrays
+    """
+    if not isinstance(tempo_envelope, EnvelopeArrays):
+        tempo_envelope = EnvelopeArrays.from_envelope(tempo_envelope)
+    bar_line_times = tempo_envelope.times_at_beats(bar_line_locations)
+    return bar_line_times[:-1], np.diff(bar_line_times)
+
+
+class EnvelopeCursor:
+    """
+    Walks a tempo envelope from front to back, keeping track of the current segment and the time accumulated so
+    far, so that each step costs amortized O(1) instead of re-integrating the envelope from beat 0 (as
+    TempoEnvelope.time_at_beat does).
+
+    :param tempo_envelope: the TempoEnvelope to walk (or its EnvelopeArrays)
+    :param beat: the beat to start from
+    :ivar beat: the current beat
+    :ivar time: the time (in seconds) at the current beat, measured from beat 0
+    """
+
+    def __init__(self, tempo_envelope: TempoEnvelope | EnvelopeArrays, beat: float = 0):
+        if not isinstance(tempo_envelope, EnvelopeArrays):
+            tempo_envelope = EnvelopeArrays.from_envelope(tempo_envelope)
+        self.envelope_arrays = tempo_envelope
+        # plain Python lists and math are much faster than NumPy for one step at a time
+        self._start_beats = tempo_envelope.start_beats.tolist()
+        self._end_beats = tempo_envelope.end_beats.tolist()
+        self._start_levels = tempo_envelope.start_levels.tolist()
+        self._end_levels = tempo_envelope.end_levels.tolist()
+        self._curve_shapes = tempo_envelope.curve_shapes.tolist()
+        self._cumulative_integrals = tempo_envelope.cumulative_integrals.tolist()
+        # times are measured from beat 0, which needn't be where the envelope starts
+        self._time_at_zero = float(tempo_envelope._antiderivative(np.zeros(1))[0])
+        self._segment_index = 0
+        self.beat = 0.0
+        self.time = 0.0
+        self.advance_to(beat)
+
+    def advance(self, delta_beats: float) -> float:
+        """
+        Moves the cursor forward by the given number of beats.
+
+        :return: the time at the new beat
+        """
+        return self.advance_to(self.beat + delta_beats)
+
+    def advance_to(self, beat: float) -> float:
+        """
+        Moves the cursor to the given beat (normally forward; moving backward walks back over segments).
+
+        :return: the time at the new beat
+        """
+        num_segments = len(self._end_beats)
+        while self._segment_index < num_segments - 1 and beat >= self._end_beats[self._segment_index]:
+            self._segment_index += 1
+        while self._segment_index > 0 and beat < self._start_beats[self._segment_index]:
+            self._segment_index -= 1
+        self.beat = beat
+        self.time = self._antiderivative(beat) - self._time_at_zero
+        return self.time
+
+    def _antiderivative(self, beat: float) -> float:
+        # time at the given beat measured from the start of the envelope, assuming it's in the current segment
+        # (or beyond either end of the envelope)
+        i = self._segment_index
+        start_beat, end_beat = self._start_beats[i], self._end_beats[i]
+        if beat < self._start_beats[0]:
+            return (beat - self._start_beats[0]) * self._start_levels[0]
+        if beat >= end_beat:
+            return self._cumulative_integrals[i + 1] + (beat - end_beat) * self._end_levels[i]
+        y1, y2, shape = self._start_levels[i], self._end_levels[i], self._curve_shapes[i]
+        offset = beat - start_beat
+        x = offset / (end_beat - start_beat)
+        if abs(shape) < LINEAR_CURVE_SHAPE_THRESHOLD:
+            area = offset * (y1 + 0.5 * x * (y2 - y1))
+        else:
+            exp_s_minus_1 = math.expm1(shape)
+            a = y1 - (y2 - y1) / exp_s_minus_1
+            b = (y2 - y1) / (shape * exp_s_minus_1)
+            area = (end_beat - start_beat) * (a * x + b * math.expm1(shape * x))
+        return self._cumulative_integrals[i] + area
@@ -1,5 +1,6 @@
 from composing_time.metric_group import MetricGroup
 import abjad
+from composing_time.abjad_utils import format_lilypond_file
 
 mg = MetricGroup.load_from_json("bar_config.json")
 
@@ -10,5 +11,5 @@ mg = MetricGroup.load_from_json("bar_config.json")
 # mg.get_tempo_envelope().show_plot()
 
 lilypond_file = mg.to_lilypond_file()
-print(abjad.lilypond(lilypond_file))
+print(format_lilypond_file(lilypond_file))
 abjad.show(lilypond_file)
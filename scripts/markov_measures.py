@@ -3,6 +3,7 @@ import random
 import abjad
 import itertools
 from scamp import TempoEnvelope
+from composing_time.timing import EnvelopeCursor
 
 
 # TODO:
@@ -49,7 +50,7 @@ def build_measure_list(
         
     measure_durs_list = []
     measure_times_list = []
-    beat = 0
+    cursor = EnvelopeCursor(tempo_envelope)
     t = last_t = 0
     while t < total_dur_in_seconds:
         if measure_durs_list:
@@ -60,8 +61,7 @@ def build_measure_list(
             next_measure_dur = start_measure_dur
             
         measure_durs_list.append(next_measure_dur)
-        beat += next_measure_dur * 0.25  # since next_measure_dur is in 16th notes
-        t = tempo_envelope.time_at_beat(beat)
+        t = cursor.advance(next_measure_dur * 0.25)  # since next_measure_dur is in 16th notes
         measure_times_list.append(t - last_t)
         last_t = t
     return measure_durs_list, measure_times_list
@@ -0,0 +1,17 @@
+import os
+import pytest
+from composing_time.lilypond_text import get_lilypond_version_string
+
+
+@pytest.fixture
+def stub_lilypond(tmp_path, monkeypatch):
+    """Puts a stand-in `lilypond` on the PATH that only answers `lilypond --version`."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    lilypond = bin_dir / "lilypond"
+    lilypond.write_text('#!/bin/sh\necho "GNU LilyPond 2.24.4"\n')
+    lilypond.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    get_lilypond_version_string.cache_clear()
+    yield lilypond
+    get_lilypond_version_string.cache_clear()
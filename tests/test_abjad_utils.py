@@ -0,0 +1,49 @@
+from fractions import Fraction
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.lilypond_text import get_tempo_annotation_plan
+from composing_time.timing import TICKS_PER_16TH, TICKS_PER_QUARTER
+
+abjad = pytest.importorskip("abjad")
+from composing_time.abjad_utils import create_blank_score, create_tempo_skip_voice  # noqa: E402
+
+# (in 16ths) steady, a ramp into a jump, then a curve that ends in a parenthesized tempo
+TEMPO_ENVELOPE = TempoEnvelope([240, 240, 360, 300, 480], [8, 13, 0, 23], [0, 0, 0, 2])
+
+
+def test_merged_skips_keep_positions_and_duration():
+    annotations = get_tempo_annotation_plan(TEMPO_ENVELOPE, ticks_per_beat=TICKS_PER_16TH).annotations
+    voice, tick_to_skip = create_tempo_skip_voice(annotations)
+    merged_voice, merged_tick_to_skip = create_tempo_skip_voice(annotations, merge_skips=True)
+    assert len(merged_voice) < len(voice)
+    assert abjad.get.duration(merged_voice) == abjad.get.duration(voice)
+    assert tick_to_skip.keys() == merged_tick_to_skip.keys()
+    for tick in tick_to_skip:
+        # (offsets are in whole notes; each annotation is on the skip containing it, which starts on the 16th grid)
+        expected = Fraction(tick // TICKS_PER_16TH * TICKS_PER_16TH, 4 * TICKS_PER_QUARTER)
+        assert abjad.get.timespan(tick_to_skip[tick]).start_offset == expected
+        assert abjad.get.timespan(merged_tick_to_skip[tick]).start_offset == expected
+
+
+def test_blank_score_tempo_voice_duration_is_unchanged_by_merging():
+    bar_lengths = [8, 7, 6, 23]
+    durations = [abjad.get.duration(create_blank_score(bar_lengths, None, TEMPO_ENVELOPE,
+                                                       merge_tempo_skips=merge)["TempoVoice"])
+                 for merge in (False, True)]
+    assert durations[0] == durations[1]
+
+
+def test_skip_duration_is_still_accepted():
+    annotations = get_tempo_annotation_plan(TEMPO_ENVELOPE, ticks_per_beat=TICKS_PER_16TH).annotations
+    voice, tick_to_skip = create_tempo_skip_voice(annotations)
+    # the same annotations, with their time points in quarter notes
+    beat_annotations = [(start / TICKS_PER_QUARTER, None if end is None else end / TICKS_PER_QUARTER, annotation)
+                        for start, end, annotation in annotations]
+    for call in (lambda: create_tempo_skip_voice(beat_annotations, skip_duration=0.25),
+                 lambda: create_tempo_skip_voice(beat_annotations, 0.25)):
+        with pytest.warns(DeprecationWarning):
+            old_voice, beat_to_skip = call()
+        assert abjad.lilypond(old_voice) == abjad.lilypond(voice)
+        assert {beat * TICKS_PER_QUARTER: abjad.get.timespan(skip).start_offset
+                for beat, skip in beat_to_skip.items()} == {
+            tick: abjad.get.timespan(skip).start_offset for tick, skip in tick_to_skip.items()}
@@ -0,0 +1,92 @@
+import io
+import json
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.batch import BatchJob, expand_jobs, run_batch, main
+from composing_time.metric_group import MetricGroup, SimpleMetricGroup
+
+CONFIG = {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 60}, {"bar_lengths": [5, 6], "tempo": 72, "end_tempo": 90}]}
+
+
+def _write_configs(directory, names):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        (directory / f"{name}.json").write_text(json.dumps(CONFIG))
+
+
+def _expected_text(config, **params):
+    out = io.StringIO()
+    MetricGroup.parse_json(config).write_lilypond_file(out, **params)
+    return out.getvalue()
+
+
+def test_expand_jobs_grid_and_names(tmp_path):
+    _write_configs(tmp_path / "forms", ["a", "b"])
+    _write_configs(tmp_path / "other", ["a"])
+    group = SimpleMetricGroup([4, 4], TempoEnvelope(60))
+    jobs = expand_jobs([tmp_path / "forms" / "*.json", tmp_path / "other" / "a.json", group], tmp_path / "out",
+                       {"proportional_duration": [(1, 20), (1, 16)], "merge_tempo_skips": [False, True]})
+    assert [job.output_path.name for job in jobs] == [
+        f"{name}.{j}.ly" for name in ("a", "b", "a-2", "config3") for j in range(4)
+    ]
+    assert all(job.output_path.parent == tmp_path / "out" for job in jobs)
+    assert [job.params for job in jobs[:4]] == [
+        {"proportional_duration": (1, 20), "merge_tempo_skips": False},
+        {"proportional_duration": (1, 20), "merge_tempo_skips": True},
+        {"proportional_duration": (1, 16), "merge_tempo_skips": False},
+        {"proportional_duration": (1, 16), "merge_tempo_skips": True},
+    ]
+    assert jobs[-1].config is group
+    # a single variant isn't numbered
+    assert [job.output_path.name for job in expand_jobs([CONFIG], tmp_path)] == ["config0.ly"]
+
+
+def test_expand_jobs_drops_repeated_configs(tmp_path):
+    _write_configs(tmp_path, ["bar_config"])
+    jobs = expand_jobs([tmp_path / "bar_config.json", str(tmp_path / "*.json"),
+                        tmp_path / "." / "bar_config.json"], tmp_path / "out", {"merge_tempo_skips": [False, True]})
+    assert [job.output_path.name for job in jobs] == ["bar_config.0.ly", "bar_config.1.ly"]
+
+
+def test_expand_jobs_errors(tmp_path):
+    with pytest.raises(ValueError):
+        expand_jobs([tmp_path / "*.json"], tmp_path)
+    with pytest.raises(ValueError):
+        expand_jobs([CONFIG], tmp_path, {"page_size": [(17, 11)]})
+    with pytest.raises(ValueError):
+        BatchJob(CONFIG, tmp_path / "out.ly", tempo=60)
+
+
+def test_run_batch(tmp_path, stub_lilypond):
+    _write_configs(tmp_path, ["good"])
+    (tmp_path / "bad.json").write_text(json.dumps({"bar_lengths": "oops", "tempo": 60}))
+    group = MetricGroup.parse_json(CONFIG)
+    jobs = expand_jobs([tmp_path / "good.json", tmp_path / "bad.json", CONFIG, group], tmp_path / "out",
+                       {"merge_tempo_skips": [False, True]})
+    results = list(run_batch(jobs, max_workers=2))
+    assert sorted(result.job.output_path.name for result in results) == sorted(job.output_path.name for job in jobs)
+    for result in results:
+        if result.job.output_path.name.startswith("bad"):
+            # a config that fails to load fails all of its jobs, with the reason
+            assert not result.ok and "bar_lengths" in result.error
+            assert not result.job.output_path.exists()
+        else:
+            assert result.ok, result.error
+            assert result.job.output_path.read_text() == _expected_text(CONFIG, **result.job.params)
+    assert json.loads(json.dumps(results[0].to_json_dict())).keys() == {
+        "config", "output", "params", "ok", "seconds", "error"}
+
+
+def test_main(tmp_path, stub_lilypond, capsys):
+    _write_configs(tmp_path, ["first", "second"])
+    assert main([str(tmp_path / "*.json"), "-o", str(tmp_path / "out"), "--proportional-duration", "1/20", "1/16",
+                 "--page-size", "17x11", "-j", "2"]) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(line["output"] for line in lines) == sorted(
+        str(tmp_path / "out" / f"{name}.{j}.ly") for name in ("first", "second") for j in range(2))
+    assert all(line["ok"] for line in lines)
+    assert (tmp_path / "out" / "first.1.ly").read_text() == _expected_text(CONFIG, proportional_duration=(1, 16))
+
+    (tmp_path / "broken.json").write_text("{")
+    assert main([str(tmp_path / "broken.json"), "-o", str(tmp_path / "out")]) == 1
+    assert [json.loads(line)["ok"] for line in capsys.readouterr().out.splitlines()] == [False]
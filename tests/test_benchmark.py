@@ -0,0 +1,12 @@
+import json
+from composing_time.benchmark import main, STAGES, COMPLEXITIES
+
+
+def test_benchmark_smoke(stub_lilypond, tmp_path):
+    results_path = tmp_path / "results.json"
+    assert main(["run", "--sizes", "10", "--max-repeats", "1", "--min-time", "0", "-o", str(results_path)]) == 0
+    results = json.loads(results_path.read_text())["results"]
+    assert len(results) == len(STAGES) * len(COMPLEXITIES)
+    assert all(result["bars"] == 10 and len(result["times"]) == 1 for result in results)
+    # a run compared with itself has no regressions
+    assert main(["compare", str(results_path), str(results_path)]) == 0
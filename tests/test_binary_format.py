@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from composing_time.benchmark import make_synthetic_config
+from composing_time.binary_format import save_binary, load_binary
+from composing_time.compact import CompactMetricGroup
+from composing_time.metric_group import MetricGroup
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, mmap):
+    metric_group = MetricGroup.parse_json({"subgroups": [make_synthetic_config(40, "envelope", 1),
+                                                         make_synthetic_config(20, "ramp", 2)]})
+    path = save_binary(metric_group, tmp_path / "piece.bin")
+    loaded = load_binary(path, mmap=mmap)
+    assert loaded.to_json_dict() == metric_group.to_json_dict()
+    compact = CompactMetricGroup.from_metric_group(metric_group)
+    for name in CompactMetricGroup._ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(compact, name))
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{}")
+    with pytest.raises(ValueError, match="not a binary metric group file"):
+        load_binary(path)
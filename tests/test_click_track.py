@@ -0,0 +1,52 @@
+import wave
+import numpy as np
+from clockblocks import TempoEnvelope
+from composing_time.click_track import (get_beat_groups, get_bar_click_pattern, iter_clicks, write_click_track,
+                                        DOWNBEAT, BEAT, SUBDIVISION)
+from composing_time.metric_group import SimpleMetricGroup
+
+
+def test_beat_groups():
+    assert get_beat_groups(3) == [3]
+    assert get_beat_groups(6) == [3, 3]
+    assert get_beat_groups(7) == [2, 2, 3]
+    assert get_beat_groups(4) == [2, 2]
+
+
+def test_bar_click_pattern():
+    # 7/8: 2+2+3 eighths
+    offsets, levels = get_bar_click_pattern(14)
+    assert offsets.tolist() == [0, 2, 4, 6, 8, 10, 12]
+    assert levels.tolist() == [DOWNBEAT, SUBDIVISION, BEAT, SUBDIVISION, BEAT, SUBDIVISION, SUBDIVISION]
+    offsets, levels = get_bar_click_pattern(14, subdivide=False)
+    assert offsets.tolist() == [0, 4, 8]
+
+
+def test_downbeats_fall_on_the_bar_lines():
+    metric_group = SimpleMetricGroup([8, 7, 12, 6] * 10, TempoEnvelope(levels=[240, 480], durations=[330]))
+    clicks = list(iter_clicks(metric_group, bars_per_batch=3))
+    times = np.concatenate([times for times, _ in clicks])
+    levels = np.concatenate([levels for _, levels in clicks])
+    assert np.all(np.diff(times) > 0)
+    np.testing.assert_allclose(times[levels == DOWNBEAT], metric_group.get_metric_index().bar_start_times)
+
+
+def test_click_track_file(tmp_path):
+    metric_group = SimpleMetricGroup([8, 8], TempoEnvelope(240))
+    sample_rate = 8000
+    path = write_click_track(metric_group, tmp_path / "click.wav", sample_rate=sample_rate, block_size=1000)
+    with wave.open(str(path), "rb") as wav_file:
+        assert (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()) == (1, 2, sample_rate)
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+    # four seconds of bars (16 16ths at four a second), plus the ringing of the last click
+    assert len(samples) == 4 * sample_rate + int(0.03 * sample_rate)
+    # a click rings for 30 ms from every eighth note (every half second), with silence in between
+    click_length = int(0.03 * sample_rate)
+    peaks = [np.abs(samples[onset:onset + click_length]).max() for onset in range(0, 4 * sample_rate, sample_rate // 2)]
+    assert min(peaks) > 1000
+    # downbeats are loudest
+    assert peaks[0] == peaks[4] == max(peaks) and peaks[1] < peaks[0]
+    silence = np.ones(len(samples), dtype=bool)
+    for onset in range(0, 4 * sample_rate, sample_rate // 2):
+        silence[onset:onset + click_length] = False
+    assert not samples[silence].any()
@@ -0,0 +1,51 @@
+import json
+import numpy as np
+import pytest
+from composing_time.benchmark import make_synthetic_config
+from composing_time.compact import CompactMetricGroup
+from composing_time.json_loader import MetricGroupJSONError
+from composing_time.metric_group import MetricGroup
+
+
+def _config():
+    return {"subgroups": [make_synthetic_config(30, complexity, seed)
+                          for seed, complexity in enumerate(("constant", "ramp", "envelope"))]}
+
+
+def test_load_from_json_matches_flattened_tree(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(_config()))
+    loaded = CompactMetricGroup.load_from_json(path)
+    flattened = CompactMetricGroup.from_metric_group(MetricGroup.load_from_json(path))
+    for name in CompactMetricGroup._ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(flattened, name))
+
+
+def test_load_from_json_rejects_empty_subgroups(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text('{"subgroups": [{"subgroups": []}, {"bar_lengths": [4], "tempo": 60}]}')
+    with pytest.raises(MetricGroupJSONError, match=r"\$\.subgroups\[0\]\.subgroups"):
+        CompactMetricGroup.load_from_json(path)
+
+
+def test_round_trip_through_tree():
+    metric_group = MetricGroup.parse_json(_config())
+    compact = CompactMetricGroup.from_metric_group(metric_group)
+    assert compact.to_json_dict() == metric_group.to_json_dict()
+    assert compact.to_metric_group().to_json_dict() == metric_group.to_json_dict()
+    assert compact.get_bar_line_locations() == metric_group.get_bar_line_locations()
+    np.testing.assert_allclose(compact.get_metric_index().bar_line_times,
+                               metric_group.get_metric_index().bar_line_times, rtol=1e-12)
+
+
+def test_parse_json_matches_flattened_tree():
+    parsed = CompactMetricGroup.parse_json(_config())
+    flattened = CompactMetricGroup.from_metric_group(MetricGroup.parse_json(_config()))
+    for name in CompactMetricGroup._ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(parsed, name), getattr(flattened, name))
+
+
+def test_json_file_round_trip(tmp_path):
+    compact = CompactMetricGroup.parse_json(_config())
+    compact.save_to_json(tmp_path / "config.json")
+    assert CompactMetricGroup.load_from_json(tmp_path / "config.json").to_json_dict() == compact.to_json_dict()
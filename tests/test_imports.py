@@ -0,0 +1,23 @@
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+PACKAGE_ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_core_timing_model_does_not_import_abjad_or_scamp():
+    # run in a fresh interpreter, since other tests may already have imported abjad into this one
+    code = textwrap.dedent("""
+        import sys
+        from composing_time.metric_group import MetricGroup
+        group = MetricGroup.parse_json({"subgroups": [
+            {"bar_lengths": [4, 6], "tempo": 60},
+            {"bar_lengths": [5], "tempo": 60, "end_tempo": 90},
+        ]})
+        group.get_metric_index().bars_at_times([0.5, 3.0])
+        assert "abjad" not in sys.modules, "abjad was imported"
+        assert "scamp" not in sys.modules, "scamp was imported"
+    """)
+    result = subprocess.run([sys.executable, "-c", code], cwd=PACKAGE_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
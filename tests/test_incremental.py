@@ -0,0 +1,84 @@
+import io
+import json
+import re
+import pytest
+from composing_time.incremental import IncrementalExporter, watch
+from composing_time.json_loader import MetricGroupJSONError
+from composing_time.metric_group import MetricGroup
+
+
+def _config(num_groups):
+    return {"subgroups": [{"bar_lengths": [4, 3 + i % 3], "tempo": 60 + i} for i in range(num_groups)]}
+
+
+def _write_lilypond_file(config, **kwargs):
+    out = io.StringIO()
+    MetricGroup.parse_json(config).write_lilypond_file(out, **kwargs)
+    return out.getvalue()
+
+
+def _edits():
+    # (tempos whose 16ths last an exact binary fraction of a second, so that the bars' spacings come out the same
+    # to the last digit whichever envelope they are integrated over)
+    yield {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 60}, {"bar_lengths": [5, 6], "tempo": 120},
+                         {"subgroups": [{"bar_lengths": [2, 9], "tempo": 30}, {"bar_lengths": [8], "tempo": 60}]}]}
+    yield {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 60}, {"bar_lengths": [5, 6, 11], "tempo": 120},
+                         {"subgroups": [{"bar_lengths": [2, 9], "tempo": 30}, {"bar_lengths": [8], "tempo": 60}]}]}
+    yield {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 60}, {"bar_lengths": [5, 6, 11], "tempo": 120},
+                         {"subgroups": [{"bar_lengths": [2, 9], "tempo": 240}, {"bar_lengths": [8], "tempo": 60}]}]}
+    yield {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 60},
+                         {"subgroups": [{"bar_lengths": [2, 9], "tempo": 240}, {"bar_lengths": [8], "tempo": 60}]}]}
+
+
+@pytest.mark.parametrize("merge_tempo_skips", [False, True])
+def test_edited_export_matches_fresh_write(stub_lilypond, merge_tempo_skips):
+    exporter = IncrementalExporter(merge_tempo_skips=merge_tempo_skips)
+    for config in _edits():
+        assert exporter.export(config) == _write_lilypond_file(config, merge_tempo_skips=merge_tempo_skips)
+
+
+def test_edited_export_with_tempo_curves_matches_fresh_write(stub_lilypond):
+    # spacings can differ in their last digits here (see incremental.py), but nothing else
+    number = re.compile(r"\d+\.\d+")
+    exporter = IncrementalExporter()
+    config = {"subgroups": [{"bar_lengths": [4, 3, 7], "tempo": 72, "end_tempo": 90},
+                            {"bar_lengths": [5, 6], "tempo": 90.5, "end_tempo": 61, "tempo_curvature": 2}]}
+    exporter.export(config)
+    config["subgroups"][0]["bar_lengths"].append(6)
+    text, expected = exporter.export(config), _write_lilypond_file(config)
+    assert number.sub("#", text) == number.sub("#", expected)
+    assert [float(x) for x in number.findall(text)] == pytest.approx([float(x) for x in number.findall(expected)],
+                                                                     rel=1e-12)
+
+
+def test_bars_must_be_whole_16ths(stub_lilypond):
+    exporter = IncrementalExporter()
+    config = {"subgroups": [{"bar_lengths": [4, 3.5], "tempo": 60}, {"bar_lengths": [5], "tempo": 90}]}
+    with pytest.raises(MetricGroupJSONError, match=r"\$\.subgroups\[0\]\.bar_lengths"):
+        exporter.export(config)
+    config["subgroups"][0]["bar_lengths"] = [4.0, 3.0]
+    assert exporter.export(config) == exporter.export({"subgroups": [{"bar_lengths": [4, 3], "tempo": 60},
+                                                                     {"bar_lengths": [5], "tempo": 90}]})
+
+
+def test_failed_export_keeps_previous_parts(stub_lilypond):
+    exporter = IncrementalExporter()
+    config = _config(40)
+    exporter.export(config)
+    invalid = json.loads(json.dumps(config))
+    invalid["subgroups"][20]["bar_lengths"] = "oops"
+    with pytest.raises(MetricGroupJSONError):
+        exporter.export(invalid)
+    config["subgroups"][30]["bar_lengths"].append(2)
+    exporter.export(config)
+    assert exporter.stats["groups_rebuilt"] == 1
+
+
+def test_watch_survives_unwritable_output(stub_lilypond, tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(_config(2)))
+    logged = []
+    checks = iter(range(2))
+    watch(config_path, tmp_path / "missing" / "out.ly", poll_interval=0, log=logged.append,
+          should_stop=lambda: next(checks, None) is None)
+    assert len(logged) == 1 and "not exported" in logged[0]
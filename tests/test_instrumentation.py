@@ -0,0 +1,94 @@
+import contextvars
+import io
+import json
+import threading
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.instrumentation import instrument, span, count, is_enabled
+from composing_time.metric_group import MetricGroup, SimpleMetricGroup, CompositeMetricGroup
+
+
+def test_recorder_is_not_shared_with_other_threads():
+    started, stop = threading.Event(), threading.Event()
+    seen = []
+
+    def other_thread():
+        started.set()
+        stop.wait()
+        seen.append(is_enabled())
+        count("other")
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    started.wait()
+    with instrument() as recorder:
+        stop.set()
+        thread.join()
+        count("mine")
+    assert seen == [False]
+    assert recorder.counters == {"mine": 1}
+
+
+def test_spans_from_several_threads():
+    def work():
+        for _ in range(1000):
+            with span("work"):
+                count("calls")
+
+    with instrument() as recorder:
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(work,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert not is_enabled()
+    assert recorder.summary()["spans"]["work"]["calls"] == 4000
+    assert recorder.counters["calls"] == 4000
+
+
+def _write_config(tmp_path):
+    config_path = tmp_path / "bar_config.json"
+    CompositeMetricGroup([SimpleMetricGroup([4, 6, 5], TempoEnvelope(60)),
+                          SimpleMetricGroup([7, 3], TempoEnvelope([60, 90], [10]))]).save_to_json(config_path)
+    return config_path
+
+
+def test_pipeline_spans_and_counters(tmp_path, stub_lilypond):
+    pytest.importorskip("abjad")
+    from composing_time.abjad_utils import format_lilypond_file
+    config_path = _write_config(tmp_path)
+    with instrument() as recorder:
+        metric_group = MetricGroup.load_from_json(config_path)
+        text = format_lilypond_file(metric_group.to_lilypond_file())
+        out = io.StringIO()
+        metric_group.write_lilypond_file(out)
+    spans = recorder.summary()["spans"]
+    for name in ("load_json", "concatenate_envelopes", "bar_timing", "build_tempo_voice", "create_blank_score",
+                 "abjad_lilypond", "write_lilypond"):
+        assert spans[name]["calls"] >= 1, name
+    counters = recorder.counters
+    # both the abjad score and the streamed file process every bar
+    assert counters["bars_processed"] == 2 * 5
+    assert counters["bytes_written"] == len(text) + len(out.getvalue())
+    assert counters["annotations_emitted"] > 0 and counters["skips_created"] > 0
+
+
+def test_write_trace_events(tmp_path):
+    with instrument() as recorder:
+        with span("outer", label="x"):
+            with span("inner"):
+                count("things", 3)
+    trace_path = recorder.write_trace_events(tmp_path / "export.trace.json")
+    with open(trace_path) as f:
+        trace = json.load(f)
+    events = trace["traceEvents"]
+    complete = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert complete.keys() == {"outer", "inner"}
+    assert complete["outer"]["args"] == {"label": "x"}
+    for event in complete.values():
+        assert event["dur"] >= 0 and event["ts"] >= 0
+    outer, inner = complete["outer"], complete["inner"]
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    counters = [event for event in events if event["ph"] == "C"]
+    assert [(event["name"], event["args"]) for event in counters] == [("things", {"things": 3})]
+    assert [event["ts"] for event in events] == sorted(event["ts"] for event in events)
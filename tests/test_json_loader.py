@@ -0,0 +1,88 @@
+import io
+import json
+import pytest
+from composing_time.benchmark import make_synthetic_config
+from composing_time.compact import CompactMetricGroup
+from composing_time.json_loader import MetricGroupJSONError, dump_metric_group_json, load_metric_group_json
+from composing_time.metric_group import MetricGroup
+
+DEPTH = 600
+
+
+def _deep_config_text(depth: int = DEPTH) -> str:
+    # built as text, since the json module can't encode (or compare) dictionaries nested this deeply
+    text = json.dumps({"bar_lengths": [4, 3], "tempo": 60})
+    for i in range(depth):
+        text = '{"subgroups": [' + text + ", " + json.dumps({"bar_lengths": [2], "tempo": 90 + i % 5}) + "]}"
+    return text
+
+
+def test_deeply_nested_config_can_be_used(tmp_path):
+    group = load_metric_group_json(io.StringIO(_deep_config_text()))
+    bar_lengths = group.get_bar_lengths()
+    assert bar_lengths == [4, 3] + [2] * DEPTH
+    assert group.get_tempo_envelope().end_time() == sum(bar_lengths)
+    group.to_json_dict()
+    group.groups[0].groups[0].invalidate()
+    assert group._bar_lengths is None
+
+    compact = CompactMetricGroup.from_metric_group(group)
+    assert compact.get_bar_lengths() == bar_lengths
+    assert compact.to_metric_group().get_bar_lengths() == bar_lengths
+    assert list(compact.get_tempo_envelope().durations) == list(group.get_tempo_envelope().durations)
+
+    group.save_to_json(tmp_path / "deep.json")
+    assert MetricGroup.load_from_json(tmp_path / "deep.json").get_bar_lengths() == bar_lengths
+
+
+def test_dump_matches_json_dump():
+    group = MetricGroup.parse_json(make_synthetic_config(200, "envelope", 3))
+    file = io.StringIO()
+    dump_metric_group_json(group, file)
+    assert file.getvalue() == json.dumps(group.to_json_dict(), indent=2)
+
+
+def test_identical_groups_dont_share_editable_envelopes():
+    group = {"bar_lengths": [4, 4], "tempo": 60, "end_tempo": 90}
+    composite = MetricGroup.parse_json({"subgroups": [group, dict(group)]})
+    first, second = composite.groups
+    assert first.get_tempo_envelope() is second.get_tempo_envelope()
+    composite.get_tempo_envelope()
+    first.tempo_envelope.scale_vertical(0.5)
+    first.invalidate()
+    assert first.get_tempo_envelope().levels[0] == 0.5
+    assert second.get_tempo_envelope().levels[0] == 1.0
+    assert second.to_json_dict() == group
+
+
+SIMPLE = '{"bar_lengths": [4], "tempo": 60}'
+INVALID_CONFIGS = [
+    ('{"subgroups": [' + SIMPLE + ', {"bar_lengths": [4, 0], "tempo": 60}]}', "$.subgroups[1].bar_lengths[1]"),
+    ('{"subgroups": [' + SIMPLE + ', {"bar_lengths": [4]}]}', "$.subgroups[1]"),
+    ('{"subgroups": [{"bar_lengths": [4], "tempo": 60, "meter": 3}]}', "$.subgroups[0].meter"),
+    ('{"subgroups": [{"subgroups": [' + SIMPLE + ']}, {"subgroups": []}]}', "$.subgroups[1].subgroups"),
+    ('{"subgroups": [' + SIMPLE + '], "tempo": 60}', "$.tempo"),
+    ('{"bar_lengths": [4], "tempo_envelope": {"levels": [60, 90], "durations": [1, 2]}}',
+     "$.tempo_envelope.durations"),
+    ('{"subgroups": [' + SIMPLE + ', 5]}', "$.subgroups[1]"),
+]
+
+
+@pytest.mark.parametrize("text, path", INVALID_CONFIGS)
+def test_errors_give_the_path(tmp_path, text, path):
+    with pytest.raises(MetricGroupJSONError) as streamed:
+        load_metric_group_json(io.StringIO(text), chunk_size=7)
+    assert streamed.value.path == path
+    with pytest.raises(MetricGroupJSONError) as parsed:
+        MetricGroup.parse_json(json.loads(text))
+    assert parsed.value.path == path
+    (tmp_path / "config.json").write_text(text)
+    with pytest.raises(MetricGroupJSONError) as compact:
+        CompactMetricGroup.load_from_json(tmp_path / "config.json")
+    assert compact.value.path == path
+
+
+@pytest.mark.parametrize("text", ['{"subgroups": [' + SIMPLE + ',]}', SIMPLE + " {}", '{"subgroups": [' + SIMPLE])
+def test_malformed_json(text):
+    with pytest.raises(MetricGroupJSONError):
+        load_metric_group_json(io.StringIO(text), chunk_size=7)
@@ -0,0 +1,99 @@
+import io
+import random
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.lilypond_text import (iter_blank_lilypond_file, write_blank_lilypond_file,
+                                          get_tempo_annotation_key_points, get_tempo_annotation_plan,
+                                          get_tempo_skip_layout, _get_cached_plan)
+from composing_time.metric_group import SimpleMetricGroup, CompositeMetricGroup
+from composing_time.timing import TICKS_PER_16TH, TICKS_PER_QUARTER
+
+
+def _random_metric_group(rng: random.Random):
+    groups = []
+    for _ in range(rng.randint(1, 5)):
+        bar_lengths = [rng.randint(1, 16) for _ in range(rng.randint(1, 8))]
+        kind = rng.random()
+        if kind < 0.3:
+            tempo_envelope = TempoEnvelope(rng.choice([40, 60, 72.5, 90]))
+        elif kind < 0.6:
+            tempo_envelope = TempoEnvelope([rng.uniform(40, 150), rng.uniform(40, 150)], [sum(bar_lengths)],
+                                           [rng.choice([0, 2, -3])])
+        else:
+            num_segments = rng.randint(1, 4)
+            tempo_envelope = TempoEnvelope([rng.choice([60, 60, 80, rng.uniform(40, 150)])
+                                            for _ in range(num_segments + 1)],
+                                           [rng.choice([0.5, 1, 3, sum(bar_lengths) / num_segments])
+                                            for _ in range(num_segments)])
+        groups.append(SimpleMetricGroup(bar_lengths, tempo_envelope))
+    return CompositeMetricGroup(groups) if len(groups) > 1 else groups[0]
+
+
+@pytest.mark.parametrize("merge_tempo_skips", [False, True])
+@pytest.mark.parametrize("seed", range(3))
+def test_text_backend_matches_abjad(stub_lilypond, seed, merge_tempo_skips):
+    abjad = pytest.importorskip("abjad")
+    from composing_time.abjad_utils import create_blank_score, create_blank_lilypond_file
+    rng = random.Random(seed)
+    for _ in range(10):
+        metric_group = _random_metric_group(rng)
+        bar_lengths, tempo_envelope = metric_group.get_bar_lengths(), metric_group.get_tempo_envelope()
+        expected = abjad.lilypond(create_blank_lilypond_file(
+            create_blank_score(bar_lengths, None, tempo_envelope, merge_tempo_skips=merge_tempo_skips)))
+        assert "\n".join(iter_blank_lilypond_file(bar_lengths, None, tempo_envelope,
+                                                  merge_tempo_skips=merge_tempo_skips)) == expected
+        file = io.StringIO()
+        write_blank_lilypond_file(file, bar_lengths, None, tempo_envelope, merge_tempo_skips=merge_tempo_skips)
+        assert file.getvalue() == expected
+
+
+def test_key_points_are_whole_ticks():
+    tempo_envelope = TempoEnvelope([60, 90, 90, 120], [1.5, 0, 2.5])
+    assert get_tempo_annotation_key_points(tempo_envelope, TICKS_PER_16TH) == [
+        (0, 60), (360, 90), (360, 90), (960, 120)
+    ]
+    # segment boundaries are converted one by one from the cumulative beats, so rounding doesn't build up
+    key_points = get_tempo_annotation_key_points(TempoEnvelope([60] * 31, [0.1] * 30), TICKS_PER_QUARTER)
+    assert [tick for tick, _ in key_points[1::2]] == [96 * (i + 1) for i in range(30)]
+
+
+def test_skip_layout():
+    assert get_tempo_skip_layout([0, 240, 960]) == ([1] * 5, {0: 0, 240: 1, 960: 4})
+    assert get_tempo_skip_layout([0, 240, 960], merge_skips=True) == ([1, 3, 1], {0: 0, 240: 1, 960: 2})
+    # points off the 16th-note grid fall in the skip containing them
+    assert get_tempo_skip_layout([0, 300, 470, 720], merge_skips=True) == ([1, 2, 1], {0: 0, 300: 1, 470: 1,
+                                                                                     720: 2})
+    assert get_tempo_skip_layout([100, 1000], skip_ticks=TICKS_PER_QUARTER) == ([1, 1], {100: 0, 1000: 1})
+    assert get_tempo_skip_layout([]) == ([], {})
+
+
+def test_plan_layout_puts_annotations_on_their_skips():
+    # a constant tempo for a quarter note, then a ramp over two quarter notes (envelope in 16ths)
+    plan = get_tempo_annotation_plan(TempoEnvelope([60, 60, 90], [4, 8]), ticks_per_beat=TICKS_PER_16TH)
+    # the ramp ends in a parenthesized tempo, so its arrow stops a 16th (240 ticks) before the end
+    assert plan.time_points == (0, 960, 2880 - 240)
+    skip_lengths, point_to_skip = plan.get_skip_layout(merge_skips=True)
+    assert skip_lengths == [4, 7, 1]
+    assert point_to_skip == {0: 0, 960: 1, 2640: 2}
+    assert sorted(plan.get_attachments(merge_skips=True)) == [0, 1, 2]
+
+
+def test_repeated_envelope_reuses_cached_plan(stub_lilypond):
+    envelope = TempoEnvelope([60, 90, 90, 72], [8, 0, 12], [0, 0, 2])
+    plan = get_tempo_annotation_plan(envelope, ticks_per_beat=TICKS_PER_16TH)
+    hits = _get_cached_plan.cache_info().hits
+    # an equal envelope (not the same object) gets the same plan, whatever renders it
+    assert get_tempo_annotation_plan(TempoEnvelope([60, 90, 90, 72], [8, 0, 12], [0, 0, 2]),
+                                     ticks_per_beat=TICKS_PER_16TH) is plan
+    assert _get_cached_plan.cache_info().hits == hits + 1
+
+    metric_group = CompositeMetricGroup([SimpleMetricGroup([4, 4], TempoEnvelope([60, 90], [8])),
+                                         SimpleMetricGroup([5, 7], TempoEnvelope([90, 72], [12], [2]))])
+    out = io.StringIO()
+    metric_group.write_lilypond_file(out)
+    hits = _get_cached_plan.cache_info().hits
+    metric_group.invalidate()
+    again = io.StringIO()
+    metric_group.write_lilypond_file(again)
+    assert _get_cached_plan.cache_info().hits == hits + 1
+    assert again.getvalue() == out.getvalue()
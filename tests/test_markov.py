@@ -0,0 +1,94 @@
+from itertools import product
+import numpy as np
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.markov import MarkovMeasureGenerator
+from composing_time.timing import EnvelopeArrays
+
+TRANSITIONS = {4: [4, 6, 6], 6: [4, 7], 7: [7, 4]}
+
+
+def _brute_force(generator, total_sixteenths):
+    # every sequence of allowed transitions that adds up to the total
+    results = []
+    for length in range(1, total_sixteenths // min(generator.states) + 1):
+        for sequence in product(generator.states, repeat=length):
+            if sum(sequence) == total_sixteenths and all(np.isfinite(generator.log_probabilities([sequence]))):
+                results.append(list(sequence))
+    return results
+
+
+def test_generate_follows_the_transition_weights():
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=0)
+    sequences = generator.generate(20, num_sequences=2000, start=4)
+    assert sequences.shape == (2000, 20) and np.all(sequences[:, 0] == 4)
+    pairs = np.stack([sequences[:, :-1].ravel(), sequences[:, 1:].ravel()], axis=1)
+    for state, next_states in TRANSITIONS.items():
+        following = pairs[pairs[:, 0] == state, 1]
+        assert set(following) == set(next_states)
+        # repeated entries are proportionally more likely
+        for next_state in set(next_states):
+            expected = next_states.count(next_state) / len(next_states)
+            assert np.mean(following == next_state) == pytest.approx(expected, abs=0.02)
+
+
+def test_generate_is_reproducible():
+    first = MarkovMeasureGenerator(TRANSITIONS, seed=5).generate(10, num_sequences=4)
+    second = MarkovMeasureGenerator(TRANSITIONS, seed=5).generate(10, num_sequences=4)
+    np.testing.assert_array_equal(first, second)
+    assert MarkovMeasureGenerator(TRANSITIONS, seed=5).generate(0, num_sequences=3).shape == (3, 0)
+
+
+def test_log_probabilities():
+    generator = MarkovMeasureGenerator(TRANSITIONS, initial_weights={4: 1, 6: 3}, seed=0)
+    log_probabilities = generator.log_probabilities([[4, 6, 7, 7], [6, 6, 4, 4]])
+    assert log_probabilities[0] == pytest.approx(np.log(2 / 3 * 1 / 2 * 1 / 2))
+    # 6 can't follow 6
+    assert log_probabilities[1] == -np.inf
+    assert generator.log_probabilities([[6, 4]], include_start=True)[0] == pytest.approx(np.log(3 / 4 * 1 / 2))
+
+
+def test_invalid_transitions():
+    with pytest.raises(ValueError):
+        MarkovMeasureGenerator({4: [5]})
+    with pytest.raises(ValueError):
+        MarkovMeasureGenerator({4: [4], 0: [4]})
+    with pytest.raises(ValueError):
+        MarkovMeasureGenerator({4: {4: 0}})
+
+
+@pytest.mark.parametrize("total_sixteenths", [4, 13, 21, 25])
+def test_enumerate_exact_finds_every_sequence(total_sixteenths):
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=0)
+    assert sorted(generator.enumerate_exact(total_sixteenths)) == sorted(_brute_force(generator, total_sixteenths))
+
+
+def test_sample_exact_hits_the_total():
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=1)
+    sequences = generator.sample_exact(60, num_sequences=200, start=6)
+    assert all(sequence.sum() == 60 and sequence[0] == 6 for sequence in sequences)
+    assert all(np.isfinite(generator.log_probabilities([sequence])[0]) for sequence in sequences)
+
+
+def test_sample_exact_never_takes_a_dead_end():
+    # 6+6 would also add up to 12, but 6 can't follow 6, so 4+4+4 is the only way
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=2)
+    assert {tuple(sequence) for sequence in generator.sample_exact(12, num_sequences=50)} == {(4, 4, 4)}
+
+
+def test_impossible_totals():
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=0)
+    assert not generator.can_fill_exactly(5)
+    assert not generator.can_fill_exactly(7, start=4)
+    with pytest.raises(ValueError):
+        generator.sample_exact(5)
+    assert list(generator.enumerate_exact(5)) == []
+
+
+def test_sample_exact_duration():
+    generator = MarkovMeasureGenerator(TRANSITIONS, seed=3)
+    tempo_envelope = TempoEnvelope(levels=[60, 120], durations=[30])
+    envelope_arrays = EnvelopeArrays.from_envelope(tempo_envelope)
+    for sequence in generator.sample_exact_duration(20, tempo_envelope, tolerance=0.25, num_sequences=20):
+        duration = envelope_arrays.times_at_beats([sequence.sum() / 4])[0]
+        assert abs(duration - 20) <= 0.25
@@ -0,0 +1,27 @@
+from clockblocks import TempoEnvelope
+from composing_time.metric_group import SimpleMetricGroup, CompositeMetricGroup
+
+
+def _make_composite():
+    first = SimpleMetricGroup([4, 4], TempoEnvelope(60))
+    second = SimpleMetricGroup([3, 5], TempoEnvelope(levels=[60, 120], durations=[8]))
+    return first, second, CompositeMetricGroup([first, second])
+
+
+def test_invalidate_after_in_place_edit_refits_envelope():
+    first, second, composite = _make_composite()
+    composite.get_tempo_envelope()
+    first.bar_lengths.append(7)
+    first.invalidate()
+    assert first.tempo_envelope.end_time() == 15
+    assert composite.get_bar_line_locations() == [0, 4, 8, 15, 18, 23]
+    # the second group's tempo still starts where its bars do
+    assert list(composite.get_tempo_envelope().durations) == [15, 8]
+
+
+def test_bar_lengths_setter_refits_envelope():
+    first, _, composite = _make_composite()
+    composite.get_tempo_envelope()
+    first.bar_lengths = [2]
+    assert first.tempo_envelope.end_time() == 2
+    assert list(composite.get_tempo_envelope().durations) == [2, 8]
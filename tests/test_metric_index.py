@@ -0,0 +1,71 @@
+import random
+import numpy as np
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.metric_index import MetricIndex
+from composing_time.timing import EnvelopeArrays, get_bar_times
+
+
+def _random_bars(rng: random.Random) -> tuple[list[int], TempoEnvelope]:
+    bar_lengths = [rng.randint(1, 12) for _ in range(rng.randint(1, 20))]
+    bar_line_locations = np.concatenate(([0], np.cumsum(bar_lengths))).tolist()
+    # a ramp, a jump and a curve, spread over the bars
+    end = bar_line_locations[-1]
+    envelope = TempoEnvelope([rng.uniform(40, 160) for _ in range(5)],
+                             [end / 3, 0, end / 3, end - 2 * (end / 3)], [0, 0, rng.uniform(-3, 3), 0])
+    return bar_line_locations, envelope
+
+
+def _scan_bar_at_time(bar_line_times: list[float], time: float) -> int:
+    # the last bar that has started by the given time (the first bar before 0, the last one past the end)
+    bar = 0
+    for i, start_time in enumerate(bar_line_times[:-1]):
+        if start_time <= time:
+            bar = i
+    return bar
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_lookups_match_brute_force_scan(seed):
+    rng = random.Random(seed)
+    bar_line_locations, envelope = _random_bars(rng)
+    index = MetricIndex(bar_line_locations, EnvelopeArrays.from_envelope(envelope))
+    start_times, durations = get_bar_times(bar_line_locations, envelope)
+    bar_line_times = start_times.tolist() + [start_times[-1] + durations[-1]]
+
+    # exactly on each bar line, before 0, inside bars and past the end
+    times = bar_line_times + [-1.0, bar_line_times[-1] + 3] + [rng.uniform(0, bar_line_times[-1])
+                                                               for _ in range(30)]
+    bars, beats_in_bars = index.bars_at_times(times)
+    for time, vector_bar, vector_beat_in_bar in zip(times, bars, beats_in_bars):
+        bar, beat_in_bar = index.bar_at_time(time)
+        assert bar == vector_bar == _scan_bar_at_time(bar_line_times, time)
+        assert beat_in_bar == pytest.approx(vector_beat_in_bar, abs=1e-9)
+        if time >= 0:
+            assert beat_in_bar == pytest.approx(envelope.beat_at_time(time) - bar_line_locations[bar], abs=1e-7)
+
+    for bar in range(index.num_bars):
+        assert index.time_at_bar(bar) == pytest.approx(bar_line_times[bar], abs=1e-9)
+        # a time exactly on a bar line is in the bar that starts there
+        assert index.bar_at_time(index.time_at_bar(bar)) == (bar, pytest.approx(0, abs=1e-9))
+        beat_in_bar = rng.uniform(0, bar_line_locations[bar + 1] - bar_line_locations[bar])
+        assert index.time_at_bar(bar, beat_in_bar) == pytest.approx(
+            envelope.time_at_beat(bar_line_locations[bar] + beat_in_bar), abs=1e-9)
+    np.testing.assert_allclose(index.times_at_bars(range(index.num_bars)), bar_line_times[:-1], atol=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_tempo_at_beat_matches_envelope(seed):
+    rng = random.Random(seed)
+    bar_line_locations, envelope = _random_bars(rng)
+    index = MetricIndex(bar_line_locations, EnvelopeArrays.from_envelope(envelope))
+    beats = [rng.uniform(0, bar_line_locations[-1]) for _ in range(30)] + [bar_line_locations[-1] + 5]
+    tempos = [index.tempo_at_beat(beat) for beat in beats]
+    np.testing.assert_allclose(tempos, [60 / envelope.value_at(beat) for beat in beats], rtol=1e-9)
+    np.testing.assert_allclose(index.tempos_at_beats(beats), tempos, rtol=1e-12)
+
+
+def test_tempo_after_jump():
+    index = MetricIndex([0, 4, 8], EnvelopeArrays.from_envelope(TempoEnvelope([60, 60, 120], [4, 0])))
+    assert index.tempo_at_beat(4) == 120
+    assert index.tempo_at_bar(0, 2) == 60
@@ -0,0 +1,66 @@
+import math
+import re
+from fractions import Fraction
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.lilypond_text import format_timestamp, measure_dur_to_time_sig
+from composing_time.metric_group import SimpleMetricGroup
+from composing_time.polymetric import PolymetricLayers
+
+
+def _layers(first_bar_seconds):
+    # layers whose second downbeat falls after the given number of seconds (tempos are in 16ths per minute)
+    return PolymetricLayers([SimpleMetricGroup([40, 4], TempoEnvelope(60 * 40 / seconds))
+                             for seconds in first_bar_seconds])
+
+
+def test_near_coincidences_are_all_reported():
+    layers = _layers([10.0, 10.04, 10.08])
+    later = [(round(c.time, 2), c.bars) for c in layers.iter_coincidences(0.05) if c.time > 0]
+    assert later == [(10.0, {0: 1, 1: 1}), (10.04, {1: 1, 2: 1})]
+    assert [c.bars for c in layers.iter_coincidences(0.1) if c.time > 0] == [{0: 1, 1: 1, 2: 1}]
+
+
+def test_min_layers():
+    layers = _layers([10.0, 10.0, 12.0])
+    assert [c.layers for c in layers.iter_coincidences(0.05, min_layers=3)] == [[0, 1, 2]]
+    assert [c.layers for c in layers.iter_coincidences(0.05)] == [[0, 1, 2], [0, 1]]
+
+
+def test_polymetric_score(stub_lilypond):
+    abjad = pytest.importorskip("abjad")
+    layers = PolymetricLayers([SimpleMetricGroup([8, 6], TempoEnvelope(120)),
+                               SimpleMetricGroup([7, 5, 3], TempoEnvelope([60, 90], [15]))], names=["Strings", "Winds"])
+    lilypond_file = layers.to_lilypond_file(timestamp_interval=2)
+    score = next(item for item in lilypond_file.items if isinstance(item, abjad.Score))
+    assert [staff.name for staff in score] == ["LayerStaff1", "LayerStaff2", "TimestampStaff"]
+
+    layer_ends = []
+    for staff, name, metric_group, bar_start_times in zip(score, layers.names, layers.metric_groups,
+                                                          layers.get_bar_start_times()):
+        text = abjad.lilypond(staff)
+        assert re.findall(r'instrumentName = "(.*)"', text) == [name]
+        # each bar has its own time signature, but lasts as many quarter notes as seconds
+        bar_lengths = metric_group.get_bar_lengths()
+        time_signatures = [measure_dur_to_time_sig(length) for length in bar_lengths]
+        assert re.findall(r"\\time (\d+)/(\d+)", text) == [(str(n), str(d)) for n, d in time_signatures]
+        skips = abjad.select.leaves(staff)
+        assert len(skips) == len(bar_lengths)
+        bar_line_times = metric_group.get_metric_index().bar_line_times
+        for skip, start, end in zip(skips, bar_line_times[:-1], bar_line_times[1:]):
+            seconds = Fraction(round((end - start) * 1000), 1000)
+            assert abjad.get.timespan(skip).start_offset == pytest.approx(start / 4, abs=1e-3)
+            assert abjad.get.duration(skip) == seconds / 4
+            measure_length = seconds / 4
+            assert (rf"\set Timing.measureLength = #(ly:make-moment "
+                    rf"{measure_length.numerator}/{measure_length.denominator})") in abjad.lilypond(skip)
+            assert rf"s4 * {seconds.numerator}/{seconds.denominator}" in abjad.lilypond(skip)
+        layer_ends.append(abjad.get.duration(staff))
+
+    # the timestamps run to the end of the longest layer, every two seconds
+    timestamps = abjad.select.leaves(score["TimestampStaff"])
+    assert abjad.get.duration(score["TimestampStaff"]) == max(layer_ends)
+    assert [abjad.get.timespan(skip).start_offset for skip in timestamps] == [
+        Fraction(time, 4) for time in range(0, math.ceil(4 * max(layer_ends)), 2)]
+    assert [abjad.get.indicator(skip, abjad.Markup).string for skip in timestamps] == [
+        f'"{format_timestamp(time)}"' for time in range(0, math.ceil(4 * max(layer_ends)), 2)]
@@ -0,0 +1,54 @@
+import stat
+from clockblocks import TempoEnvelope
+from composing_time.metric_group import SimpleMetricGroup, CompositeMetricGroup
+from composing_time.rendering import split_into_chunks, render_chunks
+
+
+def _stub_lilypond_command(tmp_path):
+    # stands in for `lilypond --pdf -o BASE FILE.ly`: writes BASE.pdf and logs the file it engraved
+    log_path = tmp_path / "engraved.log"
+    command = tmp_path / "fake-lilypond"
+    command.write_text(f'#!/bin/sh\necho "$4" >> "{log_path}"\necho "%PDF-1.4" > "$3.pdf"\n')
+    command.chmod(command.stat().st_mode | stat.S_IEXEC)
+    return str(command), log_path
+
+
+def _num_engraved(log_path):
+    return len(log_path.read_text().splitlines()) if log_path.exists() else 0
+
+
+def _metric_group(middle_bars):
+    return CompositeMetricGroup([
+        SimpleMetricGroup([4, 4], TempoEnvelope(240)),
+        SimpleMetricGroup(middle_bars, TempoEnvelope(levels=[240, 480], durations=[8])),
+        SimpleMetricGroup([3, 3, 2], TempoEnvelope(360)),
+    ])
+
+
+def test_only_changed_chunks_are_engraved(stub_lilypond, tmp_path):
+    command, log_path = _stub_lilypond_command(tmp_path)
+    cache_dir = tmp_path / "cache"
+    chunks = split_into_chunks(_metric_group([4, 4]))
+    assert [chunk.first_bar for chunk in chunks] == [0, 2, 4]
+    pdf_paths = render_chunks(chunks, cache_dir, max_workers=2, lilypond_command=command)
+    assert _num_engraved(log_path) == 3
+    assert all(path.parent == cache_dir and path.exists() for path in pdf_paths)
+
+    # everything comes from the cache the second time
+    assert render_chunks(chunks, cache_dir, max_workers=2, lilypond_command=command) == pdf_paths
+    assert _num_engraved(log_path) == 3
+
+    # rebarring the middle group without changing its length only changes its own chunk
+    edited_paths = render_chunks(split_into_chunks(_metric_group([3, 5])), cache_dir, max_workers=2,
+                                 lilypond_command=command)
+    assert _num_engraved(log_path) == 4
+    assert edited_paths[0] == pdf_paths[0] and edited_paths[2] == pdf_paths[2]
+    assert edited_paths[1] != pdf_paths[1]
+
+
+def test_chunks_continue_where_the_last_one_stopped():
+    metric_group = _metric_group([4, 4])
+    chunks = split_into_chunks(metric_group, bars_per_chunk=3)
+    assert [len(chunk.measure_durs) for chunk in chunks] == [3, 3, 1]
+    bar_start_times = metric_group.get_metric_index().bar_start_times
+    assert [chunk.start_time for chunk in chunks] == [bar_start_times[0], bar_start_times[3], bar_start_times[6]]
@@ -0,0 +1,55 @@
+import struct
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.metric_group import SimpleMetricGroup, CompositeMetricGroup
+from composing_time.tempo_map import write_tempo_map
+
+
+def _read_track(data: bytes):
+    # the (tick, meta type, meta data) events of a format 0 file's only track
+    assert data[:4] == b"MThd"
+    _, file_format, num_tracks, ppq = struct.unpack(">IHHH", data[4:14])
+    assert (file_format, num_tracks) == (0, 1) and data[14:18] == b"MTrk"
+    track_length, = struct.unpack(">I", data[18:22])
+    track = data[22:]
+    assert len(track) == track_length
+    events, pos, tick = [], 0, 0
+    while pos < len(track):
+        delta = 0
+        while True:
+            byte = track[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+            if byte < 0x80:
+                break
+        tick += delta
+        assert track[pos] == 0xFF
+        meta_type, length = track[pos + 1], track[pos + 2]
+        events.append((tick, meta_type, track[pos + 3:pos + 3 + length]))
+        pos += 3 + length
+    return ppq, events
+
+
+def test_tempo_map_follows_the_envelope(tmp_path):
+    metric_group = CompositeMetricGroup([
+        SimpleMetricGroup([4, 4, 6], TempoEnvelope(240)),
+        SimpleMetricGroup([7, 7, 5, 8], TempoEnvelope(levels=[240, 480, 300], durations=[15, 12],
+                                                      curve_shapes=[2, -1])),
+    ])
+    max_error = 0.001
+    ppq, events = _read_track(write_tempo_map(metric_group, tmp_path / "tempo.mid", max_error=max_error)
+                              .read_bytes())
+    assert events[-1] == (metric_group.total_beat_duration() * ppq // 4, 0x2F, b"")
+
+    time_signatures = [(tick * 4 // ppq, data[0], 2 ** data[1]) for tick, meta_type, data in events
+                       if meta_type == 0x58]
+    assert time_signatures == [(0, 2, 8), (8, 3, 8), (14, 7, 16), (28, 5, 16), (33, 4, 8)]
+
+    # play the tempo events back, and check the clock at every bar line
+    tempo_events = [(tick, int.from_bytes(data, "big")) for tick, meta_type, data in events if meta_type == 0x51]
+    bar_line_times = metric_group.get_metric_index().bar_line_times
+    for bar_line, expected in zip(metric_group.get_bar_line_locations(), bar_line_times):
+        bar_line_tick = bar_line * ppq // 4
+        time = sum(tempo * (min(next_tick, bar_line_tick) - tick) / ppq / 1e6 for (tick, tempo), (next_tick, _)
+                   in zip(tempo_events, tempo_events[1:] + [(bar_line_tick, None)]) if tick < bar_line_tick)
+        assert time == pytest.approx(expected, abs=max_error)
@@ -0,0 +1,28 @@
+import xml.etree.ElementTree as ET
+from clockblocks import TempoEnvelope
+from composing_time.metric_group import SimpleMetricGroup
+from composing_time.timeline import iter_timeline_svg
+
+SVG = "{http://www.w3.org/2000/svg}"
+
+
+def _draw(bar_lengths, **kwargs):
+    # at 240 16ths per minute, every 16th lasts a quarter of a second (two pixels at the default scale)
+    metric_group = SimpleMetricGroup(bar_lengths, TempoEnvelope(240))
+    return ET.fromstring("".join(iter_timeline_svg(metric_group, **kwargs)))
+
+
+def test_timestamps_keep_their_distance():
+    # bars of 3 16ths, 6 pixels apart: bucketing by 40 pixels would let labels come within 4 pixels of each other
+    root = _draw([3] * 100, min_label_spacing=40)
+    xs = [float(text.get("x")) for text in root.find(f"{SVG}g[@class='timestamp']")]
+    assert min(b - a for a, b in zip(xs, xs[1:])) >= 40
+
+
+def test_every_signature_change_is_drawn():
+    # a change of time signature every bar, too close together to label them all
+    root = _draw([3, 4] * 20, min_label_spacing=40)
+    labels = root.find(f"{SVG}g[@class='signature']")
+    marks = root.find(f"{SVG}path[@class='signature-marks']").get("d").count("M")
+    assert 0 < len(labels) < 40
+    assert len(labels) + marks == 40
@@ -0,0 +1,72 @@
+import random
+import numpy as np
+import pytest
+from clockblocks import TempoEnvelope
+from composing_time.timing import EnvelopeArrays, EnvelopeCursor, get_bar_times, beats_to_ticks, ticks_to_beats
+
+
+def _random_envelope(rng: random.Random) -> TempoEnvelope:
+    # constant, ramped, curved and stepped segments, including zero-length ones (jumps)
+    num_segments = rng.randint(1, 6)
+    levels = [rng.choice([60, 90, rng.uniform(40, 150)]) for _ in range(num_segments + 1)]
+    durations = [rng.choice([0, 0.5, 1, 3, rng.uniform(0.1, 10)]) for _ in range(num_segments)]
+    if sum(durations) == 0:
+        durations[0] = 1
+    curve_shapes = [rng.choice([0, 0, 2, -3, rng.uniform(-5, 5)]) for _ in range(num_segments)]
+    return TempoEnvelope(levels, durations, curve_shapes)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_times_at_beats_match_tempo_envelope(seed):
+    rng = random.Random(seed)
+    envelope = _random_envelope(rng)
+    # beyond the end, the envelope continues at its end level
+    beats = sorted(rng.uniform(0, envelope.end_time() + 2) for _ in range(50)) + list(envelope.times)
+    expected = [envelope.time_at_beat(beat) for beat in beats]
+    np.testing.assert_allclose(EnvelopeArrays.from_envelope(envelope).times_at_beats(beats), expected,
+                               rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_get_bar_times_matches_tempo_envelope(seed):
+    rng = random.Random(seed)
+    envelope = _random_envelope(rng)
+    bar_line_locations = [0]
+    while bar_line_locations[-1] < envelope.end_time():
+        bar_line_locations.append(bar_line_locations[-1] + rng.randint(1, 8))
+    start_times, durations = get_bar_times(bar_line_locations, envelope)
+    bar_line_times = [envelope.time_at_beat(beat) for beat in bar_line_locations]
+    np.testing.assert_allclose(start_times, bar_line_times[:-1], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(durations, np.diff(bar_line_times), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_envelope_cursor_matches_tempo_envelope(seed):
+    rng = random.Random(seed)
+    envelope = _random_envelope(rng)
+    cursor = EnvelopeCursor(envelope)
+    for _ in range(50):
+        delta = rng.choice([0, rng.uniform(0, 2)])
+        assert cursor.advance(delta) == pytest.approx(envelope.time_at_beat(cursor.beat), rel=1e-9, abs=1e-9)
+    # moving back walks back over the segments
+    beat = rng.uniform(0, cursor.beat)
+    assert cursor.advance_to(beat) == pytest.approx(envelope.time_at_beat(beat), rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_beats_at_times_matches_tempo_envelope(seed):
+    rng = random.Random(seed)
+    envelope = _random_envelope(rng)
+    envelope_arrays = EnvelopeArrays.from_envelope(envelope)
+    total_time = envelope.time_at_beat(envelope.end_time())
+    times = sorted(rng.uniform(0, total_time + 2) for _ in range(50))
+    beats = envelope_arrays.beats_at_times(times)
+    np.testing.assert_allclose(beats, [envelope.beat_at_time(time) for time in times], rtol=1e-7, atol=1e-7)
+    np.testing.assert_allclose(envelope_arrays.times_at_beats(beats), times, rtol=1e-9, atol=1e-9)
+
+
+def test_ticks():
+    assert beats_to_ticks(1) == 240
+    assert beats_to_ticks(1, 960) == 960
+    assert beats_to_ticks(1 / 3) == 80
+    assert ticks_to_beats(beats_to_ticks(2.5)) == 2.5